@@ -1,11 +1,16 @@
 import SETTINGS
 import annotated_document
 import annotation_merging
+import attribution_index
+import benchmark
 import data
 import exceptions
+import log
 import parc_reader
 import path_config
 import spans
 import test
+import token_alignment
 import token_list
+import token_store
 import utils
@@ -1,6 +1,12 @@
 import re
+import bisect
+import logging
 import parc3
 import t4k
+from itertools import izip
+
+
+LOGGER = logging.getLogger(__name__)
 
 
 class AnnotatedDocument(object):
@@ -14,18 +20,120 @@ class AnnotatedDocument(object):
 
         self.doc_id = doc_id
         self.annotations = annotations or {}
-        self.tokens = parc3.token_list.TokenList(tokens or [])
-
-        self.sentences = []
+        self._tokens = parc3.token_list.TokenList(tokens or [])
+
+        # SpanIndexes by annotation type, built when first needed.  See
+        # `get_annotation_index`.
+        self.annotation_indexes = {}
+
+        # Inserting tokens updates the sentence that receives them right
+        # away, but only records how far later sentences, and the absolute
+        # ids of later tokens, have to shift.  `pending_shifts` counts the
+        # tokens inserted into each sentence (slot 0 is for tokens inserted
+        # before the first one), and `stale_abs_ids_from` is the first token
+        # whose absolute id may be out of date.  See `sync_sentences` and
+        # `sync_token_ids`.
+        self.pending_shifts = None
+        self.stale_abs_ids_from = None
+
+        # Absolute index of each sentence's first token, in sentence order, so
+        # that sentences can be found by bisection.
+        self._sentences = []
+        self._sentence_starts = []
         if sentences is not None:
             for sentence in sentences:
                 self.add_sentence(sentence)
 
 
+    def __getstate__(self):
+        # Annotation indexes are rebuilt on demand rather than pickled.
+        self.sync_sentences()
+        self.sync_token_ids()
+        state = dict(self.__dict__)
+        state['annotation_indexes'] = {}
+        return state
+
+
+    @property
+    def tokens(self):
+        self.sync_token_ids()
+        return self._tokens
+
+
+    @tokens.setter
+    def tokens(self, tokens):
+        self.stale_abs_ids_from = None
+        self._tokens = tokens
+
+
+    @property
+    def sentences(self):
+        self.sync_sentences()
+        return self._sentences
+
+
+    @property
+    def sentence_starts(self):
+        self.sync_sentences()
+        return self._sentence_starts
+
+
+    def sync_sentences(self):
+        """
+        Shift the token spans of sentences for the insertions recorded in
+        `pending_shifts`.
+        """
+        if self.pending_shifts is None:
+            return
+        for sentence_id, sentence in enumerate(self._sentences):
+            start, end = self.get_sentence_range(sentence_id)
+            sentence['token_span'].replace_with_trusted([(None, start, end)])
+            self._sentence_starts[sentence_id] = start
+        self.pending_shifts = None
+
+
+    def sync_token_ids(self):
+        """Renumber the absolute ids of tokens that insertions shifted."""
+        if self.stale_abs_ids_from is None:
+            return
+        tokens = self._tokens
+        for abs_id in xrange(self.stale_abs_ids_from, len(tokens)):
+            tokens[abs_id]['abs_id'] = abs_id
+        self.stale_abs_ids_from = None
+
+
+    def compact_tokens(self):
+        """
+        Move the document's tokens into a columnar TokenStore.  Tokens are
+        then handed out as TokenViews, which behave like the token dicts.
+
+        This is opt-in, and best done once a document's tokens are final:
+        a TokenView addresses a position, so a token held across an insertion
+        no longer refers to the same token, as a dict would.
+        """
+        self.tokens = parc3.token_store.TokenStore(self.tokens)
+
+
+    def flatten_constituents(self, keep_constituents=False):
+        """
+        Encode each sentence's constituency tree as a FlatConstituencyTree,
+        stored under the sentence's 'flat_tree' key.  Unless
+        `keep_constituents` is True, the nested constituents are then dropped.
+        """
+        for sentence_id, sentence in enumerate(self.sentences):
+            if 'constituent_children' not in sentence:
+                continue
+            sentence['flat_tree'] = (
+                parc3.spans.FlatConstituencyTree.from_constituency(
+                    sentence, sentence_id))
+            if not keep_constituents:
+                del sentence['constituent_children']
+
+
     def add_token(self, token):
-        abs_id = len(self.tokens)
+        abs_id = len(self._tokens)
         token['abs_id'] = abs_id
-        self.tokens.append(token)
+        self._tokens.append(token)
         return abs_id
 
 
@@ -35,15 +143,18 @@ class AnnotatedDocument(object):
         if 'token_span' not in sentence:
             raise ValueError("`sentence['token_span']` must be TokenSpan-like")
         sentence = parc3.spans.Span(sentence, absolute=True)
+        self.sync_sentences()
         self.validate_sentence_span(sentence)
 
         # Add the sentence
-        sentence_id = len(self.sentences)
+        sentence_id = len(self._sentences)
         sentence['id'] = sentence_id
-        self.sentences.append(sentence)
+        self._sentences.append(sentence)
+        self._sentence_starts.append(sentence['token_span'][0][1])
 
         # Add sentence-relative ids to the tokens for this sentence
         self.write_relative_token_ids_in_sentence(sentence_id)
+        self.invalidate_annotation_indexes()
 
 
     def validate_sentence_span(self, sentence):
@@ -72,33 +183,137 @@ class AnnotatedDocument(object):
                 )
 
 
-    def get_sentence_tokens(self, sentence_id):
-        if self.sentences is None:
-            raise ValueError(
-                'This annotated document has no sentence information')
-        return self.get_tokens_abs(self.sentences[sentence_id])
-
-
-    def get_tokens_abs(self, span):
+    def get_annotation_index(self, annotation_type):
+        """
+        Return the SpanIndex of the annotations of `annotation_type`.  It is
+        built on first use, and kept up to date as tokens are inserted.  It
+        is rebuilt if the annotations are replaced, or if annotations are
+        added or removed.  Changing the token spans of existing annotations in
+        any other way requires calling `invalidate_annotation_indexes`.
+        """
+        annotations = self.annotations[annotation_type]
+        cached = self.annotation_indexes.get(annotation_type)
+        if (
+            cached is None or cached[0] is not annotations
+            or cached[1] != len(annotations)
+        ):
+            index = parc3.spans.SpanIndex(self, annotations)
+            cached = (annotations, len(annotations), index)
+            self.annotation_indexes[annotation_type] = cached
+        return cached[2]
+
+
+    def invalidate_annotation_indexes(self):
+        self.annotation_indexes = {}
+
+
+    def get_overlapping_annotations(
+        self, annotation_type, sentence_id, start, end
+    ):
+        """
+        Return the IDs of annotations of `annotation_type` having tokens
+        among tokens `[start, end)` of the sentence, in order of where they
+        first overlap.
+        """
+        index = self.get_annotation_index(annotation_type)
+        found = []
+        seen = set()
+        for annotation_id, role in index.overlapping(sentence_id, start, end):
+            if annotation_id not in seen:
+                seen.add(annotation_id)
+                found.append(annotation_id)
+        return found
+
+
+    def get_covering_annotations(self, annotation_type, sentence_id, token_id):
+        """
+        Return the IDs of annotations of `annotation_type` that include token
+        `token_id` of the sentence.
+        """
+        return self.get_overlapping_annotations(
+            annotation_type, sentence_id, token_id, token_id + 1)
+
+
+    def get_sentence_tokens(self, sentence_id, view=False):
+        """
+        Return a TokenList of the sentence's tokens, or a TokenListView if
+        `view` is True.  See `get_tokens`.
+        """
+        return self.select_tokens(
+            [self.get_sentence_range(sentence_id)], view)
+
+
+    def get_tokens_abs(self, span, view=False):
         span = self.span_or_token_span(span)
-        selected = parc3.token_list.TokenList()
-        for _, start, end in span:
-            selected.extend(self.tokens[start:end])
-        return selected
-
+        return self.select_tokens(
+            [(start, end) for _, start, end in span], view)
 
-    def get_tokens(self, span):
 
-        # We can only do this if the document has sentences defined
-        if self.sentences is None:
-            raise ValueError(
-                'This annotated document has no sentence information')
+    def get_tokens(self, span, view=False):
+        """
+        Return a TokenList of the tokens in a sentence-relative span (or in a
+        Span's token span).
 
+        If `view` is True, return a TokenListView instead, which reads the
+        document's tokens in place rather than copying them into a new list.
+        A view addresses tokens by position, so after more tokens are
+        inserted it points at different tokens; it's meant for reading tokens
+        right away.
+        """
         span = self.span_or_token_span(span)
-        selected = parc3.token_list.TokenList()
+        ranges = []
         for sentence_id, start, stop in span:
-            selected.extend(self.get_sentence_tokens(sentence_id)[start:stop])
-        return selected
+            sent_start, sent_end = self.get_sentence_range(sentence_id)
+            ranges.append(
+                (sent_start + start, min(sent_start + stop, sent_end)))
+        return self.select_tokens(ranges, view)
+
+
+    def select_tokens(self, ranges, view=False):
+        """
+        Return the tokens in absolute `(start, end)` ranges, as a TokenList,
+        or as a TokenListView if `view` is True.
+        """
+        token_view = parc3.token_list.TokenListView(self.tokens, ranges)
+        if view:
+            return token_view
+        return parc3.token_list.TokenList(token_view)
+
+
+    def get_sentence_range(self, sentence_id):
+        """Absolute start and end of a sentence."""
+        _, sent_start, sent_end = self._sentences[sentence_id]['token_span'][0]
+        if self.pending_shifts is not None:
+            sent_start += self.pending_shifts.prefix_sum(sentence_id + 1)
+            sent_end += self.pending_shifts.prefix_sum(sentence_id + 2)
+        return sent_start, sent_end
+
+
+    def get_sentence_start(self, sentence_id):
+        start = self._sentence_starts[sentence_id]
+        if self.pending_shifts is not None:
+            start += self.pending_shifts.prefix_sum(sentence_id + 1)
+        return start
+
+
+    def bisect_sentence_starts(self, abs_index, right=True):
+        """
+        Bisect the starts of the sentences for `abs_index`, like
+        `bisect.bisect_right` (or `bisect.bisect_left` unless `right`).
+        """
+        if self.pending_shifts is None:
+            bisect_starts = bisect.bisect_right if right else bisect.bisect_left
+            return bisect_starts(self._sentence_starts, abs_index)
+
+        low, high = 0, len(self._sentences)
+        while low < high:
+            middle = (low + high) / 2
+            start = self.get_sentence_start(middle)
+            if start < abs_index or (right and start == abs_index):
+                low = middle + 1
+            else:
+                high = middle
+        return low
 
 
     def span_or_token_span(self, span):
@@ -110,6 +325,10 @@ class AnnotatedDocument(object):
 
 
     def relativize(self, token_ranges):
+        """
+        Convert absolute token ranges to sentence-relative ones.  Ranges that
+        cross sentence boundaries are split into one range per sentence.
+        """
         new_token_ranges = []
 
         for token_range in token_ranges:
@@ -118,32 +337,28 @@ class AnnotatedDocument(object):
             if dummy_sentence_id is not None:
                 ValueError('Cannot relativize token range: already relative.')
 
-            successfully_relativized_range = False
-
-            for sentence_id, sentence in enumerate(self.sentences):
-
-                _, sent_start, sent_end = sentence['token_span'][0]
-
-                if start >= sent_start and start < sent_end:
-                    if end <= sent_end:
-                        new_token_ranges.append((
-                            sentence_id,
-                            start - sent_start,
-                            end - sent_start
-                        ))
-                        successfully_relativized_range = True
-                    else:
-                        new_token_ranges.extend(self.relativize([
-                            (None, start, sent_end), (None, sent_end, end)
-                        ]))
-                        successfully_relativized_range = True
-
-                if sent_start >= end:
-                    break
-
-            if not successfully_relativized_range:
-                raise ValueError(
-                    'Could not relativize %s' % str(token_range))
+            # Find the sentence containing the start of the range, then
+            # take the range a sentence at a time.
+            sentence_id = self.bisect_sentence_starts(start) - 1
+            while start < end:
+
+                if sentence_id < 0 or sentence_id >= len(self._sentences):
+                    raise ValueError(
+                        'Could not relativize %s' % str(token_range))
+
+                sent_start, sent_end = self.get_sentence_range(sentence_id)
+                if start >= sent_end:
+                    raise ValueError(
+                        'Could not relativize %s' % str(token_range))
+
+                stop = min(end, sent_end)
+                new_token_ranges.append((
+                    sentence_id,
+                    start - sent_start,
+                    stop - sent_start
+                ))
+                start = stop
+                sentence_id += 1
 
         return new_token_ranges
 
@@ -157,14 +372,99 @@ class AnnotatedDocument(object):
             if not isinstance(sentence_id, int):
                 ValueError('Cannot relativize token range: already relative.')
 
-            sentence = self.sentences[sentence_id]
-            _, sent_start, sent_end = sentence['token_span'][0]
+            sent_start, sent_end = self.get_sentence_range(sentence_id)
             new_token_ranges.append((
                 None, start + sent_start, end + sent_start))
 
         return new_token_ranges
 
 
+    def get_sentence_offsets(self):
+        """Lists of the absolute starts and ends of the sentences."""
+        self.sync_sentences()
+        sent_ends = [
+            sentence['token_span'][0][2] for sentence in self._sentences]
+        return list(self._sentence_starts), sent_ends
+
+
+    def relativize_spans(self, token_spans):
+        """
+        Convert absolute token spans to sentence-relative addressing, all in
+        one pass.  The ranges of all the spans are gathered into flat arrays
+        and converted against the sentence offsets, which are worked out once
+        rather than for each range.  Nothing is converted if any range can't
+        be.  See `parc3.spans.TokenSpanBase.replace_with_converted` for how
+        the results are written back.
+        """
+        token_spans = list(token_spans)
+        for token_span in token_spans:
+            if not token_span.absolute:
+                raise ValueError(
+                    'Cannot relativize TokenSpan: already relative.')
+
+        owners, _, starts, ends = parc3.spans.flatten_token_spans(token_spans)
+        sent_starts, sent_ends = self.get_sentence_offsets()
+        num_sentences = len(sent_starts)
+
+        converted = [[] for token_span in token_spans]
+        for owner, start, end in izip(owners, starts, ends):
+            new_token_ranges = converted[owner]
+            token_range = (None, start, end)
+
+            # Take the range a sentence at a time, starting from the sentence
+            # containing its start.
+            sentence_id = bisect.bisect_right(sent_starts, start) - 1
+            while start < end:
+                if (
+                    sentence_id < 0 or sentence_id >= num_sentences
+                    or start >= sent_ends[sentence_id]
+                ):
+                    raise ValueError(
+                        'Could not relativize %s' % str(token_range))
+                sent_start = sent_starts[sentence_id]
+                stop = min(end, sent_ends[sentence_id])
+                new_token_ranges.append(
+                    (sentence_id, start - sent_start, stop - sent_start))
+                start = stop
+                sentence_id += 1
+
+        for token_span, new_token_ranges in izip(token_spans, converted):
+            token_span.replace_with_converted(new_token_ranges, absolute=False)
+
+
+    def absolutize_spans(self, token_spans):
+        """
+        Convert sentence-relative token spans to absolute addressing, all in
+        one pass.  Works like `relativize_spans`.  Ranges at the end of one
+        sentence and the start of the next become adjacent, and are merged.
+        """
+        token_spans = list(token_spans)
+        for token_span in token_spans:
+            if token_span.absolute:
+                raise ValueError(
+                    'Cannot absolutize TokenSpan: already absolute.')
+
+        owners, sentence_ids, starts, ends = parc3.spans.flatten_token_spans(
+            token_spans)
+        sent_starts, _ = self.get_sentence_offsets()
+
+        converted = [[] for token_span in token_spans]
+        for owner, sentence_id, start, end in izip(
+            owners, sentence_ids, starts, ends
+        ):
+            new_token_ranges = converted[owner]
+            sent_start = sent_starts[sentence_id]
+            start, end = start + sent_start, end + sent_start
+            if new_token_ranges and start <= new_token_ranges[-1][2]:
+                _, last_start, last_end = new_token_ranges[-1]
+                new_token_ranges[-1] = (None, last_start, max(last_end, end))
+            else:
+                new_token_ranges.append((None, start, end))
+
+        for token_span, new_token_ranges in izip(token_spans, converted):
+            token_span.replace_with_converted(new_token_ranges, absolute=True)
+
+
     def merge_tokens(
         self,
         other,
@@ -177,112 +477,197 @@ class AnnotatedDocument(object):
         for annotation in copy_annotations:
             self.annotations[annotation] = other.annotations[annotation]
 
-        self_token_pointer = 0
-        for other_token_pointer, other_token in enumerate(other.tokens):
-
-            try:
-                self_token = self.tokens[self_token_pointer]
-            except IndexError:
-                if other_token['text'] == '.':
-                    continue
-                raise
-
-            self_text, other_text = self_token['text'], other_token['text']
-            print self_text, other_text
-
-            # Skip the stray apostraphe in doc 63.
-            if self.doc_id == 63:
-                if self_token['abs_id'] == 291:
-                    continue
-            
-            force_same_token = False
-            if self.doc_id == 2201:
-                if self_token['abs_id'] == 890:
-                    other_text = self_text
-                    force_same_token = True
-
-            # If they are the same token, merge the annotations
-            if is_same_token(self_text, other_text) or force_same_token:
-                self_token.update(t4k.select(other_token, copy_token_fields))
-
-            # If the new token is a subset of the existing token, split
-            # the existing token
-            elif startswith(self_text, other_text):
-                prefix, postfix = match_split(self_text, other_text)
-                print (
-                    '\t\tdoc #%d, token %d, splitting "%s" into "%s" and "%s"'
-                    % (
-                        self.doc_id, self_token['abs_id'], self_text,
-                        prefix, postfix
-                    )
-                )
-                self_token, remainder = self.split_token(self_token, other_text)
-                self_token.update(t4k.select(other_token, copy_token_fields))
+        # Align the two tokenizations, then copy fields onto each token from
+        # the tokens that it aligns to.  A token that aligns to several other
+        # tokens is split, and the splits are applied in one batch at the end.
+        alignments = parc3.token_alignment.align_tokens(
+            [token['text'] for token in self.tokens],
+            [token['text'] for token in other.tokens]
+        )
+
+        # Splits are logged at INFO when `verbose`, and otherwise at DEBUG.
+        split_level = logging.INFO if verbose else logging.DEBUG
+        insertions = []
+        for abs_index, alignment in enumerate(alignments):
+            if not alignment:
+                parc3.log.count('tokens_unaligned')
+                continue
 
-            elif self_text == other.tokens[other_token_pointer+1]['text']:
+            self_token = self.tokens[abs_index]
+            if len(alignment) == 1:
+                other_index, _, _ = alignment[0]
+                self_token.update(t4k.select(
+                    other.tokens[other_index], copy_token_fields))
                 continue
 
-            else:
-                raise ValueError(
-                    '\t\tdoc #%d, token %d, expecting "%s" got "%s"'
-                    % (self.doc_id,self_token['abs_id'],self_text,other_text)
+            # Each piece is cut from this token's own text, so the document's
+            # text is unchanged by the split.
+            self_text = self_token['text']
+            pieces = [
+                (self_text[start:end], other.tokens[other_index])
+                for other_index, start, end in alignment
+            ]
+
+            parc3.log.count('tokens_split')
+            if LOGGER.isEnabledFor(split_level):
+                LOGGER.log(
+                    split_level,
+                    'doc #%s, token %d, splitting "%s" into %s',
+                    self.doc_id, abs_index, self_text,
+                    ', '.join(['"%s"' % text for text, _ in pieces])
                 )
 
-            self_token_pointer += 1
+            original_token = dict(self_token)
+            for i, (piece_text, other_token) in enumerate(pieces):
+                if i == 0:
+                    piece = self_token
+                    piece['text'] = piece_text
+                else:
+                    piece = dict(original_token, text=piece_text)
+                    insertions.append((abs_index + 1, piece))
+                piece.update(t4k.select(other_token, copy_token_fields))
 
+        self.insert_tokens(insertions)
 
-    def split_token(self, token, partial_text):
 
+    def split_token(self, token, partial_text):
+        """
+        Split `token` so that it keeps only `partial_text`, and insert a new
+        token holding the rest of its text right after it.
+        """
+        # The token may be held from before an earlier insertion, so its
+        # absolute id has to be brought up to date.
+        self.sync_token_ids()
         abs_index = token['abs_id'] + 1
-
-        prefix, postfix = match_split(token['text'], partial_text)
-
-        token['text'] = partial_text
-        remainder_token = dict(token, text=postfix)
+        token, remainder_token = divide_token(token, partial_text)
         self.insert_token(abs_index, remainder_token)
 
         return token, remainder_token
 
 
-    def insert_token(self, abs_index, token):
-
-        # Insert the new token in the global tokens list
-        self.tokens.insert(abs_index, token)
+    def split_tokens(self, splits):
+        """
+        Batched version of `split_token`.  Takes `(token, partial_text)` pairs,
+        for distinct tokens, and inserts all of the remainder tokens at once.
+        Returns the list of `(token, remainder_token)` pairs.
+        """
+        self.sync_token_ids()
+        split_tokens = []
+        insertions = []
+        for token, partial_text in splits:
+            abs_index = token['abs_id'] + 1
+            token, remainder_token = divide_token(token, partial_text)
+            insertions.append((abs_index, remainder_token))
+            split_tokens.append((token, remainder_token))
 
-        # Rewrite all the token ids to restore unique compact incrementing ids
-        self.write_token_ids()
+        self.insert_tokens(insertions)
+        return split_tokens
 
-        insertion_point = [
-            abs_index,
-            token.get('sentence_id', None),
-            token.get('id', None)
-        ]
 
-        # Posibly adjust sentences
-        if self.sentences:
-            for sentence in self.sentences:
-                sentence.accomodate_inserted_token(*insertion_point)
+    def insert_token(self, abs_index, token):
+        self.insert_tokens([(abs_index, token)])
+
+
+    def insert_tokens(self, insertions):
+        """
+        Insert several tokens at once.  Takes `(abs_index, token)` pairs, and
+        places each token just before the token that is at `abs_index` before
+        any of the insertions are made.  Tokens sharing an `abs_index` keep
+        their order.  A token inserted between two sentences joins the earlier
+        one.
+
+        Tokens are renumbered, and sentences and annotations are shifted, once
+        for the whole batch.  The result is the same as calling `insert_token`
+        for each pair, going from the last insertion point to the first.
+
+        Annotations are shifted right away, but the absolute ids of later
+        tokens and the token spans of later sentences are only brought up to
+        date when `tokens` or `sentences` is next read.  Token dicts and
+        sentence Spans held from before the insertion keep their old
+        positions until then, so read them through the document again rather
+        than keeping them across insertions.
+        """
+        insertions = sorted(insertions, key=lambda insertion: insertion[0])
+        if len(insertions) == 0:
+            return
+
+        # Work out where each token goes, in absolute and sentence-relative
+        # terms.
+        points = []
+        for abs_index, token in insertions:
+            sentence_id = self.bisect_sentence_starts(abs_index, False) - 1
+            if sentence_id < 0:
+                points.append((abs_index, None, None))
+            else:
+                rel_index = abs_index - self.get_sentence_start(sentence_id)
+                points.append((abs_index, sentence_id, rel_index))
+        insertion_points = parc3.spans.InsertionPoints(points)
+
+        # Insert the new tokens in the global tokens list.  Going backwards
+        # keeps the insertion points valid.
+        for abs_index, token in reversed(insertions):
+            self._tokens.insert(abs_index, token)
+
+        # Record how far the sentences shift, rather than shifting all of
+        # them now.
+        changed_sentence_ids = set()
+        if self._sentences:
+            if self.pending_shifts is None:
+                self.pending_shifts = parc3.utils.FenwickTree(
+                    len(self._sentences) + 1)
+            for _, sentence_id, _ in points:
+                slot = 0 if sentence_id is None else sentence_id + 1
+                self.pending_shifts.add(slot, 1)
+                if sentence_id is not None:
+                    changed_sentence_ids.add(sentence_id)
+
+        # Absolute ids are renumbered when tokens are next handed out.  Only
+        # the sentences that received tokens need relative ids rewritten.
+        first_stale = insertions[0][0]
+        if self.stale_abs_ids_from is not None:
+            first_stale = min(first_stale, self.stale_abs_ids_from)
+        self.stale_abs_ids_from = first_stale
+        for sentence_id in changed_sentence_ids:
+            self.write_relative_token_ids_in_sentence(sentence_id)
 
-        # Adjust annotations
+        # Adjust annotations, and the indexes over them.  Every annotation is
+        # visited, so this part costs in proportion to the whole document's
+        # annotations, not just those in the sentences that changed.
         for annotation_type in self.annotations:
             for annotation in self.annotations[annotation_type].values():
-                annotation.accomodate_inserted_token(*insertion_point)
+                annotation.accomodate_inserted_tokens(insertion_points)
+        for _, _, index in self.annotation_indexes.values():
+            index.accomodate_inserted_tokens(insertion_points)
 
 
     def write_relative_token_ids_in_sentence(self, sentence_id):
-        for token_id, token in enumerate(self.get_sentence_tokens(sentence_id)):
+        start, end = self.get_sentence_range(sentence_id)
+        tokens = self._tokens
+        for token_id in xrange(end - start):
+            token = tokens[start + token_id]
             token['id'] = token_id
             token['sentence_id'] = sentence_id
 
 
     def write_token_ids(self):
-        for abs_id, token in enumerate(self.tokens):
-            token['abs_id'] = abs_id
-        for sentence_id in range(len(self.sentences)):
+        self.stale_abs_ids_from = 0
+        self.sync_token_ids()
+        for sentence_id in range(len(self._sentences)):
             self.write_relative_token_ids_in_sentence(sentence_id)
 
 
 
+def divide_token(token, partial_text):
+    """
+    Cut `token` down to `partial_text`, and make a copy of it holding the rest
+    of its text.  The copy is not added to any document.
+    """
+    prefix, postfix = match_split(token['text'], partial_text)
+    token['text'] = partial_text
+    remainder_token = dict(token, text=postfix)
+    return token, remainder_token
+
+
 def match_split(text1, text2):
     text1_ = text1.replace("`", "'")
     text2_ = text2.replace("`", "'")
@@ -3,10 +3,20 @@ import os
 import re
 import t4k
 import copy
+import bisect
+import hashlib
 import bs4
+import itertools
+import json
+import logging
+import mmap
+import multiprocessing
+import tempfile
 from collections import defaultdict, Counter
 
 
+LOGGER = logging.getLogger(__name__)
+
 BNP_PRONOUNS_PATH = os.path.join(
     parc3.SETTINGS.BNP, 'data', 'BBN-wsj-pronouns', 'WSJ.pron')
 BNP_SENTENCES_PATH = os.path.join(
@@ -15,60 +25,234 @@ BBN_ENTITY_TYPES_DIR = os.path.join(
     parc3.SETTINGS.BNP, 'data', 'WSJtypes-subtypes')
 PROPBANK_PATH = os.path.join(parc3.SETTINGS.PROPBANK, 'data', 'vloc.txt')
 
+# Offset indexes for the BNP files are cached here, rather than beside the
+# (possibly read-only) corpus files.
+OFFSET_INDEX_CACHE_DIR = os.path.join(
+    parc3.SETTINGS.DATA_DIR, 'offset-index-cache')
+
 def read_bnp_pronoun_dataset(
     subset='all',
     skip=None,
-    limit=None
+    limit=None,
+    processes=1,
+    chunksize=1,
+    **sources
+):
+    return dict(iter_bnp_pronoun_dataset(
+        subset, skip, limit, processes, chunksize, **sources))
+
+
+def iter_bnp_pronoun_dataset(
+    subset='all',
+    skip=None,
+    limit=None,
+    processes=1,
+    chunksize=1,
+    **sources
+):
+    """
+    Yields `(doc_id, doc)` pairs, in order of doc_id, for documents having
+    coreference, entity, and attribution annotations merged together with
+    propbank verbs.
+
+    Each annotation source is read as a stream of documents in order of
+    doc_id, and each document is merged and yielded as soon as all of its
+    parts have been read, so only about one document from each source is held
+    in memory at a time.
+
+    By default documents are merged in this process.  Setting `processes` to
+    anything other than 1 merges them in a pool of that many worker processes
+    (`None` uses one per cpu), each taking `chunksize` documents at a time.
+    Documents are still yielded in order.  A document that can't be merged in
+    a worker is reported and skipped, like a document with missing parts.
+
+    Any other keyword arguments choose where the annotations are read from;
+    see `iter_bnp_doc_parts`.
+    """
+    doc_parts = iter_bnp_doc_parts(subset, skip, limit, **sources)
+
+    if processes == 1:
+        for doc_id, parts in doc_parts:
+            yield doc_id, merge_bnp_doc(*parts)
+        return
+
+    # Hand documents to the pool a window at a time; `imap` would otherwise
+    # read every document in ahead of the workers.
+    window_size = (processes or multiprocessing.cpu_count()) * chunksize * 2
+    pool = multiprocessing.Pool(processes)
+    try:
+        while True:
+            window = list(itertools.islice(doc_parts, window_size))
+            if not window:
+                break
+            merged_docs = pool.imap(try_merge_bnp_doc, window, chunksize)
+            for doc_id, doc, error, counts in merged_docs:
+                parc3.log.add_counts(counts)
+                if doc is None:
+                    parc3.log.count('docs_failed')
+                    LOGGER.warning(
+                        'Could not create doc_id %d: %s', doc_id, error)
+                    continue
+                yield doc_id, doc
+        pool.close()
+
+    # Don't leave workers behind if iteration is abandoned early.
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def iter_bnp_doc_parts(
+    subset='all',
+    skip=None,
+    limit=None,
+    pronouns_path=BNP_PRONOUNS_PATH,
+    sentences_path=BNP_SENTENCES_PATH,
+    entity_types_dir=BBN_ENTITY_TYPES_DIR,
+    propbank_path=PROPBANK_PATH,
+    parc_docs=None
 ):
+    """
+    Yields `(doc_id, parts)` pairs, where `parts` holds a document's
+    coreference, attribution, and entity annotated docs, and its propbank
+    verbs, ready to be passed to `merge_bnp_doc`.
+
+    The annotations are read from the files at the given paths.  Attribution
+    annotated docs are read with `parc3.data.iter_parc_docs`, unless
+    `parc_docs` gives another iterable of `(doc_id, doc)` pairs, in order of
+    doc_id, to take them from.
+    """
 
-    # Read in coreference, entity, and attribution annotations from disk
-    coreference_annotated_docs = read_coreference_annotations(
-        subset=subset, skip=skip, limit=limit)
-    entity_annotated_docs = read_bbn_entity_types(limit=limit)
-    attributions_by_doc = parc3.data.read_all_parc_files(
-        subset=subset, skip=skip, limit=limit)
-    propbank_verbs_by_doc = read_propbank_verbs()
-
-    # Prepare to iterate over all docs, combine the three anotation sources for
-    # each, and save them in a dictionary.
-    merged_annotated_docs = {}
-    seen_docs = set()
-    expected_docs = list(
-        parc3.data.iter_doc_num(subset, skip, limit))
-    for doc_id in expected_docs:
+    # Open streams of coreference, entity, and attribution annotations, and
+    # propbank verbs.  Propbank verbs can be missing for a doc.
+    if parc_docs is None:
+        parc_docs = parc3.data.iter_parc_docs(
+            subset=subset, skip=skip, limit=limit)
+    coreference_annotated_docs = DocStream(iter_coreference_annotations(
+        pronouns_path, subset=subset, skip=skip, limit=limit,
+        sentences_path=sentences_path
+    ))
+    entity_annotated_docs = DocStream(
+        iter_bbn_entity_types(entity_types_dir, limit=limit, skip=skip))
+    attributions_by_doc = DocStream(parc_docs)
+    propbank_verbs_by_doc = DocStream(
+        iter_propbank_verbs(propbank_path), default=[])
+
+    # Iterate over all docs, and collect the annotation sources for each.
+    for doc_id in parc3.data.iter_doc_num(subset, skip, limit):
 
         # Annotations could be missing for any given doc.  Just step over it.
         try:
-            coreference_annotated_doc = coreference_annotated_docs[doc_id]
-            attribution_annotated_doc = attributions_by_doc[doc_id]
-            entity_annotated_doc = entity_annotated_docs[doc_id]
-            propbank_verbs = propbank_verbs_by_doc[doc_id]
+            coreference_annotated_doc = coreference_annotated_docs.seek(doc_id)
+            attribution_annotated_doc = attributions_by_doc.seek(doc_id)
+            entity_annotated_doc = entity_annotated_docs.seek(doc_id)
+            propbank_verbs = propbank_verbs_by_doc.seek(doc_id)
         except KeyError:
-            print 'Could not create doc_id %d' % doc_id
+            parc3.log.count('docs_skipped')
+            LOGGER.info('Could not create doc_id %d', doc_id)
             continue
 
-        # Merge entity-type annotations with coreference annotations.
-        coreference_annotated_doc.merge_tokens(
-            entity_annotated_doc,
-            copy_token_fields=['entity'],
-            copy_annotations=['entities'],
-            verbose=True
+        yield doc_id, (
+            coreference_annotated_doc, attribution_annotated_doc,
+            entity_annotated_doc, propbank_verbs
         )
 
-        # Merge the parc-derived annotations (attribution, constituency parse,
-        # and part-of-speech (POS)) with the other annotations.
-        attribution_annotated_doc.merge_tokens(
-            coreference_annotated_doc,
-            copy_token_fields=['entity'],
-            copy_annotations=['entities', 'coreferences']
-        )
 
-        merge_propbank_verbs(attribution_annotated_doc, propbank_verbs)
+def merge_bnp_doc(
+    coreference_annotated_doc,
+    attribution_annotated_doc,
+    entity_annotated_doc,
+    propbank_verbs
+):
+    """
+    Merge one document's annotations into `attribution_annotated_doc`, and
+    return it.
+    """
+
+    # Merge entity-type annotations with coreference annotations.
+    coreference_annotated_doc.merge_tokens(
+        entity_annotated_doc,
+        copy_token_fields=['entity'],
+        copy_annotations=['entities'],
+        verbose=True
+    )
+
+    # Merge the parc-derived annotations (attribution, constituency parse,
+    # and part-of-speech (POS)) with the other annotations.
+    attribution_annotated_doc.merge_tokens(
+        coreference_annotated_doc,
+        copy_token_fields=['entity'],
+        copy_annotations=['entities', 'coreferences']
+    )
+
+    merge_propbank_verbs(attribution_annotated_doc, propbank_verbs)
+
+    return attribution_annotated_doc
+
+
+def try_merge_bnp_doc(args):
+    """
+    Merges a document as `merge_bnp_doc` does, but returns errors instead of
+    raising them, so that one bad document doesn't stop a pool of workers.
+    Takes a single `(doc_id, parts)` tuple, and returns a `(doc_id, doc,
+    error, counts)` tuple, where either `doc` or `error` is None, and `counts`
+    holds what was added to the counters in `parc3.log` while merging, so
+    that they can be carried back out of a worker.
+    """
+    doc_id, parts = args
+    counts_before = Counter(parc3.log.get_counts())
+    try:
+        doc, error = merge_bnp_doc(*parts), None
+    except Exception as exception:
+        doc, error = None, '%s: %s' % (type(exception).__name__, exception)
+    counts = Counter(parc3.log.get_counts())
+    counts.subtract(counts_before)
+    counts = {name: amount for name, amount in counts.items() if amount}
+    return doc_id, doc, error, counts
+
+
+
+class DocStream(object):
+    """
+    Reads documents on demand from an iterable of `(doc_id, doc)` pairs that
+    is ordered by doc_id.  Calling `seek(doc_id)` reads ahead to that doc and
+    hands it over, dropping any docs before it, so that docs are held only
+    until they are asked for.  Each doc can be sought only once.
+    """
+
+    NOT_GIVEN = object()
+
+    def __init__(self, docs, default=NOT_GIVEN):
+        self.docs = iter(docs)
+        self.default = default
+        self.doc_id = None
+        self.doc = None
 
-        merged_annotated_docs[doc_id] = attribution_annotated_doc
-        seen_docs.add(doc_id)
 
-    return merged_annotated_docs
+    def seek(self, doc_id):
+        """
+        Return the doc having `doc_id`.  If there is none, return the default,
+        or raise KeyError if no default was given.
+        """
+        while self.doc_id is None or self.doc_id < doc_id:
+            try:
+                next_doc_id, next_doc = next(self.docs)
+            except StopIteration:
+                break
+            if self.doc_id is not None and next_doc_id <= self.doc_id:
+                raise ValueError(
+                    'Documents must be in order of doc_id, but doc %d came '
+                    'after doc %d.' % (next_doc_id, self.doc_id)
+                )
+            self.doc_id, self.doc = next_doc_id, next_doc
+
+        if self.doc_id != doc_id:
+            if self.default is self.NOT_GIVEN:
+                raise KeyError(doc_id)
+            return self.default
+
+        doc, self.doc = self.doc, None
+        return doc
 
 
 
@@ -82,10 +266,11 @@ def merge_propbank_verbs(annotated_doc, propbank_verbs):
 
     This works by mutating annotated_doc.
     """
+    matcher = PropbankVerbMatcher(annotated_doc)
     propbank_verb_tokens = {}
     for verb_id, (sentence_id, token_id, lemma) in enumerate(propbank_verbs):
-        token = find_nearest_matching_token(
-            annotated_doc, sentence_id, token_id, lemma)
+        token = matcher.find_nearest_matching_token(
+            sentence_id, token_id, lemma)
 
         # It may not be possible to find a match.  Just keep going if so.
         if token is None: 
@@ -101,7 +286,6 @@ def merge_propbank_verbs(annotated_doc, propbank_verbs):
     annotated_doc.annotations['propbank_verbs'] = propbank_verb_tokens
 
 
-# TODO: compress this functionality.
 MAX_TOKEN_EXACT_MATCH_DISTANCE = 50
 MAX_TOKEN_NEAR_MATCH_DISTANCE = 10
 def find_nearest_matching_token(annotated_doc, sentence_id, token_id, lemma):
@@ -110,12 +294,8 @@ def find_nearest_matching_token(annotated_doc, sentence_id, token_id, lemma):
     `annotated_doc`.  First, look for an exact match.  If none is found, accept
     the closest match (in terms of number of characters in common overlap).
     """
-    try:
-        return find_nearest_exact_matching_token(
-            annotated_doc, sentence_id, token_id, lemma)
-    except ValueError:
-        return find_closest_near_matching_token(
-            annotated_doc, sentence_id, token_id, lemma)
+    return PropbankVerbMatcher(annotated_doc).find_nearest_matching_token(
+        sentence_id, token_id, lemma)
 
 
 def character_overlap(str1, str2):
@@ -132,54 +312,9 @@ def find_nearest_exact_matching_token(
     token_id,
     lemma
 ):
+    return PropbankVerbMatcher(annotated_doc).find_nearest_exact_matching_token(
+        sentence_id, token_id, lemma)
 
-    # Absolutize the location that we're expecting the token
-    absolute_token_id = annotated_doc.absolutize(
-        [(sentence_id, token_id, token_id+1)]
-    )[0][1]
-
-    token_found = False
-    distance = 0
-    while not token_found and distance <= MAX_TOKEN_EXACT_MATCH_DISTANCE:
-
-        if distance == 6:
-            print annotated_doc.doc_id
-            print lemma
-            print annotated_doc.get_sentence_tokens(sentence_id).text()
-        try:
-            check_token_id = absolute_token_id + distance
-            found_lemma = annotated_doc.tokens[check_token_id]['lemma']
-            if parc3.annotated_document.is_same_token(lemma, found_lemma):
-                print 'found at +%d' % check_token_id
-                return annotated_doc.tokens[check_token_id]
-        except IndexError:
-            pass
-
-        check_token_id = absolute_token_id - distance
-        if check_token_id >= 0:
-            try:
-                found_lemma = annotated_doc.tokens[check_token_id]['lemma']
-                is_same_token = parc3.annotated_document.is_same_token(
-                    lemma, found_lemma)
-                if is_same_token:
-                    print 'found at +%d' % check_token_id
-                    return annotated_doc.tokens[check_token_id]
-            except IndexError:
-                pass
-
-        distance += 1
-
-    sentence_text = annotated_doc.get_sentence_tokens(sentence_id).text()
-    sentence_lemmas = ' '.join([
-        t['lemma'] for t in 
-        annotated_doc.get_sentence_tokens(sentence_id)
-    ])
- 
-    raise ValueError(
-        'Could not find a token with lemma "%s" near token %d in sentence %d.'
-        '\n\n"%s"'
-        % (lemma, token_id, sentence_id, sentence_lemmas)
-    )
 
 def find_closest_near_matching_token(
     annotated_doc,
@@ -187,54 +322,168 @@ def find_closest_near_matching_token(
     token_id,
     lemma
 ):
+    return PropbankVerbMatcher(annotated_doc).find_closest_near_matching_token(
+        sentence_id, token_id, lemma)
 
-    # Absolutize the location that we're expecting the token
-    absolute_token_id = annotated_doc.absolutize(
-        [(sentence_id, token_id, token_id+1)]
-    )[0][1]
 
-    distance = 0
-    max_overlap = t4k.Max()
-    for distance in range(MAX_TOKEN_NEAR_MATCH_DISTANCE+1):
 
-        try:
-            check_token_id = absolute_token_id + distance
-            check_token = annotated_doc.tokens[check_token_id]
-            if check_token['pos'].startswith('VB'):
-                found_lemma = check_token['lemma']
-                overlap_amount = character_overlap(lemma, found_lemma)
-                max_overlap.add(overlap_amount, check_token_id)
-        except IndexError:
-            pass
-
-        check_token_id = absolute_token_id - distance
-        if check_token_id >= 0:
-            check_token = annotated_doc.tokens[check_token_id]
-            if check_token['pos'].startswith('VB'):
-                found_lemma = annotated_doc.tokens[check_token_id]['lemma']
-                overlap_amount = character_overlap(lemma, found_lemma)
-                max_overlap.add(overlap_amount, check_token_id)
-
-    sentence_lemmas = ' '.join([
-        t['lemma'] for t in 
-        annotated_doc.get_sentence_tokens(sentence_id)
-    ])
+class PropbankVerbMatcher(object):
+    """
+    Finds the tokens of a document that match propbank verbs.  The document's
+    tokens are indexed once, so that all of its verbs can be matched without
+    probing tokens one by one:
+
+        - the positions of tokens are kept by lemma, so exact matches are found
+            by bisecting the positions of the lemmas that match;
+        - the positions of verbs (by POS) are kept in order, so the candidates
+            for a near match are found by bisection;
+        - lemma comparisons, and the character histograms used to score near
+            matches, are computed once per distinct lemma.
+
+    Matches are the same as probing tokens outward from the expected
+    position, at distances 0, 1, 2, ..., after then before it.  An exact
+    match takes the first token found this way.  A near match takes the token
+    with the greatest character overlap, and among ties, the last one found.
+    """
 
-    max_overlap_amount, max_overlap_token_id = max_overlap.get()
+    def __init__(self, annotated_doc):
+        self.annotated_doc = annotated_doc
+        self.positions_by_lemma = defaultdict(list)
+        self.verb_positions = []
+        for abs_id, token in enumerate(annotated_doc.tokens):
+            if 'lemma' in token:
+                self.positions_by_lemma[token['lemma']].append(abs_id)
+                if token.get('pos', '').startswith('VB'):
+                    self.verb_positions.append(abs_id)
 
-    # Handle the case where there weren't even any candidates among the tokens
-    # searched.
-    if max_overlap_token_id is None:
-        return None
+        self.matching_lemmas = {}
+        self.histograms = {}
+        self.overlaps = {}
 
-    token = annotated_doc.tokens[max_overlap_token_id]
-    central_token = annotated_doc.tokens[absolute_token_id]
-    print central_token
-    print ('found max overlap: %.2f %s %s %s: \n\n%s' % (
-        max_overlap_amount, lemma, central_token['lemma'],
-        token['lemma'], sentence_lemmas
-    ))
-    return token
+
+    def get_expected_position(self, sentence_id, token_id):
+        sent_start, _ = self.annotated_doc.get_sentence_range(sentence_id)
+        return sent_start + token_id
+
+
+    def find_nearest_matching_token(self, sentence_id, token_id, lemma):
+        try:
+            token = self.find_nearest_exact_matching_token(
+                sentence_id, token_id, lemma)
+        except ValueError:
+            token = self.find_closest_near_matching_token(
+                sentence_id, token_id, lemma)
+            if token is None:
+                parc3.log.count('propbank_unmatched')
+                LOGGER.debug(
+                    'doc #%s, no match for propbank verb "%s" at token %d of '
+                    'sentence %d', self.annotated_doc.doc_id, lemma, token_id,
+                    sentence_id
+                )
+            else:
+                parc3.log.count('propbank_fuzzy_matches')
+        else:
+            parc3.log.count('propbank_exact_matches')
+        return token
+
+
+    def get_matching_lemmas(self, lemma):
+        """The lemmas of the document that are the same token as `lemma`."""
+        if lemma not in self.matching_lemmas:
+            self.matching_lemmas[lemma] = [
+                found_lemma for found_lemma in self.positions_by_lemma
+                if parc3.annotated_document.is_same_token(lemma, found_lemma)
+            ]
+        return self.matching_lemmas[lemma]
+
+
+    def find_nearest_exact_matching_token(self, sentence_id, token_id, lemma):
+        center = self.get_expected_position(sentence_id, token_id)
+
+        # Each candidate is ranked by its distance, then by whether it comes
+        # before the center, since positions after the center are probed
+        # first.
+        nearest = None
+        for found_lemma in self.get_matching_lemmas(lemma):
+            positions = self.positions_by_lemma[found_lemma]
+            index = bisect.bisect_left(positions, center)
+            if index < len(positions):
+                rank = (positions[index] - center, 0, positions[index])
+                nearest = rank if nearest is None else min(nearest, rank)
+            if index > 0:
+                rank = (center - positions[index-1], 1, positions[index-1])
+                nearest = rank if nearest is None else min(nearest, rank)
+
+        if nearest is not None and nearest[0] <= MAX_TOKEN_EXACT_MATCH_DISTANCE:
+            return self.annotated_doc.tokens[nearest[2]]
+
+        sentence_lemmas = ' '.join([
+            t['lemma'] for t in 
+            self.annotated_doc.get_sentence_tokens(sentence_id, view=True)
+        ])
+        raise ValueError(
+            'Could not find a token with lemma "%s" near token %d in sentence '
+            '%d.\n\n"%s"'
+            % (lemma, token_id, sentence_id, sentence_lemmas)
+        )
+
+
+    def get_histogram(self, text):
+        if text not in self.histograms:
+            self.histograms[text] = Counter(text)
+        return self.histograms[text]
+
+
+    def get_overlap(self, lemma, found_lemma):
+        """
+        The characters that `lemma` and `found_lemma` have in common, as a
+        fraction of the longer one, as `character_overlap` computes.
+        """
+        key = (lemma, found_lemma)
+        if key not in self.overlaps:
+            in_common = self.get_histogram(lemma) & self.get_histogram(
+                found_lemma)
+            self.overlaps[key] = sum(in_common.values()) / float(
+                max(len(lemma), len(found_lemma)))
+        return self.overlaps[key]
+
+
+    def find_closest_near_matching_token(self, sentence_id, token_id, lemma):
+        center = self.get_expected_position(sentence_id, token_id)
+        tokens = self.annotated_doc.tokens
+
+        # Candidates are ranked by overlap, then by the order they are probed
+        # in, latest first: by distance, and then by whether they come before
+        # the center.  The token at the center is probed on both sides.
+        best = None
+        start = bisect.bisect_left(
+            self.verb_positions, center - MAX_TOKEN_NEAR_MATCH_DISTANCE)
+        stop = bisect.bisect_right(
+            self.verb_positions, center + MAX_TOKEN_NEAR_MATCH_DISTANCE)
+        for position in self.verb_positions[start:stop]:
+            overlap = self.get_overlap(lemma, tokens[position]['lemma'])
+            rank = (overlap, abs(position - center), position <= center)
+            if best is None or rank > best[0]:
+                best = rank, position
+
+        # Handle the case where there weren't even any candidates among the
+        # tokens searched.
+        if best is None:
+            return None
+
+        (max_overlap_amount, _, _), max_overlap_token_id = best
+        token = tokens[max_overlap_token_id]
+        if LOGGER.isEnabledFor(logging.DEBUG):
+            sentence_lemmas = ' '.join([
+                t['lemma'] for t in
+                self.annotated_doc.get_sentence_tokens(sentence_id, view=True)
+            ])
+            LOGGER.debug(
+                'found max overlap: %.2f %s %s %s: \n\n%s',
+                max_overlap_amount, lemma, tokens[center]['lemma'],
+                token['lemma'], sentence_lemmas
+            )
+        return token
 
 
 
@@ -248,6 +497,24 @@ def read_propbank_verbs(path=PROPBANK_PATH):
     return propbank_verbs_by_doc
 
 
+def iter_propbank_verbs(path=PROPBANK_PATH):
+    """
+    Yields `(doc_id, propbank_verbs)` pairs, reading the propbank verbs one
+    doc at a time.  Each doc's verbs must be on consecutive lines.
+    """
+    doc_id, propbank_verbs = None, []
+    for line in t4k.trimmed_nonblank(open(path)):
+        line_doc_id, sentence_id, token_id, lemma = parse_propbank_line(line)
+        if line_doc_id != doc_id:
+            if propbank_verbs:
+                yield doc_id, propbank_verbs
+            doc_id, propbank_verbs = line_doc_id, []
+        propbank_verbs.append((sentence_id, token_id, lemma))
+
+    if propbank_verbs:
+        yield doc_id, propbank_verbs
+
+
 
 PROPBANK_LINE_PARSER = re.compile(
     'wsj/\d\d/wsj_(\d\d\d\d).mrg (\d+) (\d+) (\w+)')
@@ -287,44 +554,153 @@ def make_coreference_annotated_text(
 
 def verify_mention_tokens(mention, doc):
     expected_text = mention['text']
-    found_text = doc.get_tokens(mention['token_span']).text()
+    found_text = doc.get_tokens(mention['token_span'], view=True).text()
     assert_text_match(expected_text, found_text)
 
 
 
 
 def read_bbn_entity_types(entity_types_path=BBN_ENTITY_TYPES_DIR, limit=None):
-    print "Reading BBN entity types.  This will take a minute..."
-    annotated_docs = {}
-    for path in t4k.ls(entity_types_path):
+    LOGGER.info('Reading BBN entity types.  This will take a minute...')
+    return dict(iter_bbn_entity_types(entity_types_path, limit))
+
+
+def iter_bbn_entity_types(
+    entity_types_path=BBN_ENTITY_TYPES_DIR,
+    limit=None,
+    skip=None,
+    processes=1,
+    chunksize=1
+):
+    """
+    Yields `(doc_id, doc)` pairs for entity-annotated documents, in order of
+    doc_id.  The files are first indexed (see `BBNEntityTypeIndex`), so that
+    only the documents from `skip` up to `limit` get parsed.
+    """
+    index = BBNEntityTypeIndex(entity_types_path)
+    doc_ids = [
+        doc_id for doc_id in index.doc_ids
+        if (skip is None or doc_id >= skip)
+        and (limit is None or doc_id < limit)
+    ]
+    return index.iter_docs(doc_ids, processes, chunksize)
 
-        annotated_docs_to_add, hit_limit = parse_bbn_entity_types_file(
-            open(path).read(), limit)
-        annotated_docs.update(annotated_docs_to_add)
 
-        # Stop if we hit the limit
-        if hit_limit:
-            return annotated_docs
 
-        # Can stop early for debugging purposes
-        #doc_id = max(annotated_docs.keys())
-        #if limit is not None and doc_id == limit:
-        #    return annotated_docs
+class BBNEntityTypeIndex(object):
+    """
+    Locates each document in the BBN entity type files, so that documents can
+    be parsed individually rather than a whole file at a time.  Files are
+    split at their <DOC> tags, and the byte offsets of each document are kept
+    by doc_id.  Indexing only scans the files for tags, without parsing them.
+    """
 
-    return annotated_docs
+    DOC_START = re.compile(r'<DOC>')
+    DOC_END = '</DOC>'
+    DOC_NUM = re.compile(r'<DOCNO>(.*?)</DOCNO>', re.DOTALL)
+
+    def __init__(self, entity_types_path=BBN_ENTITY_TYPES_DIR):
+        self.locations = {}
+        for path in t4k.ls(entity_types_path):
+            self.index_file(path)
+        self.doc_ids = sorted(self.locations)
+
+
+    def index_file(self, path):
+        with open(path, 'rb') as entity_types_file:
+            # mmap can't map empty files.
+            if os.fstat(entity_types_file.fileno()).st_size == 0:
+                return
+            contents = mmap.mmap(
+                entity_types_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        try:
+            for doc_start in self.DOC_START.finditer(contents):
+                start = doc_start.start()
+                end = contents.find(self.DOC_END, start)
+                if end == -1:
+                    raise ValueError(
+                        'Unterminated <DOC> at byte %d of %s.' % (start, path))
+                end += len(self.DOC_END)
+
+                doc_num = self.DOC_NUM.search(contents, start, end)
+                if doc_num is None:
+                    raise ValueError(
+                        'No <DOCNO> in <DOC> at byte %d of %s.'
+                        % (start, path)
+                    )
+                doc_id = parse_doc_id(doc_num.group(1).strip())
+
+                # Later copies of a doc replace earlier ones, as they did when
+                # whole files were parsed and merged.
+                self.locations[doc_id] = (path, start, end)
+        finally:
+            contents.close()
+
+
+    def __contains__(self, doc_id):
+        return doc_id in self.locations
+
+
+    def __len__(self):
+        return len(self.locations)
+
+
+    def get_doc(self, doc_id):
+        return parse_bbn_entity_types_doc(self.locations[doc_id])
+
+
+    def iter_docs(self, doc_ids=None, processes=1, chunksize=1):
+        """
+        Yields `(doc_id, doc)` pairs for `doc_ids`, or for all docs.  Setting
+        `processes` to anything other than 1 parses them in a pool of that
+        many worker processes (`None` uses one per cpu), each taking
+        `chunksize` documents at a time.  Documents are yielded in the order
+        of `doc_ids` either way.
+        """
+        if doc_ids is None:
+            doc_ids = self.doc_ids
+        locations = [self.locations[doc_id] for doc_id in doc_ids]
+
+        if processes == 1:
+            for location in locations:
+                doc = parse_bbn_entity_types_doc(location)
+                yield doc.doc_id, doc
+            return
+
+        pool = multiprocessing.Pool(processes)
+        try:
+            docs = pool.imap(parse_bbn_entity_types_doc, locations, chunksize)
+            for doc in docs:
+                yield doc.doc_id, doc
+            pool.close()
+
+        # Don't leave workers behind if iteration is abandoned early.
+        finally:
+            pool.terminate()
+            pool.join()
+
+
+
+def parse_bbn_entity_types_doc(location):
+    """
+    Parse the single document at `location`, a `(path, start, end)` tuple of
+    the file and the byte offsets of the document within it.
+    """
+    path, start, end = location
+    with open(path, 'rb') as entity_types_file:
+        entity_types_file.seek(start)
+        xml_string = entity_types_file.read(end - start)
+    for doc in iter_bbn_entity_types_file(xml_string):
+        return doc
+    raise ValueError('No document found at byte %d of %s.' % (start, path))
 
 
 
 def parse_bbn_entity_types_file(xml_string, limit=None):
-    xml_string = xml_string.replace(
-        'vic<ENAMEX TYPE="PER_DESC">e pres</ENAMEX>ident',
-        '<ENAMEX TYPE="PER_DESC">vice president</ENAMEX>'
-    )
-    xml_tree = bs4.BeautifulSoup(xml_string, 'xml')
     annotated_docs = {}
     hit_limit = False
-    for doc_tag in xml_tree.find_all('DOC'):
-        doc = parse_entity_type_doc(doc_tag)
+    for doc in iter_bbn_entity_types_file(xml_string):
         if limit is not None and doc.doc_id >= limit:
             hit_limit = True
             return annotated_docs, hit_limit
@@ -333,6 +709,16 @@ def parse_bbn_entity_types_file(xml_string, limit=None):
     return annotated_docs, hit_limit
 
 
+def iter_bbn_entity_types_file(xml_string):
+    xml_string = xml_string.replace(
+        'vic<ENAMEX TYPE="PER_DESC">e pres</ENAMEX>ident',
+        '<ENAMEX TYPE="PER_DESC">vice president</ENAMEX>'
+    )
+    xml_tree = bs4.BeautifulSoup(xml_string, 'xml')
+    for doc_tag in xml_tree.find_all('DOC'):
+        yield parse_entity_type_doc(doc_tag)
+
+
 
 def parse_entity_type_doc(doc_tag):
     doc_id = parse_doc_id(doc_tag.find('DOCNO').text.strip())
@@ -435,11 +821,26 @@ class AutoIncrementer(object):
 
 
 def read_coreference_sentences_from_disk(path=BNP_SENTENCES_PATH, limit=None):
-    print "Reading BBN sentences.  This will take a minute..."
-    documents = {}
+    LOGGER.info('Reading BBN sentences.  This will take a minute...')
+    return dict(iter_coreference_sentences(path, limit))
+
+
+def iter_coreference_sentences(path=BNP_SENTENCES_PATH, limit=None):
+    """
+    Yields `(doc_id, document)` pairs, reading the tokenized and sentence-split
+    documents one at a time.
+    """
+    return iter_coreference_sentence_docs(open(path), limit)
+
+
+def iter_coreference_sentence_docs(lines, limit=None):
+    """
+    Yields `(doc_id, document)` pairs, parsing documents one at a time from
+    the lines of a WSJ.sent file.
+    """
     state = 'root'
     abs_token_id = AutoIncrementer()
-    for i, line in enumerate(open(BNP_SENTENCES_PATH)):
+    for i, line in enumerate(lines):
 
         line = line.rstrip()
         #print '%d\t%s' % (i, repr(line))
@@ -452,13 +853,12 @@ def read_coreference_sentences_from_disk(path=BNP_SENTENCES_PATH, limit=None):
 
                 # Can stop early
                 if limit is not None and doc_id >= limit:
-                    return documents
+                    return
 
                 state = 'in_doc'
                 abs_token_id.reset()
                 new_token_list = parc3.token_list.TokenList()
                 document = {'sentences':[], 'tokens':new_token_list}
-                documents[doc_id] = document
 
             else:
                 raise ValueError(
@@ -470,6 +870,7 @@ def read_coreference_sentences_from_disk(path=BNP_SENTENCES_PATH, limit=None):
 
             if line == ')':
                 state = 'root'
+                yield doc_id, document
 
             elif line.startswith('\tS'):
                 sentence_spec, content = line.lstrip().split(':', 1)
@@ -499,9 +900,6 @@ def read_coreference_sentences_from_disk(path=BNP_SENTENCES_PATH, limit=None):
                     'token_span': [(None, start, end)]
                 }, absolute=True))
 
-            elif line == ')':
-                state = 'root'
-
             else:
                 raise ValueError(
                     'Expecting sentence or document end  but got "%s".' % line)
@@ -509,7 +907,127 @@ def read_coreference_sentences_from_disk(path=BNP_SENTENCES_PATH, limit=None):
         else:
             raise ValueError('Unexpected state: "%s".' % state)
 
-    return documents
+
+class DocOffsetIndex(object):
+    """
+    The byte offsets of each document in a WSJ.sent or WSJ.pron file, so that
+    a document can be read without scanning the file.  In both files, a
+    document starts with a line beginning with "(", and ends with a line
+    beginning with ")".
+
+    The index is cached in `cache_dir`, under a name derived from the file's
+    absolute path, and is rebuilt whenever the file's size or modification
+    time no longer match the ones recorded in it.  If `cache_dir` is None, or
+    the cached index can't be written, the index is just kept in memory.
+    """
+
+    SUFFIX = '.offsets'
+    VERSION = 1
+
+    def __init__(self, path, cache_dir=OFFSET_INDEX_CACHE_DIR):
+        self.path = path
+        self.index_path = None
+        if cache_dir is not None:
+            self.index_path = get_offset_index_path(path, cache_dir)
+        self.offsets = self.read_index()
+        if self.offsets is None:
+            self.offsets = self.build_index()
+            self.write_index()
+
+
+    def get_file_stamp(self):
+        stat = os.stat(self.path)
+        return {
+            'version': self.VERSION,
+            'size': stat.st_size,
+            'mtime': stat.st_mtime
+        }
+
+
+    def read_index(self):
+        if self.index_path is None:
+            return None
+        try:
+            with open(self.index_path) as index_file:
+                saved = json.load(index_file)
+        except (IOError, ValueError):
+            return None
+        if saved.get('stamp') != self.get_file_stamp():
+            return None
+        return {
+            int(doc_id): tuple(offsets)
+            for doc_id, offsets in saved['offsets'].items()
+        }
+
+
+    def write_index(self):
+        if self.index_path is None:
+            return
+        saved = {'stamp': self.get_file_stamp(), 'offsets': self.offsets}
+        cache_dir = os.path.dirname(self.index_path)
+        temp_path = None
+        try:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+            with os.fdopen(fd, 'w') as temp_file:
+                json.dump(saved, temp_file)
+            os.rename(temp_path, self.index_path)
+        except (IOError, OSError):
+            if temp_path is not None and os.path.exists(temp_path):
+                os.remove(temp_path)
+            LOGGER.debug(
+                'Could not cache offset index at %s; keeping it in memory',
+                self.index_path
+            )
+            self.index_path = None
+
+
+    def build_index(self):
+        """
+        Scan the file line by line, recording the start and end offsets of
+        each document.
+        """
+        offsets = {}
+        offset = 0
+        doc_id, start = None, None
+        with open(self.path, 'rb') as doc_file:
+            for line in doc_file:
+                if line.startswith('('):
+                    doc_id, start = parse_doc_id(line), offset
+                offset += len(line)
+                if line.startswith(')') and doc_id is not None:
+                    offsets.setdefault(doc_id, (start, offset))
+                    doc_id = None
+        return offsets
+
+
+    def __contains__(self, doc_id):
+        return doc_id in self.offsets
+
+
+    def get_doc_ids(self):
+        return sorted(self.offsets)
+
+
+    def read_lines(self, doc_id):
+        start, end = self.offsets[doc_id]
+        with open(self.path, 'rb') as doc_file:
+            doc_file.seek(start)
+            return doc_file.read(end - start).splitlines(True)
+
+
+
+def get_offset_index_path(path, cache_dir=OFFSET_INDEX_CACHE_DIR):
+    """
+    Files with the same name in different directories get different entries.
+    """
+    abs_path = os.path.abspath(path)
+    digest = hashlib.md5(abs_path).hexdigest()[:12]
+    fname = '%s.%s%s' % (
+        os.path.basename(abs_path), digest, DocOffsetIndex.SUFFIX)
+    return os.path.join(cache_dir, fname)
+
 
 
 WHITESPACE = re.compile('\s+')
@@ -529,21 +1047,37 @@ def read_coreference_annotations(
     skip=None,
     limit=None
 ):
-    coref_sentences_by_doc = read_coreference_sentences_from_disk(limit=limit)
-    coref_info_by_doc = read_coreference_information_from_disk(limit=limit)
+    return dict(iter_coreference_annotations(path, subset, skip, limit))
+
+
+def iter_coreference_annotations(
+    path=BNP_PRONOUNS_PATH,
+    subset='all',
+    skip=None,
+    limit=None,
+    sentences_path=BNP_SENTENCES_PATH
+):
+    """
+    Yields `(doc_id, doc)` pairs for coreference-annotated documents, in order
+    of doc_id, reading the sentences and the coreference information for one
+    document at a time.
+    """
+    coref_sentences_by_doc = DocStream(
+        iter_coreference_sentences(sentences_path, limit=limit))
+    coref_info_by_doc = DocStream(
+        iter_coreference_information(path, limit=limit))
 
-    coreference_annotated_docs = {}
     for doc_id in parc3.data.iter_doc_num(subset, skip, limit):
 
         try:
-            sentences = coref_sentences_by_doc[doc_id]
-            coreferences, mentions = coref_info_by_doc[doc_id]
+            sentences = coref_sentences_by_doc.seek(doc_id)
+            coreferences, mentions = coref_info_by_doc.seek(doc_id)
         except KeyError:
             continue
 
         # Build the coreference-annotated document from the coreference
         # information that has been loaded from disk
-        coreference_annotated_docs[doc_id] = make_coreference_annotated_text(
+        yield doc_id, make_coreference_annotated_text(
             sentences['tokens'],
             sentences['sentences'],
             coreferences,
@@ -551,13 +1085,43 @@ def read_coreference_annotations(
             doc_id
         )
 
-    return coreference_annotated_docs
+
+def load_coreference_annotated_doc(
+    doc_id,
+    sentences_path=BNP_SENTENCES_PATH,
+    pronouns_path=BNP_PRONOUNS_PATH,
+    cache_dir=OFFSET_INDEX_CACHE_DIR
+):
+    """
+    Load the coreference-annotated document for `doc_id` alone, by seeking to
+    its sentences and coreference chains through the files' offset indexes
+    (see `DocOffsetIndex`).  Raises KeyError if either file lacks the doc.
+    """
+    sentence_lines = DocOffsetIndex(
+        sentences_path, cache_dir).read_lines(doc_id)
+    pronoun_lines = DocOffsetIndex(pronouns_path, cache_dir).read_lines(doc_id)
+
+    for _, sentences in iter_coreference_sentence_docs(sentence_lines):
+        for _, coreference_specs in iter_coreference_specs(pronoun_lines):
+            coreferences, mentions = assemble_doc_coreference_annotations(
+                coreference_specs)
+            return make_coreference_annotated_text(
+                sentences['tokens'],
+                sentences['sentences'],
+                coreferences,
+                mentions,
+                doc_id
+            )
 
 
 def read_coreference_information_from_disk(path=BNP_PRONOUNS_PATH, limit=None):
-    parsed_docs = parse_coreference_annotations(open(path).read(), limit)
-    annotations_by_doc = assemble_all_coreference_annotations(parsed_docs)
-    return annotations_by_doc
+    LOGGER.info('Reading BBN pronouns.  This will take a minute...')
+    return dict(iter_coreference_information(path, limit))
+
+
+def iter_coreference_information(path=BNP_PRONOUNS_PATH, limit=None):
+    for doc_id, coreference_specs in iter_coreference_specs(open(path), limit):
+        yield doc_id, assemble_doc_coreference_annotations(coreference_specs)
 
 
 
@@ -616,6 +1180,8 @@ def assemble_doc_coreference_annotations(coreference_specs):
 class Coreference(dict):
     def accomodate_inserted_token(self, *insertion_point):
         pass
+    def accomodate_inserted_tokens(self, insertion_points):
+        pass
 
 
 def accumulate_representative(mentions, antecedent_ids):
@@ -652,11 +1218,18 @@ def assert_text_match(expected_text, found_text):
 
 
 def parse_coreference_annotations(text_to_parse, limit=None):
-    print "Reading BBN pronouns.  This will take a minute..."
+    LOGGER.info('Reading BBN pronouns.  This will take a minute...')
+    return dict(iter_coreference_specs(text_to_parse.split('\n'), limit))
+
+
+def iter_coreference_specs(lines, limit=None):
+    """
+    Yields `(doc_id, coreference_specs)` pairs, parsing the coreference chains
+    of one document at a time from the lines of a WSJ.pron file.
+    """
     state = 'root'
-    documents = {}
 
-    for i, line in enumerate(t4k.skip_blank(text_to_parse.split('\n'))):
+    for i, line in enumerate(t4k.skip_blank(lines)):
 
         line = line.rstrip()
 
@@ -667,11 +1240,10 @@ def parse_coreference_annotations(text_to_parse, limit=None):
 
                 # Can stop early for debugging purposes
                 if limit is not None and doc_id >= limit:
-                    return documents
+                    return
 
                 state = 'in_doc'
                 coreferences = []
-                documents[doc_id] = coreferences
 
             else:
                 raise ValueError(
@@ -682,6 +1254,7 @@ def parse_coreference_annotations(text_to_parse, limit=None):
         elif state == 'in_doc':
 
             if line[0] == ')':
+                yield doc_id, coreferences
                 coreferences = None
                 state = 'root'
 
@@ -723,8 +1296,6 @@ def parse_coreference_annotations(text_to_parse, limit=None):
             'but currently in "%s" state; on line %d.' % (state, i)
         )
 
-    return documents
-
 
 
 def correct_token_offset_error(mention):
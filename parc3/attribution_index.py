@@ -0,0 +1,226 @@
+'''
+An inverted index over the cues, sources, and contents of attributions, so
+that a dataset can be queried without scanning every attribution.
+'''
+
+import bisect
+import re
+import sre_constants
+import sre_parse
+
+
+ROLES = ('cue', 'source', 'content')
+TOKEN_FIELDS = ('word', 'lemma', 'pos')
+TEXT_MATCHERS = ('regex', 'prefix')
+TRIGRAM_LENGTH = 3
+
+
+class AttributionIndex(object):
+    '''
+    Indexes attributions by role: the cue, source, and content.  For each
+    role, the index keeps
+
+        - postings from each token field in `TOKEN_FIELDS` (word, lemma, and
+            POS) to the attributions having a token with that value in that
+            role;
+        - postings from the text of the role (its words joined by spaces) to
+            the attributions having that text;
+        - the distinct texts in sorted order, for prefix queries; and
+        - postings from each character trigram to the distinct texts that
+            contain it, which narrow down the texts that a regex is tried on.
+
+    Attributions are added with a back-pointer, which is what queries return.
+    Back-pointers are dicts identifying the attribution, and must include an
+    'attribution_id'.
+    '''
+
+    def __init__(self):
+        self.back_pointers = {}
+        self.field_postings = {
+            role: {field: {} for field in TOKEN_FIELDS} for role in ROLES
+        }
+        self.text_postings = {role: {} for role in ROLES}
+        self.trigram_postings = {role: {} for role in ROLES}
+        self._sorted_texts = {role: None for role in ROLES}
+
+
+    def __len__(self):
+        return len(self.back_pointers)
+
+
+    def add(self, back_pointer, roles):
+        '''
+        Index an attribution.  `roles` maps each role to the attribution's
+        tokens in that role, which are dicts that may have any of the fields
+        in `TOKEN_FIELDS`.  Re-adding an attribution has no effect.
+        '''
+        attribution_id = back_pointer['attribution_id']
+        if attribution_id in self.back_pointers:
+            return
+        self.back_pointers[attribution_id] = back_pointer
+
+        for role in ROLES:
+            tokens = roles.get(role, [])
+
+            for field in TOKEN_FIELDS:
+                postings = self.field_postings[role][field]
+                for token in tokens:
+                    if field in token:
+                        postings.setdefault(token[field], set()).add(
+                            attribution_id)
+
+            text = ' '.join([token['word'] for token in tokens])
+            text_postings = self.text_postings[role]
+            if text not in text_postings:
+                text_postings[text] = set()
+                self._sorted_texts[role] = None
+                trigram_postings = self.trigram_postings[role]
+                for trigram in get_trigrams(text):
+                    trigram_postings.setdefault(trigram, set()).add(text)
+            text_postings[text].add(attribution_id)
+
+
+    def get_sorted_texts(self, role):
+        if self._sorted_texts[role] is None:
+            self._sorted_texts[role] = sorted(self.text_postings[role])
+        return self._sorted_texts[role]
+
+
+    def match_texts(self, role, regex=None, prefix=None):
+        '''
+        Return the distinct texts in `role` that match `regex` (by
+        `re.search`), and that start with `prefix`.  Texts must contain the
+        literal parts that the regex requires, so only texts having all of
+        their trigrams are tried.
+        '''
+        if prefix is not None:
+            texts = self.get_sorted_texts(role)
+            start = bisect.bisect_left(texts, prefix)
+            candidates = []
+            for text in texts[start:]:
+                if not text.startswith(prefix):
+                    break
+                candidates.append(text)
+        else:
+            candidates = None
+
+        if regex is None:
+            return (
+                list(self.text_postings[role]) if candidates is None
+                else candidates
+            )
+
+        matcher = re.compile(regex)
+        trigram_postings = self.trigram_postings[role]
+        for literal in get_required_literals(regex):
+            for trigram in get_trigrams(literal):
+                having_trigram = trigram_postings.get(trigram, set())
+                if candidates is None:
+                    candidates = having_trigram
+                else:
+                    candidates = having_trigram.intersection(candidates)
+
+        if candidates is None:
+            candidates = self.text_postings[role]
+        return [text for text in candidates if matcher.search(text)]
+
+
+    def find(self, role, field, value=None, regex=None, prefix=None):
+        '''
+        Return the set of IDs of attributions for which `role` satisfies the
+        condition.  If `field` is 'text', the condition is on the role's text,
+        which must match `regex` and / or start with `prefix`.  Otherwise,
+        `field` is one of `TOKEN_FIELDS`, and some token in the role must have
+        that field equal to `value`.
+        '''
+        if role not in ROLES:
+            raise ValueError('Unknown role: %s' % repr(role))
+
+        if field == 'text':
+            found = set()
+            for text in self.match_texts(role, regex, prefix):
+                found.update(self.text_postings[role][text])
+            return found
+
+        if field not in TOKEN_FIELDS:
+            raise ValueError('Unknown token field: %s' % repr(field))
+        return set(self.field_postings[role][field].get(value, ()))
+
+
+    def query(self, **conditions):
+        '''
+        Return the back-pointers of attributions satisfying all of the
+        conditions.  Each condition is named `<role>_<kind>`, where the kind
+        is either one of `TOKEN_FIELDS`, to require a token having that value,
+        or one of `TEXT_MATCHERS`, to match the role's text.  A bare role name
+        is taken as a regex.  For example, the cues containing "said" whose
+        source is a personal pronoun are found by
+
+            index.query(cue_regex=r'\\bsaid\\b', source_pos='PRP')
+        '''
+        found = None
+        for name, value in conditions.items():
+            role, kind = parse_condition(name)
+            if kind in TEXT_MATCHERS:
+                matched = self.find(role, 'text', **{kind: value})
+            else:
+                matched = self.find(role, kind, value)
+            found = matched if found is None else found & matched
+            if not found:
+                break
+
+        if found is None:
+            found = self.back_pointers
+        return [
+            self.back_pointers[attribution_id]
+            for attribution_id in sorted(found)
+        ]
+
+
+def parse_condition(name):
+    if name in ROLES:
+        return name, 'regex'
+    role, _, kind = name.partition('_')
+    if role not in ROLES or kind not in TOKEN_FIELDS + TEXT_MATCHERS:
+        raise ValueError('Unknown query condition: %s' % repr(name))
+    return role, kind
+
+
+def get_trigrams(text):
+    return set([
+        text[i:i+TRIGRAM_LENGTH]
+        for i in xrange(len(text) - TRIGRAM_LENGTH + 1)
+    ])
+
+
+def get_required_literals(regex):
+    '''
+    Return literal strings that any match of `regex` must contain.  Only runs
+    of plain characters at the top level of the pattern are found, which is
+    enough to narrow down most queries.  Patterns whose literals can't be
+    relied upon, like case-insensitive ones, give no literals.
+    '''
+    try:
+        parsed = sre_parse.parse(regex)
+    except sre_constants.error:
+        return []
+
+    if parsed.pattern.flags & (sre_parse.SRE_FLAG_IGNORECASE
+            | sre_parse.SRE_FLAG_VERBOSE):
+        return []
+
+    to_char = unichr if isinstance(regex, unicode) else chr
+    literals = []
+    run = []
+    for op, arg in parsed:
+        if op == sre_constants.LITERAL:
+            run.append(to_char(arg))
+            continue
+        # A top-level alternation means nothing is required.
+        if op == sre_constants.BRANCH:
+            return []
+        literals.append(''.join(run))
+        run = []
+    literals.append(''.join(run))
+
+    return [literal for literal in literals if len(literal) >= TRIGRAM_LENGTH]
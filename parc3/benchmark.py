@@ -0,0 +1,785 @@
+'''
+Benchmarks for parsing, merging, and span operations.  They run on synthetic
+inputs, generated at a configurable size, so they can be reproduced without
+the corpora.  Run them from the command line:
+
+    python -m parc3.benchmark --docs 50 --save-baseline baseline.json
+    python -m parc3.benchmark --docs 50 --baseline baseline.json
+
+Each case is timed over a few repeats, and the best time is kept.  Its
+throughput is the number of units handled (tokens, spans, documents...) per
+second.  Its peak memory is how much the process's peak resident set grew
+while the case ran.  Each case runs in a fresh worker process by default, so
+that this growth is its own.  Cases that got slower, or used more memory,
+than the baseline by more than the tolerance are reported as regressions, and
+the exit status is 1.
+'''
+
+import argparse
+import gc
+import json
+import multiprocessing
+import os
+import random
+import shutil
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+import parc3
+
+
+DEFAULT_NUM_DOCS = 20
+DEFAULT_NUM_SENTENCES = 20
+DEFAULT_SENTENCE_LENGTH = 25
+DEFAULT_SEED = 0
+DEFAULT_REPEAT = 3
+DEFAULT_TOLERANCE = 0.2
+
+# Memory growth below this isn't reported as a regression, since it is within
+# the noise of measuring resident memory.
+MIN_MEMORY_REGRESSION_KB = 1024
+
+# Tokens used to fill out synthetic sentences, as (text, pos, lemma).
+NOUNS = (
+    ('company', 'NN', 'company'), ('shares', 'NNS', 'share'),
+    ('market', 'NN', 'market'), ('analysts', 'NNS', 'analyst'),
+    ('prices', 'NNS', 'price'), ('year', 'NN', 'year'),
+    ('investors', 'NNS', 'investor'), ('profit', 'NN', 'profit'),
+)
+VERBS = (
+    ('rose', 'VBD', 'rise'), ('expects', 'VBZ', 'expect'),
+    ('fell', 'VBD', 'fall'), ('reported', 'VBD', 'report'),
+    ('sell', 'VB', 'sell'),
+)
+FUNCTION_WORDS = (
+    ('the', 'DT', 'the'), ('of', 'IN', 'of'), ('and', 'CC', 'and'),
+    ('in', 'IN', 'in'), ('a', 'DT', 'a'),
+)
+
+# Hyphenated tokens are split apart in the BBN tokenization, so that merging
+# has tokens to split.
+HYPHENATED = (
+    ('long-term', 'JJ', 'long-term'), ('third-quarter', 'JJ', 'third-quarter'),
+    ('well-known', 'JJ', 'well-known'),
+)
+
+ATTRIBUTION_RATE = 0.5
+CONTINUED_CONTENT_RATE = 0.3
+HYPHENATED_RATE = 0.05
+VERB_RATE = 0.15
+NOUN_RATE = 0.4
+SHIFTED_VERB_RATE = 0.2
+MISSPELLED_VERB_RATE = 0.05
+
+# Number of tokens inserted into each document by the insert_token case, and
+# number of ranges in each span consolidated by the consolidate case.
+INSERTIONS_PER_DOC = 100
+RANGES_PER_SPAN = 20
+
+# Most ranges in each span built by the span construction cases.
+MAX_CONSTRUCTED_RANGES = 3
+
+
+class SyntheticCorpus(object):
+    """
+    A synthetic PARC corpus, along with the BBN pronoun and entity type
+    annotations, and the propbank verbs, that go with it, written in the
+    formats of the real files.
+
+    Each document has `num_sentences` sentences of `sentence_length` tokens.
+    Every sentence after the first starts with a pronoun referring back to the
+    first, and about half of them carry an attribution, sometimes with content
+    running on through the next sentence.  Hyphenated words are split in the
+    BBN tokenization, and some propbank verbs point a little off from their
+    token, or have a misspelled lemma, so that merging has to do the same
+    kinds of work as on the real data.  The same seed gives the same corpus.
+    """
+
+    def __init__(
+        self,
+        directory,
+        num_docs=DEFAULT_NUM_DOCS,
+        num_sentences=DEFAULT_NUM_SENTENCES,
+        sentence_length=DEFAULT_SENTENCE_LENGTH,
+        seed=DEFAULT_SEED
+    ):
+        self.directory = directory
+        self.num_docs = num_docs
+        self.num_sentences = num_sentences
+        self.sentence_length = sentence_length
+        self.seed = seed
+
+        self.doc_ids = range(num_docs)
+        self.parc_dir = os.path.join(directory, 'parc')
+        self.sentences_path = os.path.join(directory, 'WSJ.sent')
+        self.pronouns_path = os.path.join(directory, 'WSJ.pron')
+        self.entity_types_dir = os.path.join(directory, 'WSJtypes-subtypes')
+        self.propbank_path = os.path.join(directory, 'vloc.txt')
+
+
+    def get_settings(self):
+        return {
+            'num_docs': self.num_docs,
+            'num_sentences': self.num_sentences,
+            'sentence_length': self.sentence_length,
+            'seed': self.seed,
+        }
+
+
+    def get_parc_path(self, doc_id):
+        return os.path.join(
+            self.parc_dir, '%s.xml' % parc3.data.get_parc_fname(doc_id))
+
+
+    def read_parc_xml(self, doc_id):
+        return open(self.get_parc_path(doc_id)).read()
+
+
+    @property
+    def num_tokens(self):
+        return self.num_docs * self.num_sentences * self.sentence_length
+
+
+    def write(self):
+        for directory in [self.parc_dir, self.entity_types_dir]:
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+
+        rng = random.Random(self.seed)
+        sentences_file = open(self.sentences_path, 'w')
+        pronouns_file = open(self.pronouns_path, 'w')
+        propbank_file = open(self.propbank_path, 'w')
+        entity_types_files = {}
+        try:
+            for doc_id in self.doc_ids:
+                sentences = self.make_doc(doc_id, rng)
+                with open(self.get_parc_path(doc_id), 'w') as parc_file:
+                    parc_file.write(render_parc_doc(doc_id, sentences))
+                sentences_file.write(render_sentences(doc_id, sentences))
+                pronouns_file.write(render_pronouns(doc_id, sentences))
+                propbank_file.write(render_propbank(doc_id, sentences, rng))
+
+                entity_types_fname = 'wsj%02d.qa' % (doc_id / 100)
+                if entity_types_fname not in entity_types_files:
+                    entity_types_files[entity_types_fname] = open(
+                        os.path.join(
+                            self.entity_types_dir, entity_types_fname),
+                        'w'
+                    )
+                entity_types_files[entity_types_fname].write(
+                    render_entity_types(doc_id, sentences))
+        finally:
+            sentences_file.close()
+            pronouns_file.close()
+            propbank_file.close()
+            for entity_types_file in entity_types_files.values():
+                entity_types_file.close()
+
+
+    def make_doc(self, doc_id, rng):
+        """
+        Make the sentences of a document.  Each sentence is a list of tokens,
+        which are dicts holding text, pos, lemma, and a dict of the
+        attribution roles that the token plays, keyed by attribution id.
+        """
+        sentences = []
+        continued_attribution = None
+        for sentence_id in xrange(self.num_sentences):
+            if sentence_id == 0:
+                subject = ('Smith', 'NNP', 'Smith')
+            else:
+                subject = ('He', 'PRP', 'he')
+            tokens = [make_token(*subject)]
+
+            attributed = (
+                continued_attribution is None
+                and rng.random() < ATTRIBUTION_RATE
+            )
+            tokens.append(
+                make_token('said', 'VBD', 'say') if attributed
+                else make_token(*rng.choice(VERBS))
+            )
+            while len(tokens) < self.sentence_length - 1:
+                tokens.append(make_token(*choose_word(rng)))
+            tokens.append(make_token('.', '.', '.'))
+
+            # Content carried on from an attribution in the last sentence.
+            if continued_attribution is not None:
+                for token in tokens[:-1]:
+                    token['roles'][continued_attribution] = 'content'
+                continued_attribution = None
+
+            if attributed:
+                attribution_id = (
+                    'wsj_%04d_Attribution_relation_level.xml_set_%d'
+                    % (doc_id, sentence_id)
+                )
+                tokens[0]['roles'][attribution_id] = 'source'
+                tokens[1]['roles'][attribution_id] = 'cue'
+                for token in tokens[2:-1]:
+                    token['roles'][attribution_id] = 'content'
+                if rng.random() < CONTINUED_CONTENT_RATE:
+                    continued_attribution = attribution_id
+
+            sentences.append(tokens)
+        return sentences
+
+
+
+def make_token(text, pos, lemma):
+    return {'text': text, 'pos': pos, 'lemma': lemma, 'roles': {}}
+
+
+def choose_word(rng):
+    draw = rng.random()
+    if draw < HYPHENATED_RATE:
+        return rng.choice(HYPHENATED)
+    if draw < HYPHENATED_RATE + VERB_RATE:
+        return rng.choice(VERBS)
+    if draw < HYPHENATED_RATE + VERB_RATE + NOUN_RATE:
+        return rng.choice(NOUNS)
+    return rng.choice(FUNCTION_WORDS)
+
+
+def get_bbn_texts(token):
+    """The texts that `token` is split into in the BBN tokenization."""
+    if token['pos'] == 'JJ' and '-' in token['text']:
+        first, rest = token['text'].split('-', 1)
+        return [first, '-', rest]
+    return [token['text']]
+
+
+def render_parc_doc(doc_id, sentences):
+    lines = ['<?xml version="1.0" encoding="UTF-8"?>', '<root>']
+    for sentence_id, tokens in enumerate(sentences):
+        words = [
+            render_parc_word(sentence_id, token_id, token)
+            for token_id, token in enumerate(tokens)
+        ]
+        lines.append(
+            '<SENTENCE gorn="%d"><S gorn="%d">'
+            '<NP-SBJ gorn="%d,0">%s</NP-SBJ>'
+            '<VP gorn="%d,1">%s<SBAR gorn="%d,1,1">%s</SBAR></VP>'
+            '</S></SENTENCE>'
+            % (
+                sentence_id, sentence_id, sentence_id, words[0],
+                sentence_id, words[1], sentence_id, ''.join(words[2:])
+            )
+        )
+    lines.append('</root>')
+    return '\n'.join(lines)
+
+
+def render_parc_word(sentence_id, token_id, token):
+    attributions = ''.join([
+        '<attribution id="%s"><attributionRole roleValue="%s"/>'
+        '</attribution>' % (attribution_id, role)
+        for attribution_id, role in sorted(token['roles'].items())
+    ])
+    return (
+        '<WORD ByteCount="%d,%d" gorn="%d,%d" lemma="%s" pos="%s" '
+        'sentenceWord="%d" text="%s">%s</WORD>'
+        % (
+            token_id, token_id + len(token['text']), sentence_id, token_id,
+            token['lemma'], token['pos'], token_id, token['text'],
+            attributions
+        )
+    )
+
+
+def render_sentences(doc_id, sentences):
+    lines = ['(WSJ%04d' % doc_id]
+    for sentence_id, tokens in enumerate(sentences):
+        texts = []
+        for token in tokens:
+            texts.extend(get_bbn_texts(token))
+        lines.append('\tS%d: %s' % (sentence_id + 1, ' '.join(texts)))
+    lines.append(')')
+    return '\n'.join(lines) + '\n'
+
+
+def render_pronouns(doc_id, sentences):
+    """
+    Every sentence after the first opens with a pronoun referring to the
+    subject of the first, so each document has a single coreference chain.
+    """
+    lines = ['(WSJ%04d' % doc_id]
+    if len(sentences) > 1:
+        lines.append('    (')
+        lines.append(
+            '\tAntecedent -> S1:1-1 -> %s' % sentences[0][0]['text'])
+        for sentence_id, tokens in enumerate(sentences[1:], 2):
+            lines.append(
+                '\tPronoun -> S%d:1-1 -> %s' % (sentence_id, tokens[0]['text']))
+        lines.append('    )')
+    lines.append(')')
+    return '\n'.join(lines) + '\n'
+
+
+def render_entity_types(doc_id, sentences):
+    texts = []
+    for tokens in sentences:
+        for token in tokens:
+            if token['pos'] == 'NNP':
+                texts.append(
+                    '<ENAMEX TYPE="PERSON">%s</ENAMEX>' % token['text'])
+            else:
+                texts.extend(get_bbn_texts(token))
+    return (
+        '<DOC>\n<DOCNO> WSJ%04d </DOCNO>\n%s\n</DOC>\n'
+        % (doc_id, ' '.join(texts))
+    )
+
+
+def render_propbank(doc_id, sentences, rng):
+    """
+    List the verbs of a document.  Some are pointed a token or two off, and
+    some have a misspelled lemma, as happens in the real propbank locations.
+    """
+    lines = []
+    for sentence_id, tokens in enumerate(sentences):
+        for token_id, token in enumerate(tokens):
+            if not token['pos'].startswith('VB'):
+                continue
+            lemma = token['lemma']
+            draw = rng.random()
+            if draw < SHIFTED_VERB_RATE:
+                token_id += rng.randint(1, 2)
+            elif draw < SHIFTED_VERB_RATE + MISSPELLED_VERB_RATE:
+                lemma = lemma[:-1] + 'x'
+            lines.append(
+                'wsj/%02d/wsj_%04d.mrg %d %d %s'
+                % (doc_id / 100, doc_id, sentence_id, token_id, lemma)
+            )
+    return ''.join([line + '\n' for line in lines])
+
+
+
+def read_parc_docs(corpus, include_nested=True):
+    return [
+        parc3.parc_reader.read_parc_file(
+            corpus.read_parc_xml(doc_id), doc_id, include_nested)
+        for doc_id in corpus.doc_ids
+    ]
+
+
+def iter_parc_docs(corpus, include_nested=True):
+    for doc_id in corpus.doc_ids:
+        yield doc_id, parc3.parc_reader.read_parc_file(
+            corpus.read_parc_xml(doc_id), doc_id, include_nested)
+
+
+def get_sources(corpus):
+    """
+    The keyword arguments that point `iter_bnp_doc_parts` and
+    `iter_bnp_pronoun_dataset` at the documents of `corpus`.
+    """
+    return {
+        'subset': 'all',
+        'limit': corpus.num_docs,
+        'pronouns_path': corpus.pronouns_path,
+        'sentences_path': corpus.sentences_path,
+        'entity_types_dir': corpus.entity_types_dir,
+        'propbank_path': corpus.propbank_path,
+        'parc_docs': iter_parc_docs(corpus),
+    }
+
+
+def iter_doc_parts(corpus):
+    """
+    Yields `(doc_id, parts)` pairs from `iter_bnp_doc_parts`, reading the
+    annotations from the files of `corpus`.
+    """
+    return parc3.annotation_merging.iter_bnp_doc_parts(**get_sources(corpus))
+
+
+# Each case takes the corpus, does any setup that shouldn't be timed, and
+# returns `(run, num_units, unit)`: the function to time, and the amount of
+# work that it does, for reporting throughput.  Setup is repeated before each
+# timed run, since most operations change what they run on.
+
+def setup_read_parc_file(corpus):
+    xmls = [(doc_id, corpus.read_parc_xml(doc_id)) for doc_id in corpus.doc_ids]
+    def run():
+        for doc_id, xml in xmls:
+            parc3.parc_reader.read_parc_file(xml, doc_id)
+    return run, corpus.num_tokens, 'tokens'
+
+
+def setup_stitch_attributions(corpus):
+    docs_and_specs = []
+    for doc_id in corpus.doc_ids:
+        doc = parc3.annotated_document.AnnotatedDocument(doc_id=doc_id)
+        specs = parc3.parc_reader.soup_parse(corpus.read_parc_xml(doc_id), doc)
+        docs_and_specs.append((doc, specs))
+    def run():
+        for doc, specs in docs_and_specs:
+            parc3.parc_reader.stitch_attributions(specs, doc)
+    num_specs = sum([len(specs) for doc, specs in docs_and_specs])
+    return run, num_specs, 'fragments'
+
+
+def setup_consolidate(corpus):
+    rng = random.Random(corpus.seed)
+    spans = []
+    for i in xrange(corpus.num_tokens / RANGES_PER_SPAN):
+        span = parc3.spans.TokenSpan(absolute=True)
+        for j in xrange(RANGES_PER_SPAN):
+            start = rng.randrange(corpus.sentence_length * 10)
+            span.add_token_range(
+                (start, start + rng.randint(1, 5)), skip_consolidation=True)
+        spans.append(span)
+    def run():
+        for span in spans:
+            span.consolidate()
+    return run, len(spans) * RANGES_PER_SPAN, 'ranges'
+
+
+def make_consolidated_ranges(corpus):
+    """
+    Make lists of sorted, separated sentence-relative ranges, one list per
+    token in the corpus, for the span construction cases.
+    """
+    rng = random.Random(corpus.seed)
+    range_lists = []
+    for i in xrange(corpus.num_tokens):
+        sentence_id = rng.randrange(corpus.num_sentences)
+        token_ranges = []
+        end = 0
+        for j in xrange(rng.randint(1, MAX_CONSTRUCTED_RANGES)):
+            start = end + rng.randint(1, 3)
+            end = start + rng.randint(1, 5)
+            token_ranges.append((sentence_id, start, end))
+        range_lists.append(token_ranges)
+    return range_lists
+
+
+def setup_construct_spans(corpus):
+    range_lists = make_consolidated_ranges(corpus)
+    def run():
+        for token_ranges in range_lists:
+            parc3.spans.TokenSpan(token_ranges)
+    return run, sum([len(ranges) for ranges in range_lists]), 'ranges'
+
+
+def setup_construct_trusted_spans(corpus):
+    range_lists = make_consolidated_ranges(corpus)
+    def run():
+        for token_ranges in range_lists:
+            parc3.spans.TokenSpan.from_trusted_ranges(token_ranges)
+    return run, sum([len(ranges) for ranges in range_lists]), 'ranges'
+
+
+def setup_replace_spans(corpus):
+    range_lists = make_consolidated_ranges(corpus)
+    spans = [parc3.spans.TokenSpan(ranges) for ranges in range_lists]
+    def run():
+        for span, token_ranges in zip(spans, range_lists):
+            span.replace_with(token_ranges)
+    return run, sum([len(ranges) for ranges in range_lists]), 'ranges'
+
+
+def setup_replace_trusted_spans(corpus):
+    range_lists = make_consolidated_ranges(corpus)
+    spans = [parc3.spans.TokenSpan(ranges) for ranges in range_lists]
+    def run():
+        for span, token_ranges in zip(spans, range_lists):
+            span.replace_with_trusted(token_ranges)
+    return run, sum([len(ranges) for ranges in range_lists]), 'ranges'
+
+
+def setup_relativize(corpus):
+    docs = read_parc_docs(corpus)
+    attributions = []
+    for doc in docs:
+        for attribution in doc.annotations['attributions'].values():
+            attribution.absolutize(doc)
+            attributions.append((doc, attribution))
+    def run():
+        for doc, attribution in attributions:
+            attribution.relativize(doc)
+    return run, len(attributions), 'attributions'
+
+
+def setup_relativize_spans(corpus):
+    docs = read_parc_docs(corpus)
+    docs_and_spans = []
+    for doc in docs:
+        token_spans = []
+        for attribution in doc.annotations['attributions'].values():
+            attribution.absolutize(doc)
+            token_spans.extend([
+                attribution[role] for role in attribution.ROLES])
+        docs_and_spans.append((doc, token_spans))
+    def run():
+        for doc, token_spans in docs_and_spans:
+            doc.relativize_spans(token_spans)
+    num_attributions = sum([
+        len(doc.annotations['attributions']) for doc in docs])
+    return run, num_attributions, 'attributions'
+
+
+def setup_insert_token(corpus):
+    rng = random.Random(corpus.seed)
+    docs = read_parc_docs(corpus)
+    insertions = [
+        (doc, [
+            rng.randrange(len(doc.tokens))
+            for i in xrange(INSERTIONS_PER_DOC)
+        ])
+        for doc in docs
+    ]
+    def run():
+        for doc, abs_indices in insertions:
+            for abs_index in abs_indices:
+                doc.insert_token(abs_index, {'text': 'inserted'})
+
+            # Reading these applies the shifts that insertion defers.
+            doc.tokens
+            doc.sentences
+    return run, len(docs) * INSERTIONS_PER_DOC, 'insertions'
+
+
+def setup_merge_tokens(corpus):
+    doc_parts = [parts for doc_id, parts in iter_doc_parts(corpus)]
+    def run():
+        for coreference_doc, attribution_doc, entity_doc, _ in doc_parts:
+            coreference_doc.merge_tokens(
+                entity_doc, copy_token_fields=['entity'],
+                copy_annotations=['entities']
+            )
+            attribution_doc.merge_tokens(
+                coreference_doc, copy_token_fields=['entity'],
+                copy_annotations=['entities', 'coreferences']
+            )
+    return run, corpus.num_tokens, 'tokens'
+
+
+def setup_bnp_pronoun_dataset(corpus):
+    """
+    Times `iter_bnp_pronoun_dataset`, reading and merging the annotations
+    from the files of `corpus`.
+    """
+    def run():
+        for doc_id, doc in parc3.annotation_merging.iter_bnp_pronoun_dataset(
+            **get_sources(corpus)
+        ):
+            pass
+    return run, corpus.num_docs, 'docs'
+
+
+CASES = OrderedDict([
+    ('read_parc_file', setup_read_parc_file),
+    ('stitch_attributions', setup_stitch_attributions),
+    ('consolidate', setup_consolidate),
+    ('construct_spans', setup_construct_spans),
+    ('construct_trusted_spans', setup_construct_trusted_spans),
+    ('replace_spans', setup_replace_spans),
+    ('replace_trusted_spans', setup_replace_trusted_spans),
+    ('relativize', setup_relativize),
+    ('relativize_spans', setup_relativize_spans),
+    ('insert_token', setup_insert_token),
+    ('merge_tokens', setup_merge_tokens),
+    ('bnp_pronoun_dataset', setup_bnp_pronoun_dataset),
+])
+
+
+
+def get_peak_rss_kb():
+    # Imported here, since the resource module is only on Unix, and parc3
+    # imports this module.
+    import resource
+
+    # ru_maxrss is in kilobytes on Linux, but in bytes on macOS.
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak_rss / 1024 if sys.platform == 'darwin' else peak_rss
+
+
+def run_case(args):
+    """
+    Run one case, and return its result.  Takes a single `(corpus, name,
+    repeat)` tuple, so that it can be mapped over by a pool.
+    """
+    corpus, name, repeat = args
+    peak_rss_before = get_peak_rss_kb()
+    times = []
+    for i in xrange(repeat):
+        run, num_units, unit = CASES[name](corpus)
+        gc_was_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            start = timeit.default_timer()
+            run()
+            times.append(timeit.default_timer() - start)
+        finally:
+            if gc_was_enabled:
+                gc.enable()
+
+    seconds = min(times)
+    return {
+        'seconds': seconds,
+        'num_units': num_units,
+        'unit': unit,
+        'throughput': num_units / seconds if seconds > 0 else None,
+        'peak_rss_kb': get_peak_rss_kb() - peak_rss_before,
+    }
+
+
+def run_benchmarks(corpus, names=None, repeat=DEFAULT_REPEAT, isolate=True):
+    """
+    Run the cases named in `names` (all of `CASES` by default) on `corpus`,
+    which must already be written.  Returns an OrderedDict of results by case
+    name.  With `isolate`, each case runs in its own worker process.
+    """
+    names = CASES.keys() if names is None else names
+    for name in names:
+        if name not in CASES:
+            raise ValueError('Unknown benchmark case: %s' % repr(name))
+
+    results = OrderedDict()
+    for name in names:
+        if not isolate:
+            results[name] = run_case((corpus, name, repeat))
+            continue
+        pool = multiprocessing.Pool(1)
+        try:
+            results[name] = pool.apply(run_case, ((corpus, name, repeat),))
+            pool.close()
+        finally:
+            pool.terminate()
+            pool.join()
+    return results
+
+
+def find_regressions(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Compare `results` to `baseline`, as written by `write_baseline`.  Returns
+    `(name, measure, baseline_value, value)` tuples for each case whose time
+    or peak memory grew by more than the fraction `tolerance`.  Cases missing
+    from the baseline are skipped.
+    """
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline['results']:
+            continue
+        baseline_result = baseline['results'][name]
+
+        if result['seconds'] > baseline_result['seconds'] * (1 + tolerance):
+            regressions.append(
+                (name, 'seconds', baseline_result['seconds'],
+                    result['seconds'])
+            )
+
+        memory_growth = result['peak_rss_kb'] - baseline_result['peak_rss_kb']
+        if (
+            memory_growth > MIN_MEMORY_REGRESSION_KB
+            and memory_growth > baseline_result['peak_rss_kb'] * tolerance
+        ):
+            regressions.append(
+                (name, 'peak_rss_kb', baseline_result['peak_rss_kb'],
+                    result['peak_rss_kb'])
+            )
+    return regressions
+
+
+def write_baseline(path, settings, results):
+    with open(path, 'w') as baseline_file:
+        json.dump(
+            {'settings': settings, 'results': results}, baseline_file,
+            indent=2
+        )
+
+
+def read_baseline(path, settings):
+    """
+    Read the baseline at `path`.  Raises ValueError if it was recorded with
+    different settings, since its timings wouldn't be comparable.
+    """
+    baseline = json.load(open(path))
+    if baseline['settings'] != settings:
+        raise ValueError(
+            'Baseline %s was recorded with settings %s, not %s.'
+            % (path, baseline['settings'], settings)
+        )
+    return baseline
+
+
+def format_results(results):
+    lines = ['%-24s %10s %28s %14s' % (
+        'case', 'seconds', 'throughput', 'peak RSS')]
+    for name, result in results.items():
+        throughput = (
+            '-' if result['throughput'] is None
+            else '%.1f %s/s' % (result['throughput'], result['unit'])
+        )
+        lines.append('%-24s %10.4f %28s %11d KB' % (
+            name, result['seconds'], throughput, result['peak_rss_kb']))
+    return '\n'.join(lines)
+
+
+def format_regressions(regressions):
+    return '\n'.join([
+        'REGRESSION %s %s: %s -> %s' % (name, measure, baseline_value, value)
+        for name, measure, baseline_value, value in regressions
+    ])
+
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--docs', type=int, default=DEFAULT_NUM_DOCS)
+    parser.add_argument(
+        '--sentences', type=int, default=DEFAULT_NUM_SENTENCES,
+        help='sentences per document')
+    parser.add_argument(
+        '--sentence-length', type=int, default=DEFAULT_SENTENCE_LENGTH,
+        help='tokens per sentence')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED)
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT)
+    parser.add_argument(
+        '--cases', nargs='+', choices=CASES.keys(), default=None)
+    parser.add_argument(
+        '--baseline', help='compare to the baseline stored at this path')
+    parser.add_argument(
+        '--save-baseline', help='store the results as a baseline at this path')
+    parser.add_argument(
+        '--tolerance', type=float, default=DEFAULT_TOLERANCE,
+        help='fraction by which a case may grow before it is a regression')
+    parser.add_argument(
+        '--directory',
+        help='write the corpus here and keep it, rather than in a temporary '
+        'directory')
+    args = parser.parse_args(argv)
+
+    directory = args.directory or tempfile.mkdtemp()
+    try:
+        corpus = SyntheticCorpus(
+            directory, args.docs, args.sentences, args.sentence_length,
+            args.seed
+        )
+        corpus.write()
+        settings = dict(corpus.get_settings(), repeat=args.repeat)
+        baseline = (
+            None if args.baseline is None
+            else read_baseline(args.baseline, settings)
+        )
+        results = run_benchmarks(corpus, args.cases, args.repeat)
+    finally:
+        if args.directory is None:
+            shutil.rmtree(directory)
+
+    print format_results(results)
+    if args.save_baseline is not None:
+        write_baseline(args.save_baseline, settings, results)
+
+    if baseline is not None:
+        regressions = find_regressions(results, baseline, args.tolerance)
+        if regressions:
+            print format_regressions(regressions)
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -5,11 +5,33 @@ import os
 import subprocess
 import SETTINGS
 import json
+import logging
 import random
+import multiprocessing
+import cPickle
+import tempfile
+import mmap
+import struct
+
+
+LOGGER = logging.getLogger(__name__)
 
 MAX_ARTICLE_NUM = 2499
 ARTICLE_NUM_MATCHER = re.compile('wsj_(\d\d\d\d)')
 
+# Parsed documents are cached here.  Bump the version whenever a change to
+# parsing or to the document classes would make cached documents stale.
+PARC_CACHE_DIR = os.path.join(SETTINGS.DATA_DIR, 'parc-cache')
+PARC_CACHE_VERSION = 4
+
+
+# Saved ParcDatasets start with a header giving the format version and
+# where the pickled index is.  Bump the version whenever the layout or the
+# pickled classes change.
+DATASET_MAGIC = 'PARCDSET'
+DATASET_FORMAT_VERSION = 3
+DATASET_HEADER = struct.Struct('<8sIQQ')
+
 
 def get_article_num(article_fname):
     return int(ARTICLE_NUM_MATCHER.search(article_fname).group(1))
@@ -42,16 +64,94 @@ def get_parc_path(doc_num):
     return os.path.join(parc_dir, subsubdir, fname + '.xml')
 
 
-def load_parc_doc(doc_num, include_nested=True):
+def load_parc_doc(doc_num, include_nested=True, backend=None, use_cache=False):
     """
     Loads a parc file into memory, but does not load the associated corenlp 
-    annotations
+    annotations.  `backend` selects the xml parser (see
+    `parc3.parc_reader.PARSER_BACKENDS`).  If `use_cache` is True, the parsed
+    document is read from, or written to, the on-disk cache.
+    """
+    if use_cache:
+        return load_cached_parc_doc(doc_num, include_nested, backend)
+    return parc3.parc_reader.read_parc_path(
+        get_parc_path(doc_num), doc_num, include_nested, backend)
+
+
+def load_cached_parc_doc(
+    doc_num, include_nested=True, backend=None, cache_dir=PARC_CACHE_DIR
+):
+    """
+    Loads a parc file from the cache of parsed documents in `cache_dir`.  If
+    there is no entry for the file, or if the file has changed since it was
+    cached, it is parsed and the cache entry is (re)written.
     """
-    return parc3.parc_reader.read_parc_file(
-        open(get_parc_path(doc_num)).read(), doc_num, include_nested
+    key = get_parc_cache_key(get_parc_path(doc_num), include_nested)
+    cache_path = get_parc_cache_path(doc_num, include_nested, cache_dir)
+    doc = read_parc_cache(cache_path, key)
+    if doc is None:
+        doc = load_parc_doc(doc_num, include_nested, backend)
+        write_parc_cache(cache_path, key, doc)
+    return doc
+
+
+def get_parc_cache_key(parc_path, include_nested):
+    """
+    Cache entries are only valid for the source file having the same path, size
+    and modification time, and for the same treatment of nested attributions.
+    """
+    with open(parc_path) as parc_file:
+        stat = os.fstat(parc_file.fileno())
+    return (
+        PARC_CACHE_VERSION, os.path.abspath(parc_path), stat.st_size,
+        stat.st_mtime, bool(include_nested)
     )
 
 
+def get_parc_cache_path(doc_num, include_nested, cache_dir=PARC_CACHE_DIR):
+    nested = 'nested' if include_nested else 'unnested'
+    fname = '%s.%s.pkl' % (get_parc_fname(doc_num), nested)
+    return os.path.join(cache_dir, fname)
+
+
+def read_parc_cache(cache_path, key):
+    """
+    Reads a document from the cache.  Returns None if there is no entry, the
+    entry was written under a different key, or it can't be unpickled (for
+    example, because the classes it was pickled from have changed).  The key
+    is stored ahead of the document, so a stale entry can be rejected without
+    unpickling it.
+    """
+    try:
+        with open(cache_path, 'rb') as cache_file:
+            if cPickle.load(cache_file) != key:
+                return None
+            return cPickle.load(cache_file)
+    except Exception:
+        LOGGER.debug(
+            'Could not read cache entry %s', cache_path, exc_info=True)
+        return None
+
+
+def write_parc_cache(cache_path, key, doc):
+    """
+    Writes a document to the cache.  Entries are written to a temporary file
+    that is then moved into place, so readers never see partial entries.
+    """
+    cache_dir = os.path.dirname(cache_path)
+    if not os.path.exists(cache_dir):
+        try:
+            os.makedirs(cache_dir)
+        except OSError:
+            if not os.path.isdir(cache_dir):
+                raise
+
+    fd, temp_path = tempfile.mkstemp(dir=cache_dir)
+    with os.fdopen(fd, 'wb') as temp_file:
+        cPickle.dump(key, temp_file, cPickle.HIGHEST_PROTOCOL)
+        cPickle.dump(doc, temp_file, cPickle.HIGHEST_PROTOCOL)
+    os.rename(temp_path, cache_path)
+
+
 
 
 def iter_doc_num(subset='train', skip=None, limit=None):
@@ -80,7 +180,15 @@ def iter_doc_num(subset='train', skip=None, limit=None):
         yield doc_num
 
 
-def iter_parc_docs(subset='train', skip=None, limit=None, include_nested=True):
+def iter_parc_docs(
+    subset='train',
+    skip=None,
+    limit=None,
+    include_nested=True,
+    processes=1,
+    chunksize=1,
+    use_cache=False
+):
     """
     Yields all parc files, parsed to surface tokenization, sentence splitting, 
     constituence parse structure, and attributions.
@@ -88,18 +196,65 @@ def iter_parc_docs(subset='train', skip=None, limit=None, include_nested=True):
 
         'train', 'test', 'dev', or 'all.
 
+    By default documents are loaded one at a time in this process.  Setting
+    `processes` to anything other than 1 loads them in a pool of that many
+    worker processes (`None` uses one per cpu), each taking `chunksize`
+    documents at a time.  Documents are yielded in order either way.
+
+    If `use_cache` is True, parsed documents are read from, or written to, the
+    on-disk cache (see `load_cached_parc_doc`).
     """
-    for doc_num in iter_doc_num(subset, skip=skip, limit=limit):
-        doc = try_do(load_parc_doc, doc_num, include_nested)
-        if doc is not None:
-            yield doc_num, doc
+    load_args = (
+        (doc_num, include_nested, use_cache)
+        for doc_num in iter_doc_num(subset, skip=skip, limit=limit)
+    )
+
+    if processes == 1:
+        for doc_num, doc in (try_load_parc_doc(args) for args in load_args):
+            if doc is not None:
+                yield doc_num, doc
+        return
 
+    pool = multiprocessing.Pool(processes)
+    try:
+        for doc_num, doc in pool.imap(try_load_parc_doc, load_args, chunksize):
+            if doc is not None:
+                yield doc_num, doc
+        pool.close()
+
+    # Don't leave workers behind if iteration is abandoned early.
+    finally:
+        pool.terminate()
+        pool.join()
 
-def read_all_parc_files(subset='train', skip=None, limit=None):
-    print 'Reading PARC3 files.  This will take a minute...'
+
+def try_load_parc_doc(args):
+    """
+    Loads a parc file as `load_parc_doc` does, but tolerates missing or
+    unparsable files by returning `None` for the document.  Takes a single
+    `(doc_num, include_nested, use_cache)` tuple so that it can be mapped over
+    a multiprocessing pool.
+    """
+    doc_num, include_nested, use_cache = args
+    return doc_num, try_do(
+        load_parc_doc, doc_num, include_nested, use_cache=use_cache)
+
+
+def read_all_parc_files(
+    subset='train',
+    skip=None,
+    limit=None,
+    processes=1,
+    chunksize=1,
+    use_cache=False
+):
+    LOGGER.info('Reading PARC3 files.  This will take a minute...')
     return {
         doc_num : doc
-        for doc_num, doc in iter_parc_docs(subset, skip=skip, limit=limit)
+        for doc_num, doc in iter_parc_docs(
+            subset, skip=skip, limit=limit, processes=processes,
+            chunksize=chunksize, use_cache=use_cache
+        )
     }
 
 
@@ -110,7 +265,7 @@ def iter_articles(subset='train'):
     ``'all'``.
     """
     for doc_num in iter_doc_num(subset):
-        doc = try_do(load_article, doc_num)
+        doc = try_do(load_parc_doc, doc_num)
         if doc is not None:
             yield get_parc_fname(doc_num), doc
 
@@ -146,17 +301,17 @@ def show_attributions(attribution_ids, limit=None):
     # Get the set of articles (by article number) containing the attributions
     article_nums = set([get_article_num(att_id) for att_id in attribution_ids])
 
-    print '%d articles to load...' % len(article_nums)
+    LOGGER.info('%d articles to load...', len(article_nums))
 
     # Load the articles that contain the desired attributions
     articles = {}
     for doc_num in article_nums:
-        print 'loading article %d' % doc_num
-        articles[doc_num] = load_article(doc_num)
+        LOGGER.debug('loading article %d', doc_num)
+        articles[doc_num] = load_parc_doc(doc_num)
 
     # Get the real attribution objects for the desired attributions
     attributions = [
-        articles[get_article_num(attr_id)].attributions[attr_id]
+        articles[get_article_num(attr_id)].annotations['attributions'][attr_id]
         for attr_id in attribution_ids
     ]
 
@@ -189,6 +344,32 @@ def show_attributions(attribution_ids, limit=None):
     subprocess.check_output(['open', out_path])
 
 
+def get_article_size(article):
+    '''
+    The number of tokens in an article, which stands in for the memory it
+    takes up.
+    '''
+    return len(article.tokens)
+
+
+def get_attribution_roles(article, attribution):
+    '''
+    The tokens of each of an attribution's roles, as the dicts of token
+    fields that `parc3.attribution_index.AttributionIndex` takes: the
+    token's text as its 'word', and its 'lemma' and 'pos' where it has them.
+    '''
+    roles = {}
+    for role in parc3.attribution_index.ROLES:
+        roles[role] = []
+        for token in article.get_tokens(attribution[role]):
+            index_token = {'word': token['text']}
+            for field in ('lemma', 'pos'):
+                if field in token:
+                    index_token[field] = token[field]
+            roles[role].append(index_token)
+    return roles
+
+
 def safe_append(dictionary, key, val):
     '''
     Simulates defaultdict behavior where the default is an empty list
@@ -200,6 +381,15 @@ def safe_append(dictionary, key, val):
 
 
 class ParcDataset(object):
+    '''
+    The attributions of a set of PARC articles, indexed by their cues,
+    sources, and contents.
+
+    Normally every article is kept in memory.  If `lazy` is True, only the
+    index stays resident, and articles are loaded on demand into an LRU
+    cache, holding at most `max_articles` articles and / or articles
+    totalling at most `max_tokens` tokens.
+    '''
 
     def __init__(
         self, 
@@ -208,8 +398,15 @@ class ParcDataset(object):
         limit=MAX_ARTICLE_NUM,
         article_nums=None,
         num_attributions=None,
+        lazy=False,
+        max_articles=None,
+        max_tokens=None,
     ):
 
+        self.lazy = lazy
+        self.max_articles = max_articles
+        self.max_tokens = max_tokens
+
         if load is not None:
             self.load(load)
         else:
@@ -245,11 +442,13 @@ class ParcDataset(object):
         of article_nums, in which case start and limit are ignored.
         '''
 
-        self.articles = {}
+        self.articles = self.make_article_store()
+        self.article_nums = []
         self.cues = {}
         self.contents = {}
         self.sources = {}
         self._attributions = {}
+        self.index = parc3.attribution_index.AttributionIndex()
 
         # Pack all data into a tuple for easy saving and loading
         self.data = self.articles, self.cues, self.contents, self.sources
@@ -266,73 +465,171 @@ class ParcDataset(object):
                 if len(self._attributions) >= num_attributions:
                     break
 
-            fname = 'wsj_%s' % str(doc_num).zfill(4)
-            print 'reading %s...' % fname
+            LOGGER.debug('reading %s...', get_parc_fname(doc_num))
 
             # Load each article, but tolerate missing files.  There are
             # frequently holes in the file name series.
             try:
-                article = load_article(doc_num)
+                article = load_parc_doc(doc_num)
             except IOError:
+                parc3.log.count('docs_skipped')
                 continue
 
             self.articles[doc_num] = article
+            self.article_nums.append(doc_num)
+
+            attributions = article.annotations['attributions']
+            for attribution_id in sorted(attributions):
 
-            for sentence in article.sentences:
+                if attribution_id in self._attributions:
+                    continue
 
-                for attribution_id in sentence['attributions']:
+                back_pointer = {
+                    'doc_num': doc_num, 
+                    'attribution_id': attribution_id
+                }
+                roles = get_attribution_roles(
+                    article, attributions[attribution_id])
 
-                    attribution = sentence['attributions'][attribution_id]
-                    back_pointer = {
-                        'doc_num': doc_num, 
-                        'attribution_id': attribution_id
-                    }
+                self._attributions[attribution_id] = back_pointer
+                self.index.add(back_pointer, roles)
 
-                    if attribution_id in self._attributions:
-                        continue
-                    
-                    self._attributions[attribution_id] = back_pointer
+                cue = ' '.join([t['word'] for t in roles['cue']])
+                safe_append(self.cues, cue, back_pointer)
 
-                    cue = ' '.join([t['word'] for t in attribution['cue']])
-                    safe_append(self.cues, cue, back_pointer)
+                source = ' '.join([t['word'] for t in roles['source']])
+                safe_append(self.sources, source, back_pointer)
 
-                    source = ' '.join([
-                        t['word'] for t in attribution['source']])
-                    safe_append(self.sources, source, back_pointer)
+                content = ' '.join([t['word'] for t in roles['content']])
+                safe_append(self.contents, content, back_pointer)
 
-                    content = ' '.join([
-                        t['word'] for t in attribution['content']])
-                    safe_append(self.contents, content, back_pointer)
+
+    def make_article_store(self, load=None):
+        if not self.lazy:
+            return {}
+        if load is None:
+            load = load_parc_doc
+        return parc3.utils.LRUCache(
+            load, self.max_articles, self.max_tokens, get_article_size)
+
+
+    def save(self, path):
+        '''
+        Save the dataset to a single file at `path`.  After a header, the
+        file holds each article pickled separately, followed by the index,
+        which records where each article is.  Loading maps the file into
+        memory, and only unpickles articles once they are needed.
+        '''
+        save_dir = os.path.dirname(os.path.abspath(path))
+        fd, temp_path = tempfile.mkstemp(dir=save_dir)
+        with os.fdopen(fd, 'wb') as out_file:
+            out_file.write('\0' * DATASET_HEADER.size)
+
+            article_offsets = {}
+            for doc_num in self.article_nums:
+                serialized = cPickle.dumps(
+                    self.articles[doc_num], cPickle.HIGHEST_PROTOCOL)
+                article_offsets[doc_num] = (out_file.tell(), len(serialized))
+                out_file.write(serialized)
+
+            index = {
+                'article_nums': self.article_nums,
+                'article_offsets': article_offsets,
+                'cues': self.cues,
+                'contents': self.contents,
+                'sources': self.sources,
+                'attributions': self._attributions,
+                'index': self.index,
+            }
+            index_offset = out_file.tell()
+            cPickle.dump(index, out_file, cPickle.HIGHEST_PROTOCOL)
+            index_length = out_file.tell() - index_offset
+
+            out_file.seek(0)
+            out_file.write(DATASET_HEADER.pack(
+                DATASET_MAGIC, DATASET_FORMAT_VERSION, index_offset,
+                index_length
+            ))
+        os.rename(temp_path, path)
+
+
+    def load(self, path):
+        '''
+        Load a dataset saved by `save`.  Only the index is unpickled here;
+        articles are unpickled from the memory-mapped file on first access.
+        '''
+        with open(path, 'rb') as in_file:
+            self.saved_data = mmap.mmap(
+                in_file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, version, index_offset, index_length = DATASET_HEADER.unpack(
+            self.saved_data[:DATASET_HEADER.size])
+        if magic != DATASET_MAGIC:
+            raise ValueError('%s is not a saved ParcDataset.' % path)
+        if version != DATASET_FORMAT_VERSION:
+            raise ValueError(
+                '%s was saved in format version %d, but version %d is '
+                'needed.  Rebuild and save the dataset again.'
+                % (path, version, DATASET_FORMAT_VERSION)
+            )
+
+        index = cPickle.loads(
+            self.saved_data[index_offset:index_offset+index_length])
+        self.article_nums = index['article_nums']
+        self.article_offsets = index['article_offsets']
+        self.cues = index['cues']
+        self.contents = index['contents']
+        self.sources = index['sources']
+        self._attributions = index['attributions']
+        self.index = index['index']
+
+        # Even when not lazy, articles are only unpickled as they are needed,
+        # though they are then kept.
+        if self.lazy:
+            self.articles = self.make_article_store(self.read_saved_article)
+        else:
+            self.articles = parc3.utils.LRUCache(self.read_saved_article)
+
+        self.data = self.articles, self.cues, self.contents, self.sources
+
+
+    def read_saved_article(self, doc_num):
+        offset, length = self.article_offsets[doc_num]
+        return cPickle.loads(self.saved_data[offset:offset+length])
+
+
+    def query(self, **conditions):
+        '''
+        Return back-pointers to the attributions satisfying all of the
+        conditions.  See `parc3.attribution_index.AttributionIndex.query`.
+        '''
+        return self.index.query(**conditions)
 
 
     def print_cue_grep(self, pattern):
-        matcher = re.compile(pattern)
-        for cue in self.cues:
-            if matcher.search(cue):
-                print cue.upper()
-                for example in self.cues[cue]:
-                    attribution_id = example['attribution_id']
-                    print attribution_id
-                    article = self.articles[example['doc_num']]
-
-                    attribution = article.attributions[attribution_id]
-                    sentence_ids = attribution.get_sentence_ids()
-                    print sentence_ids
-                    sentences = article.sentences[
-                            min(sentence_ids) : max(sentence_ids) + 1
-                    ]
-                    tokens = t4k.flatten([s['tokens'] for s in sentences])
-                    print '-->\t' + ' '.join(
-                        [t['word'] for t in tokens])
-                print '\n'
+        for cue in self.index.match_texts('cue', pattern):
+            print cue.upper()
+            for example in self.cues[cue]:
+                attribution_id = example['attribution_id']
+                print attribution_id
+                article = self.articles[example['doc_num']]
+
+                attribution = article.attributions[attribution_id]
+                sentence_ids = attribution.get_sentence_ids()
+                print sentence_ids
+                sentences = article.sentences[
+                        min(sentence_ids) : max(sentence_ids) + 1
+                ]
+                tokens = t4k.flatten([s['tokens'] for s in sentences])
+                print '-->\t' + ' '.join(
+                    [t['word'] for t in tokens])
+            print '\n'
 
 
     def source_grep(self, pattern):
-        matcher = re.compile(pattern)
         matched_sources = {}
-        for source in self.sources:
-            if matcher.search(source):
-                matched_sources[source] = self.sources[source]
+        for source in self.index.match_texts('source', pattern):
+            matched_sources[source] = self.sources[source]
 
         return matched_sources
 
@@ -365,11 +662,9 @@ class ParcDataset(object):
 
 
     def cue_grep(self, pattern):
-        matcher = re.compile(pattern)
         matched_cues = {}
-        for cue in self.cues:
-            if matcher.search(cue):
-                matched_cues[cue] = self.cues[cue]
+        for cue in self.index.match_texts('cue', pattern):
+            matched_cues[cue] = self.cues[cue]
 
         return matched_cues
 
@@ -387,17 +682,23 @@ class ParcDataset(object):
     def attributions(self):
         '''
         Generator that yields the fully populated attributions from the
-        dataset reader.
+        dataset reader.  They are yielded article by article, so that lazily
+        loaded articles are only loaded once.
         '''
-        for attribution_spec in self._attributions:
+        attribution_specs = sorted(
+            self._attributions.values(),
+            key=lambda spec: spec['doc_num']
+        )
+        for attribution_spec in attribution_specs:
             article = self.articles[attribution_spec['doc_num']]
-            attribution = article.attributions[
+            attribution = article.annotations['attributions'][
                 attribution_spec['attribution_id']]
             yield attribution, article
 
 
     def get_attribution(self, doc_num, attribution_id):
-        return self.articles[doc_num].attributions[attribution_id]
+        article = self.articles[doc_num]
+        return article.annotations['attributions'][attribution_id]
 
 
     def get_attribution_html(
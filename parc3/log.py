@@ -0,0 +1,72 @@
+'''
+Logging and counters for the long-running reading and merging routines.
+
+Modules log to loggers under the "parc3" logger, which has a `NullHandler`,
+so nothing is printed until a handler is attached (see `enable`).  Messages
+that are costly to build are only built when their level is enabled.
+
+Counters tally events worth keeping an eye on, like tokens split while
+merging tokenizations, propbank verbs matched only approximately, and
+documents skipped.  Counting is just a dict update, so counters are always
+on.  The counter names used are listed in `COUNTERS`.
+'''
+
+import logging
+from collections import Counter
+
+
+LOGGER_NAME = 'parc3'
+LOG_FORMAT = '%(asctime)s %(name)s %(levelname)s: %(message)s'
+COUNTERS = (
+    'tokens_split',
+    'tokens_unaligned',
+    'propbank_exact_matches',
+    'propbank_fuzzy_matches',
+    'propbank_unmatched',
+    'docs_skipped',
+    'docs_failed',
+)
+
+logging.getLogger(LOGGER_NAME).addHandler(logging.NullHandler())
+
+COUNTS = Counter()
+
+
+def count(name, amount=1):
+    COUNTS[name] += amount
+
+
+def get_counts():
+    """Return a snapshot of the counters, as a dict."""
+    return dict(COUNTS)
+
+
+def reset_counts():
+    COUNTS.clear()
+
+
+def add_counts(counts):
+    """
+    Add counts tallied elsewhere, like in a worker process, to the counters.
+    """
+    COUNTS.update(counts)
+
+
+def enable(level=logging.INFO, stream=None, fmt=LOG_FORMAT):
+    """
+    Start showing parc3's log messages at `level` and above, written to
+    `stream` (stderr by default).  Returns the handler that was attached, which
+    can be passed to `disable`.
+    """
+    handler = logging.StreamHandler(stream)
+    handler.setFormatter(logging.Formatter(fmt))
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    return handler
+
+
+def disable(handler):
+    logger = logging.getLogger(LOGGER_NAME)
+    logger.removeHandler(handler)
+    logger.setLevel(logging.NOTSET)
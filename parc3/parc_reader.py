@@ -1,13 +1,32 @@
+import logging
 import parc3
 from bs4 import BeautifulSoup as Soup
 from collections import defaultdict
 from brat_reader import BratAnnotatedText
+from StringIO import StringIO
+
+# Prefer lxml's iterparse, but the standard library's C implementation offers
+# the same interface.
+try:
+    from lxml import etree
+except ImportError:
+    import xml.etree.cElementTree as etree
+
+LOGGER = logging.getLogger(__name__)
 
 ROLES = {'cue', 'content', 'source'}
 
+# Backend used by read_parc_file when none is given.  Either 'soup', which
+# builds a complete BeautifulSoup tree before walking it, or 'iterparse',
+# which builds the document straight from the stream of xml parse events.
+PARSER_BACKENDS = ('soup', 'iterparse')
+PARSER_BACKEND = 'soup'
 
 
-def read_parc_file(parc_xml, doc_id=None, include_nested=False):
+
+def read_parc_file(
+    parc_xml, doc_id=None, include_nested=False, backend=None
+):
     """
     This reads in annotation information from parc xml files.  
     It includes the following annotations:
@@ -21,13 +40,67 @@ def read_parc_file(parc_xml, doc_id=None, include_nested=False):
     Because it carries it's own alignment of annotations onto tokens, it
     can be combined with annotations whose opinion on tokenization differs
     slightly, as long as some effort to reconcile tokens is made. 
+
+    The xml can be parsed by either of the backends listed in
+    `PARSER_BACKENDS`; both produce identical documents.  If `backend` is not
+    given, `PARSER_BACKEND` is used.
+
+    `parc_xml` is either the xml as a string, or a file object to read it
+    from.  The 'iterparse' backend parses a file object as a stream, without
+    reading the whole file into memory first (see `read_parc_path`).
     """
-    soup = Soup(parc_xml, 'html.parser')
-    sentence_wrapper_tags = soup.find_all('sentence')
+    backend = PARSER_BACKEND if backend is None else backend
     annotated_doc = parc3.annotated_document.AnnotatedDocument(
         doc_id=doc_id)
+
+    if backend == 'soup':
+        all_attributions = soup_parse(parc_xml, annotated_doc, include_nested)
+    elif backend == 'iterparse':
+        all_attributions = iterparse_parse(
+            parc_xml, annotated_doc, include_nested)
+    else:
+        raise ValueError(
+            'Unknown parser backend "%s".  Expected one of: %s.'
+            % (backend, ', '.join(PARSER_BACKENDS))
+        )
+
+    # Assemble attribution fragments and use sentence-relative addressing
+    attributions = stitch_attributions(all_attributions, annotated_doc)
+    annotated_doc.annotations['attributions'] = attributions
+
+    # Make non-sentence constituents use sentence-relative addressing
+    annotated_doc.relativize_spans([
+        constituent['token_span']
+        for sentence in annotated_doc.sentences
+        for child in sentence['constituent_children']
+        for _, constituent in parc3.spans.iter_constituents(child)
+    ])
+
+    return annotated_doc
+
+
+
+def read_parc_path(
+    parc_path, doc_id=None, include_nested=False, backend=None
+):
+    """
+    Read the parc xml file at `parc_path`, as `read_parc_file` does.  The
+    file is handed to the parser open, so the 'iterparse' backend streams it.
+    """
+    with open(parc_path, 'rb') as parc_file:
+        return read_parc_file(parc_file, doc_id, include_nested, backend)
+
+
+
+def soup_parse(parc_xml, annotated_doc, include_nested=False):
+    """
+    Builds a complete BeautifulSoup tree for the xml, then recursively walks
+    each sentence, adding tokens and sentences to `annotated_doc`.  Returns
+    the attribution fragments found on tokens.
+    """
+    soup = Soup(parc_xml, 'html.parser')
+    sentence_wrapper_tags = soup.find_all('sentence')
     all_attributions = []
-    #print 'doc_id', doc_id
     for sentence_id, sentence_wrapper_tag in enumerate(sentence_wrapper_tags):
         real_sentence_tag = parc3.utils.first_non_text_child(
             sentence_wrapper_tag)
@@ -35,16 +108,202 @@ def read_parc_file(parc_xml, doc_id=None, include_nested=False):
             real_sentence_tag, annotated_doc, include_nested=include_nested)
         all_attributions.extend(attributions)
 
-    # Assemble attribution fragments and use sentence-relative addressing
-    attributions = stitch_attributions(all_attributions, annotated_doc)
-    annotated_doc.annotations['attributions'] = attributions
+    return all_attributions
 
-    # Make non-sentence constituents use sentence-relative addressing
-    for sentence in annotated_doc.sentences:
-        for child in sentence['constituent_children']:
-            child.relativize(annotated_doc)
 
-    return annotated_doc
+
+def iterparse_parse(parc_xml, annotated_doc, include_nested=False):
+    """
+    Streaming counterpart to `soup_parse`.  Tokens, constituents and
+    attribution fragments are built directly from the start / end events
+    emitted while parsing, and elements are discarded as soon as they have
+    been handled, so no document tree is ever held in memory.
+
+    The same structure is produced as by `recursively_parse`: only the first
+    child of each <sentence> is parsed, <none> and childless constituents are
+    dropped (along with the attributions found under them), and nested
+    attributions are optionally excluded.
+
+    `parc_xml` is the xml as a string, or a file object, which is parsed
+    directly from the file.
+    """
+    if isinstance(parc_xml, unicode):
+        parc_xml = parc_xml.encode('utf8')
+    if isinstance(parc_xml, str):
+        parc_xml = StringIO(parc_xml)
+
+    all_attributions = []
+
+    # Each open constituent has a frame on the stack holding its node and the
+    # attribution fragments found beneath it.
+    stack = []
+
+    # Depth of the open <sentence> wrapper, and whether its first child (the
+    # real sentence constituent) has been seen yet.
+    depth = 0
+    wrapper_depth = None
+    found_sentence_tag = False
+
+    # While inside a <word>, or inside an element that isn't parsed, events
+    # are ignored until the element at this depth closes.
+    skip_depth = None
+
+    events = etree.iterparse(parc_xml, events=('start', 'end'))
+    for event, element in events:
+        name = element.tag.lower()
+
+        if event == 'start':
+            depth += 1
+
+            if skip_depth is not None:
+                continue
+
+            # Words are handled all at once, when they close.
+            if stack and name == 'word':
+                skip_depth = depth
+
+            elif stack:
+                if name == 'attribution':
+                    raise ValueError(
+                        'Got <attribution> tag.  Expecting a constituency '
+                        'tag.'
+                    )
+                stack.append((make_constituent(name, element.attrib), []))
+
+            elif wrapper_depth is None:
+                if name == 'sentence':
+                    wrapper_depth = depth
+                    found_sentence_tag = False
+
+            # This is the first child of a <sentence>: the real sentence tag.
+            elif depth == wrapper_depth + 1 and not found_sentence_tag:
+                found_sentence_tag = True
+                if name == 'attribution' or name == 'word':
+                    raise ValueError(
+                        'Expected non-token constituency tag.  Got <%s>.'
+                        % name
+                    )
+                stack.append((make_constituent(name, element.attrib), []))
+
+            # Anything else under the wrapper is ignored.
+            else:
+                skip_depth = depth
+
+            continue
+
+        # Handle end events.
+        depth -= 1
+
+        if skip_depth is not None:
+            if depth + 1 != skip_depth:
+                continue
+            skip_depth = None
+
+            if name == 'word' and stack:
+                node, attributions = stack[-1]
+                token = make_token(
+                    element.attrib,
+                    [
+                        parse_attribution_element(child)
+                        for child in element if is_element(child)
+                    ],
+                    include_nested
+                )
+                attributions.extend(
+                    add_token_to_constituent(token, node, annotated_doc))
+
+            element.clear()
+            continue
+
+        if stack:
+            node, attributions = stack.pop()
+            node['token_span'].consolidate()
+            element.clear()
+
+            # The sentence constituent is complete.
+            if not stack:
+                annotated_doc.add_sentence(node)
+                all_attributions.extend(attributions)
+                continue
+
+            parent, parent_attributions = stack[-1]
+            if add_child_constituent(node, parent):
+                parent_attributions.extend(attributions)
+
+        elif wrapper_depth is not None and depth + 1 == wrapper_depth:
+            wrapper_depth = None
+            element.clear()
+
+    return all_attributions
+
+
+
+def make_constituent(node_type, attrs):
+    # We're building a constituency parse node from an xml tag.
+    # Each constituent is modelled as a span that has direct references to its
+    # children.  Then need to be modelled as absolute spans at first.
+    return parc3.spans.Constituency({
+        'constituent_type': node_type
+    }, absolute=True, **normalize_attrs(attrs))
+
+
+def normalize_attrs(attrs):
+    """
+    Lowercase attribute names and coerce values to unicode, so that attributes
+    read by an xml parser look like those read by BeautifulSoup's html.parser.
+    """
+    return {
+        unicode(key).lower(): unicode(value) for key, value in attrs.items()
+    }
+
+
+def add_token_to_constituent(token, node, annotated_doc):
+    """
+    Add `token` to the document, and point the constituent `node` and the
+    token's attribution fragments at it.  Returns the attribution fragments.
+    """
+    token['sentence_id'] = len(annotated_doc.sentences)
+    token_attributions = token['attributions']
+
+    abs_id = annotated_doc.add_token(token)
+    token_pointer = (None, abs_id, abs_id+1)
+    for attribution in token_attributions:
+        attribution['token_span'].add_token_range(token_pointer)
+    node['token_span'].add_token_range(token_pointer)
+
+    # As usual, we only want to provide a pointer to tokens, but for
+    # consistency in traversing the constituency tree, the token should
+    # appear in the node's constituent_children list.  We provide only
+    # a stub to create the link
+    node['constituent_children'].append(
+        parc3.spans.Constituency({
+            'constituent_type': 'token',
+            'sentence_id': len(annotated_doc.sentences),
+            'token_span': parc3.spans.TokenSpan.from_trusted_ranges(
+                [token_pointer], absolute=True)
+        }, absolute=True)
+    )
+
+    return token_attributions
+
+
+def add_child_constituent(child_node, node):
+    """
+    Attach a parsed internal constituent to its parent.  Returns False if the
+    child was refused.
+    """
+    # Refuse children that are <none> tags
+    if child_node['constituent_type'] == 'none':
+        return False
+
+    # Refuse children that themselves have no children, depste not
+    # being tokens.
+    if len(child_node['constituent_children']) == 0:
+        return False
+
+    node['token_span'].add_token_ranges(child_node['token_span'])
+    node['constituent_children'].append(child_node)
+    return True
 
 
 
@@ -65,7 +324,11 @@ def stitch_attributions(attribution_specs, annotated_doc):
     for attribution in attributions.values():
         for role in attribution.ROLES:
             attribution[role].consolidate()
-        attribution.relativize(annotated_doc)
+    annotated_doc.relativize_spans([
+        attribution[role]
+        for attribution in attributions.values()
+        for role in attribution.ROLES
+    ])
 
     return attributions
 
@@ -80,12 +343,7 @@ def recursively_parse(tag, annotated_doc, depth=0, include_nested=True):
             'Expected non-token constituency tag.  Got <%s>.'
             % tag.name.lower())
 
-    # We're building a constituency parse node from an xml tag.
-    # Each constituent is modelled as a span that has direct references to its
-    # children.  Then need to be modelled as absolute spans at first.
-    node = parc3.spans.Constituency({
-        'constituent_type': node_type
-    }, absolute=True, **tag.attrs)
+    node = make_constituent(node_type, tag.attrs)
 
     # We'll capture attributions from children
     attributions = []
@@ -96,52 +354,24 @@ def recursively_parse(tag, annotated_doc, depth=0, include_nested=True):
         # We shouldn't encounter attributions as direct children of internal
         # constituency nodes.
         if child_tag.name.lower() == 'attribution':
-            print 'this node:', node
-            print 'this tag:', tag
+            LOGGER.debug('this node: %s', node)
+            LOGGER.debug('this tag: %s', tag)
             raise ValueError(
                 'Got <attribution> tag.  Expecting a constituency tag.')
 
         # Handle parsing child tokens
         elif child_tag.name.lower() == 'word':
             child_node = parse_token(child_tag, include_nested)
-            child_node['sentence_id'] = len(annotated_doc.sentences)
-            child_attributions = child_node['attributions']
-
-            abs_id = annotated_doc.add_token(child_node)
-            token_pointer = (None, abs_id, abs_id+1)
-            for attribution in child_attributions:
-                attribution['token_span'].add_token_range(token_pointer)
-            node['token_span'].add_token_range(token_pointer)
-
-            # As usual, we only want to provide a pointer to tokens, but for
-            # consistency in traversing the constituency tree, the token should
-            # appear in the node's constituent_children list.  We provide only
-            # a stub to create the link
-            node['constituent_children'].append(
-                parc3.spans.Constituency({
-                    'constituent_type': 'token',
-                    'sentence_id': len(annotated_doc.sentences),
-                    'token_span': [(None, abs_id, abs_id+1)]
-                }, absolute=True)
-            )
+            child_attributions = add_token_to_constituent(
+                child_node, node, annotated_doc)
 
         # Handle parsing child internal constituency nodes
         else:
             child_node, child_attributions = recursively_parse(
                 child_tag, annotated_doc, depth+1, include_nested)
-
-            # Refuse children that are <none> tags
-            if child_node['constituent_type'] == 'none':
-                continue
-
-            # Refuse children that themselves have no children, depste not
-            # being tokens.
-            if len(child_node['constituent_children']) == 0:
+            if not add_child_constituent(child_node, node):
                 continue
 
-            node['token_span'].add_token_ranges(child_node['token_span'])
-            node['constituent_children'].append(child_node)
-
         attributions.extend(child_attributions)
 
     node['token_span'].consolidate()
@@ -162,13 +392,26 @@ def parse_token(tag, include_nested=True):
     if tag_name != 'word':
         raise ValueError('Expecting a <word> tag, but got <%s>' % tag_name)
 
+    attributions = [
+        parse_attribution(attr_tag)
+        for attr_tag in parc3.utils.non_text_children(tag)
+    ]
+    return make_token(tag.attrs, attributions, include_nested)
+
+
+def make_token(attrs, attributions, include_nested=True):
+    """
+    Build a token from the attributes of a <word> tag and the attribution
+    fragments parsed from its children.
+    """
+
     # We're building a leaf node in the constituency parse; a *token*.
     node = {'is_token': True}
-    node.update(tag.attrs)
+    node.update(normalize_attrs(attrs))
     node['is_token'] = True
 
     # Correct an inconsistency in WSJ document 4 of PTB2
-    if tag['gorn'].split(',')[0] == '1':
+    if node['gorn'].split(',')[0] == '1':
         if node['text'] == 'IBC/Donoghue':
             node['text'] = 'IBC'
 
@@ -176,9 +419,8 @@ def parse_token(tag, include_nested=True):
     # annotations appear as children in the xml.
     node['attributions'] = []
 
-    # Parse any attribution tags.  Ignore nested ones if desired.
-    for attr_tag in parc3.utils.non_text_children(tag):
-        attribution = parse_attribution(attr_tag)
+    # Keep the attribution fragments.  Ignore nested ones if desired.
+    for attribution in attributions:
         if not include_nested and 'Nested' in attribution['id']:
             continue
         node['attributions'].append(attribution)
@@ -193,3 +435,22 @@ def parse_attribution(tag):
     }, absolute=True)
 
 
+def parse_attribution_element(element):
+    """Counterpart to `parse_attribution` for xml.etree-style elements."""
+    attrs = normalize_attrs(element.attrib)
+    return parc3.spans.Span({
+        'id': attrs['id'],
+        'roles': [
+            normalize_attrs(role_element.attrib)['rolevalue']
+            for role_element in element.iter()
+            if is_element(role_element)
+            and role_element.tag.lower() == 'attributionrole'
+        ]
+    }, absolute=True)
+
+
+def is_element(element):
+    """Comments and processing instructions don't have string tags."""
+    return isinstance(element.tag, basestring)
+
+
@@ -1,6 +1,10 @@
 import os
 import sys
 import json
+import logging
+
+
+LOGGER = logging.getLogger(__name__)
 
 
 def get_path_config():
@@ -26,20 +30,19 @@ def get_path_config():
                 + ', '.join(unexpected_keys)
             )
 
-        print "Using paths set in '~/.parc3rc':"
+        LOGGER.debug("Using paths set in '~/.parc3rc'")
         PATH_CONFIG.update(RC_PATH_CONFIG)
 
 
     # Fail if the corenlpyrc file has invalid json
     except ValueError:
-            print "invalid json in '~/.parc3rc'"
-            sys.exit(1)
+            sys.exit("invalid json in '~/.parc3rc'")
 
     # Tolerate missing file or unspecified corenlp_path silently
     except IOError:
-            print 'Using default paths:'
-            pass
+            LOGGER.debug('Using default paths')
 
-    print json.dumps(PATH_CONFIG, indent=2)
+    if LOGGER.isEnabledFor(logging.DEBUG):
+        LOGGER.debug('Paths: %s', json.dumps(PATH_CONFIG, indent=2))
 
     return PATH_CONFIG
@@ -1,4 +1,31 @@
+import bisect
 import parc3
+from array import array
+from collections import Mapping, defaultdict
+
+# Spans and attributions store their token ranges in an ArrayTokenSpan, rather
+# than a TokenSpan, when this is set.
+COMPACT_TOKEN_SPANS = False
+
+# Ranges passed to `from_trusted_ranges` and `replace_with_trusted` are
+# assigned without being checked, unless this is set (for debugging).
+VALIDATE_TRUSTED_RANGES = False
+
+
+def make_token_span(token_span=None, absolute=False):
+    """
+    Make a TokenSpan, or an ArrayTokenSpan if `COMPACT_TOKEN_SPANS` is set.
+    The ranges of a consolidated span are copied without being checked again.
+    """
+    span_class = ArrayTokenSpan if COMPACT_TOKEN_SPANS else TokenSpan
+    if (
+        isinstance(token_span, TokenSpanBase)
+        and token_span.absolute == absolute
+        and token_span.consolidated
+    ):
+        return span_class.from_trusted_ranges(token_span, absolute=absolute)
+    return span_class(token_span, absolute=absolute)
+
 
 class Span(dict):
     """
@@ -18,7 +45,7 @@ class Span(dict):
 
     def initialize_tokens(self, absolute):
         token_span = self.pop('token_span', [])
-        self['token_span'] = TokenSpan(token_span, absolute=absolute)
+        self['token_span'] = make_token_span(token_span, absolute=absolute)
 
 
     def add_token_ranges(self, token_ranges):
@@ -33,6 +60,10 @@ class Span(dict):
         self['token_span'].accomodate_inserted_token(abs_id,sentence_id,rel_id)
 
 
+    def accomodate_inserted_tokens(self, insertion_points):
+        self['token_span'].accomodate_inserted_tokens(insertion_points)
+
+
     def relativize(self, doc):
         self['token_span'].relativize(doc)
 
@@ -54,16 +85,240 @@ class Constituency(Span):
             child.accomodate_inserted_token(abs_id, sentence_id, rel_id)
 
 
-    def relativize(self, doc):
-        super(Constituency, self).relativize(doc)
+    def accomodate_inserted_tokens(self, insertion_points):
+        super(Constituency, self).accomodate_inserted_tokens(insertion_points)
         for child in self['constituent_children']:
-            child.relativize(doc)
+            child.accomodate_inserted_tokens(insertion_points)
+
+
+    def relativize(self, doc):
+        doc.relativize_spans([
+            constituent['token_span']
+            for _, constituent in iter_constituents(self)
+        ])
+
+
+class FlatConstituencyTree(object):
+    """
+    A compact encoding of one sentence's constituency tree.  Rather than
+    nesting Constituency dicts, nodes are numbered in depth-first pre-order
+    (the root is node 0), and the tree is held in parallel integer arrays:
+    each node's parent, first child, and next sibling (`NO_NODE` where there
+    is none), its label ID, and the start and end of its token range.
+
+    Token ranges in the arrays are relative to the sentence, including the
+    root's, but the root reports the root's own `root_token_span`, which is
+    the sentence's token span, so that it follows the sentence when tokens
+    are inserted.  Labels are the constituent types, including 'token' for
+    leaves; `labels` maps them to label IDs.
+
+    Any other keys that nodes have, like the parser's xml attributes, or the
+    'sentence_id' of tokens, are kept as a tuple of values for each node,
+    along with the ID of the tuple of their names in `attribute_names`.
+    """
+
+    NO_NODE = -1
+
+    # Keys of nodes that are encoded in the arrays.
+    STRUCTURE_KEYS = ('constituent_type', 'token_span', 'constituent_children')
+
+    def __init__(self, sentence_id=None):
+        self.sentence_id = sentence_id
+        self.root_token_span = None
+        self.labels = parc3.utils.IncrementingMap()
+        self.parents = array('i')
+        self.first_children = array('i')
+        self.next_siblings = array('i')
+        self.label_ids = array('i')
+        self.starts = array('i')
+        self.ends = array('i')
+        self.attribute_names = parc3.utils.IncrementingMap()
+        self.attribute_name_ids = array('i')
+        self.attribute_values = []
+
+
+    @classmethod
+    def from_constituency(cls, root, sentence_id=None):
+        """
+        Encode the tree of Constituency nodes under `root`.  Absolutely
+        addressed ranges are made relative to the start of the root.
+        """
+        tree = cls(sentence_id)
+        tree.root_token_span = root['token_span']
+        _, root_start, _ = tree.root_token_span.get_single_range()
+
+        # The most recently added child of each node, for linking siblings.
+        last_children = []
+
+        stack = [(root, cls.NO_NODE)]
+        while stack:
+            node, parent = stack.pop()
+
+            range_sentence_id, start, end = (
+                node['token_span'].get_single_range())
+            if range_sentence_id is None:
+                start, end = start - root_start, end - root_start
+
+            attributes = [
+                (name, value) for name, value in sorted(node.items())
+                if name not in cls.STRUCTURE_KEYS and name != 'flat_tree'
+            ]
+            index = tree.add_node(
+                node['constituent_type'], start, end, parent, attributes)
+            last_children.append(cls.NO_NODE)
+            if parent != cls.NO_NODE:
+                if last_children[parent] == cls.NO_NODE:
+                    tree.first_children[parent] = index
+                else:
+                    tree.next_siblings[last_children[parent]] = index
+                last_children[parent] = index
+
+            # Push children in reverse, so that they're numbered in order.
+            children = get_constituency_children(node)
+            stack.extend([(child, index) for child in reversed(children)])
+
+        return tree
+
+
+    def add_node(self, label, start, end, parent=NO_NODE, attributes=()):
+        """
+        Append a node, returning its index.  `attributes` are the node's
+        other `(name, value)` pairs.  Linking it to its siblings is left to
+        the caller.
+        """
+        self.labels.add(label)
+        self.parents.append(parent)
+        self.first_children.append(self.NO_NODE)
+        self.next_siblings.append(self.NO_NODE)
+        self.label_ids.append(self.labels[label])
+        self.starts.append(start)
+        self.ends.append(end)
+
+        names = tuple([name for name, value in attributes])
+        self.attribute_names.add(names)
+        self.attribute_name_ids.append(self.attribute_names[names])
+        self.attribute_values.append(
+            tuple([value for name, value in attributes]))
+        return len(self.parents) - 1
+
+
+    def get_attribute_names(self, index):
+        return self.attribute_names.key(self.attribute_name_ids[index])
+
+
+    def get_attribute(self, index, name):
+        """Return a node's other attribute `name`, or raise KeyError."""
+        try:
+            position = self.get_attribute_names(index).index(name)
+        except ValueError:
+            raise KeyError(name)
+        return self.attribute_values[index][position]
+
+
+    def __len__(self):
+        return len(self.parents)
+
+
+    def get_label(self, index):
+        return self.labels.key(self.label_ids[index])
+
+
+    def get_children(self, index):
+        children = []
+        child = self.first_children[index]
+        while child != self.NO_NODE:
+            children.append(child)
+            child = self.next_siblings[child]
+        return children
+
+
+    def get_dfs_sequence(self):
+        """
+        List `(depth, node)` pairs in depth-first pre-order, as
+        `get_dfs_constituents` does for nested trees.  Nodes are stored in
+        that order, so this is a single loop over the arrays.
+        """
+        depths = array('i')
+        sequence = []
+        for index, parent in enumerate(self.parents):
+            depth = 0 if parent == self.NO_NODE else depths[parent] + 1
+            depths.append(depth)
+            sequence.append((depth, FlatConstituent(self, index)))
+        return sequence
+
+
+
+class FlatConstituent(Mapping):
+    """
+    A node of a FlatConstituencyTree, presented like a Constituency: with a
+    'constituent_type', a 'token_span', 'constituent_children', and any other
+    keys that the node had.
+    """
+
+    __slots__ = ('tree', 'index')
+
+    def __init__(self, tree, index):
+        self.tree = tree
+        self.index = index
+
+
+    def __getitem__(self, key):
+        tree, index = self.tree, self.index
+        if key == 'constituent_type':
+            return tree.get_label(index)
+        elif key == 'token_span':
+            if index == 0 and tree.root_token_span is not None:
+                root_token_span = tree.root_token_span
+                return TokenSpan.from_trusted_ranges(
+                    root_token_span, absolute=root_token_span.absolute)
+            return TokenSpan.from_trusted_ranges([(
+                tree.sentence_id, tree.starts[index], tree.ends[index])])
+        elif key == 'constituent_children':
+            return [
+                FlatConstituent(tree, child)
+                for child in tree.get_children(index)
+            ]
+        return tree.get_attribute(index, key)
+
+
+    def __iter__(self):
+        for key in FlatConstituencyTree.STRUCTURE_KEYS:
+            yield key
+        for key in self.tree.get_attribute_names(self.index):
+            yield key
+
+
+    def __len__(self):
+        return (
+            len(FlatConstituencyTree.STRUCTURE_KEYS)
+            + len(self.tree.get_attribute_names(self.index))
+        )
+
+
+    def __repr__(self):
+        return 'FlatConstituent(%s, %d)' % (
+            repr(self['constituent_type']), self.index)
+
 
 
 def get_dfs_constituents(node):
+    # Sentences that have been flattened are traversed through their arrays.
+    if 'flat_tree' in node:
+        return node['flat_tree'].get_dfs_sequence()
     return parc3.utils.get_dfs_sequence(node, get_constituency_children)
 
 
+def iter_constituents(node, order='pre', prune=None, max_depth=None):
+    """
+    Lazily yield `(depth, constituent)` pairs from the constituency tree under
+    `node`.  See `parc3.utils.iter_tree` for the meaning of the arguments.
+    """
+    if 'flat_tree' in node:
+        node = FlatConstituent(node['flat_tree'], 0)
+    return parc3.utils.iter_tree(
+        node, get_constituency_children, order, prune, max_depth)
+
+
 def get_constituency_children(node):
     try:
         return node['constituent_children']
@@ -94,57 +349,175 @@ class Attribution(dict):
     def initialize_spans(self, absolute):
         for span_type in self.ROLES:
             span = self.pop(span_type, [])
-            self[span_type] = TokenSpan(span, absolute=absolute)
+            self[span_type] = make_token_span(span, absolute=absolute)
 
     def accomodate_inserted_token(self, abs_id, sentence_id, rel_id):
         for span_type in self.ROLES:
             self[span_type].accomodate_inserted_token(
                 abs_id, sentence_id, rel_id)
 
-    def relativize(self, doc):
+    def accomodate_inserted_tokens(self, insertion_points):
         for span_type in self.ROLES:
-            self[span_type].relativize(doc)
+            self[span_type].accomodate_inserted_tokens(insertion_points)
+
+    def relativize(self, doc):
+        doc.relativize_spans([self[span_type] for span_type in self.ROLES])
 
 
     def absolutize(self, doc):
-        for span_type in self.ROLES:
-            self[span_type].absolutize(doc)
+        doc.absolutize_spans([self[span_type] for span_type in self.ROLES])
 
 
-# TODO: override .append and .extend
-class TokenSpan(list):
+class InsertionPoints(object):
     """
-    Serves as a pointer to a specific subset of tokens in a document.
+    A batch of token insertions, against which token indices can be shifted.
 
-    Consists of a list of tuples, having the form 
+    Each insertion point has the form
 
-        (sentence_id, start, end)
+        (abs_id, sentence_id, rel_id)
 
-    Absolute token_spans address tokens with respect to their ordering in the
-    entire document, and have a sentence_id of `None`.  Relative token spans
-    address tokens relative to a given sentence, and should have an integer for
-    sentence_id 
+    giving the position at which a token is inserted, addressed as it was
+    before any of the insertions were made: absolutely, and relative to the
+    sentence that the token joins.  `sentence_id` and `rel_id` are `None` if
+    the token doesn't join a sentence.
 
-    In either case, the start and end indices follow the convention of slice
-    notation.
+    An index is shifted by one for every insertion at or before it, so a range
+    ending exactly at an insertion point grows to include the inserted token.
+    Relative indices only shift for insertions in their own sentence.
     """
 
-    def __init__(
-        self, token_span=None, single_range=None, absolute=False
-    ):
-        super(TokenSpan, self).__init__()
-        self.absolute = absolute
+    def __init__(self, insertion_points):
+        self.abs_ids = sorted([abs_id for abs_id, _, _ in insertion_points])
+        self.rel_ids = sorted([
+            (sentence_id, rel_id)
+            for _, sentence_id, rel_id in insertion_points
+            if sentence_id is not None
+        ])
 
-        # Collect together spans to be added.  Tolerate adding no spans, and
-        # tolerate specifying single_range and / or token_span.
-        token_span = [] if token_span is None else list(token_span)
-        if single_range is not None:
-            token_span.append(single_range)
 
-        # Add all the tokens
-        self.consolidated = True
-        self.add_token_ranges(token_span)
+    def shift_abs(self, abs_id):
+        return abs_id + bisect.bisect_right(self.abs_ids, abs_id)
+
+
+    def shift_rel(self, sentence_id, rel_id):
+        num_inserted = (
+            bisect.bisect_right(self.rel_ids, (sentence_id, rel_id))
+            - bisect.bisect_left(self.rel_ids, (sentence_id,))
+        )
+        return rel_id + num_inserted
+
+
+
+class SpanIndex(object):
+    """
+    Indexes where the annotations of one type lie in a document, sentence by
+    sentence, so that the annotations overlapping some tokens, or containing
+    a token, are found without scanning them all.  Each sentence gets an
+    `IntervalIndex` over the sentence-relative token ranges of the
+    annotations; absolute token spans are relativized to build it.
+
+    Annotations having a 'token_span' are indexed under the role `None`.
+    Attributions are indexed under each of their roles.  Other annotations,
+    like coreference chains, have no tokens of their own, and are skipped.
+    """
+
+    def __init__(self, doc, annotations):
+        intervals_by_sentence = defaultdict(list)
+        for annotation_id, annotation in annotations.items():
+            for role, token_span in get_annotation_token_spans(annotation):
+                if token_span.absolute:
+                    token_span = doc.relativize(token_span)
+                for sentence_id, start, end in token_span:
+                    intervals_by_sentence[sentence_id].append(
+                        (start, end, (annotation_id, role)))
 
+        self.sentence_indexes = {
+            sentence_id: parc3.utils.IntervalIndex(intervals)
+            for sentence_id, intervals in intervals_by_sentence.items()
+        }
+
+
+    def overlapping(self, sentence_id, start, end):
+        """
+        Return `(annotation_id, role)` pairs for the token ranges that overlap
+        tokens `[start, end)` of the sentence.
+        """
+        if sentence_id not in self.sentence_indexes:
+            return []
+        return self.sentence_indexes[sentence_id].overlapping(start, end)
+
+
+    def containing(self, sentence_id, token_id):
+        return self.overlapping(sentence_id, token_id, token_id + 1)
+
+
+    def accomodate_inserted_tokens(self, insertion_points):
+        """
+        Shift the indexed ranges the same way that the annotations' token
+        spans shift for the insertions in `insertion_points`.  Only the
+        sentences that received tokens change.
+        """
+        sentence_ids = set([
+            sentence_id for sentence_id, _ in insertion_points.rel_ids])
+        for sentence_id in sentence_ids:
+            if sentence_id in self.sentence_indexes:
+                self.sentence_indexes[sentence_id].remap(
+                    lambda rel_id: insertion_points.shift_rel(
+                        sentence_id, rel_id)
+                )
+
+
+
+def flatten_token_spans(token_spans):
+    """
+    Gather the ranges of `token_spans` into four parallel arrays: the index
+    of the span that each range belongs to, and the ranges' sentence ids
+    (with `None` stored as -1), starts, and ends.
+    """
+    owners = array('i')
+    sentence_ids = array('i')
+    starts = array('i')
+    ends = array('i')
+    for owner, token_span in enumerate(token_spans):
+
+        # The arrays of ArrayTokenSpans are sliced rather than unpacked.
+        if isinstance(token_span, ArrayTokenSpan):
+            ranges = token_span.ranges
+            owners.extend(array('i', [owner]) * (len(ranges) / 3))
+            sentence_ids.extend(ranges[0::3])
+            starts.extend(ranges[1::3])
+            ends.extend(ranges[2::3])
+            continue
+
+        for sentence_id, start, end in token_span:
+            owners.append(owner)
+            sentence_ids.append(
+                ArrayTokenSpan.NO_SENTENCE if sentence_id is None
+                else sentence_id
+            )
+            starts.append(start)
+            ends.append(end)
+
+    return owners, sentence_ids, starts, ends
+
+
+def get_annotation_token_spans(annotation):
+    """Return `(role, token_span)` pairs for the tokens of an annotation."""
+    if 'token_span' in annotation:
+        return [(None, annotation['token_span'])]
+    if hasattr(annotation, 'ROLES'):
+        return [(role, annotation[role]) for role in annotation.ROLES]
+    return []
+
+
+
+class TokenSpanBase(object):
+    """
+    Behaviour shared by TokenSpan and ArrayTokenSpan, written against the
+    methods that they each implement: iteration, indexing, `add_token_range`,
+    `consolidate`, `replace_with`, `accomodate_inserted_tokens` and
+    `num_segments`.
+    """
 
     def relativize(self, doc):
         """
@@ -171,6 +544,62 @@ class TokenSpan(list):
 
 
 
+    @classmethod
+    def from_trusted_ranges(cls, token_ranges, absolute=False):
+        """
+        Build a span from ranges that are already valid and consolidated:
+        `(sentence_id, start, end)` tuples, in sorted order, that neither
+        overlap nor touch.  They are assigned as they are, without the checks
+        that `add_token_range` makes (unless `VALIDATE_TRUSTED_RANGES` is
+        set), so this is only for ranges that come from other spans, or that
+        are built to be consolidated.
+        """
+        # Skip `__init__`, which would validate an empty list of ranges.
+        token_span = cls.__new__(cls)
+        token_span.absolute = absolute
+        token_span.replace_with_trusted(token_ranges)
+        return token_span
+
+
+    def replace_with_trusted(self, token_ranges, absolute=None):
+        """
+        Assign new token ranges that are already valid and consolidated.  See
+        `from_trusted_ranges`.
+        """
+        self.absolute = self.absolute if absolute is None else absolute
+        if VALIDATE_TRUSTED_RANGES:
+            token_ranges = self._check_trusted_ranges(token_ranges)
+        self._replace_with_consolidated(token_ranges)
+
+
+    def _check_trusted_ranges(self, token_ranges):
+        """
+        Put ranges through full validation and consolidation, and raise a
+        ValueError unless that leaves them as they are.
+        """
+        token_ranges = list(token_ranges)
+        checked_span = self.__class__(token_ranges, absolute=self.absolute)
+        if list(checked_span) != token_ranges:
+            raise ValueError(
+                'Trusted token ranges are not consolidated: %s'
+                % str(token_ranges)
+            )
+        return token_ranges
+
+
+    def replace_with_converted(self, token_ranges, absolute):
+        """
+        Assign ranges converted from this span's own ranges to or from
+        sentence-relative addressing, as `AnnotatedDocument.relativize_spans`
+        does.  Converting keeps ranges in order, and keeps gaps between them,
+        so if this span was consolidated, the converted ranges are trusted.
+        """
+        if self.consolidated:
+            self.replace_with_trusted(token_ranges, absolute)
+        else:
+            self.replace_with(token_ranges, absolute)
+
+
     def _normalize_range(self, token_range):
         """Handle ommitting sentence_id when specifying a token range."""
         if len(token_range) == 3:
@@ -215,11 +644,91 @@ class TokenSpan(list):
         self.consolidate()
 
 
+    def is_single_range(self):
+        return self.num_segments() == 1
+
+
+    def get_single_range(self):
+        if not self.is_single_range():
+            raise parc3.exceptions.NonSingleRangeError(
+                'This token span has multiple ranges.')
+        return self[0]
+
+
+    def accomodate_inserted_token(
+        self,
+        at_abs_id,
+        at_sentence_id=None,
+        at_rel_id=None
+    ):
+        self.accomodate_inserted_tokens(
+            InsertionPoints([(at_abs_id, at_sentence_id, at_rel_id)]))
+
+
+    def maybe_shift_range(self, token_range, insertion_points):
+
+        sentence_id, start, end = token_range
+
+        if sentence_id is None:
+            start = insertion_points.shift_abs(start)
+            end = insertion_points.shift_abs(end)
+            return (None, start, end)
+
+        else:
+            start = insertion_points.shift_rel(sentence_id, start)
+            end = insertion_points.shift_rel(sentence_id, end)
+            return (sentence_id, start, end)
+
+
+
+# TODO: override .append and .extend
+class TokenSpan(TokenSpanBase, list):
+    """
+    Serves as a pointer to a specific subset of tokens in a document.
+
+    Consists of a list of tuples, having the form 
+
+        (sentence_id, start, end)
+
+    Absolute token_spans address tokens with respect to their ordering in the
+    entire document, and have a sentence_id of `None`.  Relative token spans
+    address tokens relative to a given sentence, and should have an integer for
+    sentence_id 
+
+    In either case, the start and end indices follow the convention of slice
+    notation.
+    """
+
+    def __init__(
+        self, token_span=None, single_range=None, absolute=False
+    ):
+        super(TokenSpan, self).__init__()
+        self.absolute = absolute
+
+        # Collect together spans to be added.  Tolerate adding no spans, and
+        # tolerate specifying single_range and / or token_span.
+        token_span = [] if token_span is None else list(token_span)
+        if single_range is not None:
+            token_span.append(single_range)
+
+        # Add all the tokens
+        self.consolidated = True
+        self.add_token_ranges(token_span)
+
+
+    def __reduce__(self):
+        """
+        Pickle by reconstructing through `__init__`.  The default pickling of
+        list subclasses re-adds ranges before `absolute` has been restored.
+        """
+        return (self.__class__, (list(self), None, self.absolute))
+
+
     def add_token_range(self, token_range, skip_consolidation=False):
         token_range = self._normalize_range(token_range)
         self._validate_range(token_range)
         self._check_if_still_consolidated(token_range)
-        super(TokenSpan, self).append(token_range)
+        list.append(self, token_range)
         if not skip_consolidation:
             self.consolidate()
 
@@ -277,6 +786,7 @@ class TokenSpan(list):
         consolidated.
         """
         self[:] = token_ranges
+        self.consolidated = True
 
 
     def replace_with(self, token_ranges, absolute=None):
@@ -286,54 +796,29 @@ class TokenSpan(list):
         """
         self.absolute = self.absolute if absolute is None else absolute
         self[:] = []
+        self.consolidated = True
         self.add_token_ranges(token_ranges)
 
 
     def num_segments(self):
-        return super(TokenSpan, self).__len__()
+        return list.__len__(self)
 
 
-    def is_single_range(self):
-        return self.num_segments() == 1
-
-
-    def get_single_range(self):
-        if not self.is_single_range():
-            raise parc3.exceptions.NonSingleRangeError(
-                'This token span has multiple ranges.')
-        return self[0]
-
-
-    def accomodate_inserted_token(
-        self,
-        at_abs_id,
-        at_sentence_id=None,
-        at_rel_id=None
-    ):
-
-        insertion_point = (at_abs_id, at_sentence_id, at_rel_id)
-
-        # Replace range elements in place
-        self.replace_with([
-            self.maybe_shift_range(token_range, insertion_point) 
+    def accomodate_inserted_tokens(self, insertion_points):
+        """
+        Shift this span to account for all of the token insertions in
+        `insertion_points` (an `InsertionPoints`) at once.
+        """
+        # Shifting preserves order, and can only pull ranges apart, so the
+        # shifted ranges of a consolidated span are trusted.
+        shifted_ranges = [
+            self.maybe_shift_range(token_range, insertion_points) 
             for token_range in self
-        ])
-
-
-    def maybe_shift_range(self, token_range, insertion_point):
-
-        sentence_id, start, end = token_range
-        at_abs_id, at_sentence_id, at_rel_id = insertion_point
-
-        if sentence_id is None:
-            start += int(start >= at_abs_id)
-            end += int(end >= at_abs_id)
-            return (None, start, end)
-
+        ]
+        if self.consolidated:
+            self.replace_with_trusted(shifted_ranges)
         else:
-            start += int((sentence_id, start) >= (at_sentence_id, at_rel_id))
-            end += int((sentence_id, end) >= (at_sentence_id, at_rel_id))
-            return (sentence_id, start, end)
+            self.replace_with(shifted_ranges)
 
 
     def __len__(self):
@@ -358,3 +843,216 @@ class TokenSpan(list):
     #    return parc3.token_list.TokenList(selected)
 
 
+
+class ArrayTokenSpan(TokenSpanBase):
+    """
+    A compact drop-in alternative to `TokenSpan`.  Rather than a list of
+    tuples, ranges are packed into a single array of integers, three per
+    range, with a sentence_id of `None` stored as -1.  Iterating and indexing
+    yield `(sentence_id, start, end)` tuples, and ArrayTokenSpans compare
+    equal to TokenSpans and lists holding the same ranges.
+
+    Consolidation sorts and merges ranges within the array, and
+    `from_sorted_ranges` builds a span from ranges that are already sorted
+    in a single pass.
+    """
+
+    NO_SENTENCE = -1
+
+    def __init__(
+        self, token_span=None, single_range=None, absolute=False
+    ):
+        self.absolute = absolute
+        self.consolidated = True
+        self.ranges = array('i')
+
+        # Copy the array directly from spans that are already consolidated.
+        if (
+            isinstance(token_span, ArrayTokenSpan)
+            and token_span.absolute == absolute
+            and token_span.consolidated
+            and single_range is None
+        ):
+            self.ranges = array('i', token_span.ranges)
+            return
+
+        # Collect together spans to be added.  Tolerate adding no spans, and
+        # tolerate specifying single_range and / or token_span.
+        token_span = [] if token_span is None else list(token_span)
+        if single_range is not None:
+            token_span.append(single_range)
+
+        self.add_token_ranges(token_span)
+
+
+    @classmethod
+    def from_sorted_ranges(cls, token_ranges, absolute=False):
+        """
+        Build a span from valid ranges that are already sorted, without
+        validating them.  Overlapping and adjacent ranges are merged as they
+        are added.
+        """
+        token_span = cls(absolute=absolute)
+        ranges = token_span.ranges
+        for sentence_id, start, end in token_ranges:
+            if sentence_id is None:
+                sentence_id = cls.NO_SENTENCE
+            if (
+                len(ranges) > 0 and ranges[-3] == sentence_id
+                and start <= ranges[-1]
+            ):
+                ranges[-1] = max(ranges[-1], end)
+            else:
+                ranges.extend((sentence_id, start, end))
+        return token_span
+
+
+    def __reduce__(self):
+        return (self.__class__, (), self.__dict__)
+
+
+    def _pack(self, token_range):
+        sentence_id, start, end = token_range
+        if sentence_id is None:
+            sentence_id = self.NO_SENTENCE
+        return sentence_id, start, end
+
+
+    def _unpack(self, offset):
+        sentence_id = self.ranges[offset]
+        if sentence_id == self.NO_SENTENCE:
+            sentence_id = None
+        return (sentence_id, self.ranges[offset+1], self.ranges[offset+2])
+
+
+    def __iter__(self):
+        for offset in xrange(0, len(self.ranges), 3):
+            yield self._unpack(offset)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return list(self)[index]
+        num_segments = self.num_segments()
+        if index < 0:
+            index += num_segments
+        if index < 0 or index >= num_segments:
+            raise IndexError('ArrayTokenSpan index out of range')
+        return self._unpack(3 * index)
+
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+    def add_token_range(self, token_range, skip_consolidation=False):
+        token_range = self._normalize_range(token_range)
+        self._validate_range(token_range)
+        sentence_id, start, end = token_range
+
+        # Check if this token range comes strictly after existing token
+        # ranges, in which case consolidation isn't needed.
+        if len(self.ranges) > 0 and self.ranges[-1] >= start:
+            self.consolidated = False
+
+        self.ranges.extend(self._pack(token_range))
+        if not skip_consolidation:
+            self.consolidate()
+
+
+    def consolidate(self):
+        """
+        Sort ranges, then merge overlapping and adjacent ranges, overwriting
+        the array in place.
+        """
+        if self.consolidated:
+            return
+
+        ranges = self.ranges
+        sorted_ranges = sorted(
+            ranges[offset:offset+3] for offset in xrange(0, len(ranges), 3))
+
+        write = -3
+        for sentence_id, start, end in sorted_ranges:
+            if write >= 0 and ranges[write] == sentence_id and (
+                start <= ranges[write+2]
+            ):
+                ranges[write+2] = max(ranges[write+2], end)
+            else:
+                write += 3
+                ranges[write:write+3] = array('i', (sentence_id, start, end))
+        del ranges[write+3:]
+
+        self.consolidated = True
+
+
+    def _replace_with_consolidated(self, token_ranges):
+        """
+        Directly assign token ranges, which are assumed to be already valid and
+        consolidated.
+        """
+        ranges = array('i')
+        for token_range in token_ranges:
+            ranges.extend(self._pack(token_range))
+        self.ranges = ranges
+        self.consolidated = True
+
+
+    def replace_with(self, token_ranges, absolute=None):
+        """
+        Assign new token ranges.  Subject ranges to validation and
+        consolidation.
+        """
+        self.absolute = self.absolute if absolute is None else absolute
+        self.ranges = array('i')
+        self.consolidated = True
+        self.add_token_ranges(token_ranges)
+
+
+    def num_segments(self):
+        return len(self.ranges) / 3
+
+
+    def accomodate_inserted_tokens(self, insertion_points):
+        """
+        Shift this span to account for all of the token insertions in
+        `insertion_points` (an `InsertionPoints`) at once.  Shifting preserves
+        order, and can only pull ranges apart, so the array is updated in
+        place.
+        """
+        ranges = self.ranges
+        for offset in xrange(0, len(ranges), 3):
+            sentence_id = ranges[offset]
+            if sentence_id == self.NO_SENTENCE:
+                ranges[offset+1] = insertion_points.shift_abs(ranges[offset+1])
+                ranges[offset+2] = insertion_points.shift_abs(ranges[offset+2])
+            else:
+                ranges[offset+1] = insertion_points.shift_rel(
+                    sentence_id, ranges[offset+1])
+                ranges[offset+2] = insertion_points.shift_rel(
+                    sentence_id, ranges[offset+2])
+
+
+    def __len__(self):
+        ranges = self.ranges
+        return sum([
+            ranges[offset+2] - ranges[offset+1]
+            for offset in xrange(0, len(ranges), 3)
+        ])
@@ -1,7 +1,14 @@
 from unittest import main, TestCase
 from collections import defaultdict
 import parc3
+import copy
+import logging
+import os
+import pickle
+import shutil
+import tempfile
 import t4k
+from StringIO import StringIO
 
 
 class TestReadAllAnnotations(TestCase):
@@ -13,6 +20,250 @@ class TestReadAllAnnotations(TestCase):
 
 
 
+class TestBenchmark(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.corpus = parc3.benchmark.SyntheticCorpus(
+            self.temp_dir, num_docs=3, num_sentences=4, sentence_length=10)
+        self.corpus.write()
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_synthetic_corpus_merges(self):
+        merged = [
+            parc3.annotation_merging.merge_bnp_doc(*parts)
+            for doc_id, parts in parc3.benchmark.iter_doc_parts(self.corpus)
+        ]
+        self.assertEqual(len(merged), 3)
+        for doc in merged:
+            self.assertEqual(len(doc.sentences), 4)
+            self.assertTrue(doc.annotations['propbank_verbs'])
+            self.assertEqual(len(doc.annotations['coreferences']), 1)
+
+
+    def test_run_benchmarks(self):
+        results = parc3.benchmark.run_benchmarks(
+            self.corpus, repeat=1, isolate=False)
+        self.assertEqual(results.keys(), parc3.benchmark.CASES.keys())
+        for result in results.values():
+            self.assertTrue(result['num_units'] > 0)
+
+        baseline_path = os.path.join(self.temp_dir, 'baseline.json')
+        settings = self.corpus.get_settings()
+        parc3.benchmark.write_baseline(baseline_path, settings, results)
+        baseline = parc3.benchmark.read_baseline(baseline_path, settings)
+        self.assertEqual(
+            parc3.benchmark.find_regressions(results, baseline), [])
+
+        slower = dict(results)
+        slower['consolidate'] = dict(
+            results['consolidate'],
+            seconds=results['consolidate']['seconds'] * 2 + 1
+        )
+        self.assertEqual(
+            [(name, measure) for name, measure, _, _ in
+                parc3.benchmark.find_regressions(slower, baseline)],
+            [('consolidate', 'seconds')]
+        )
+        with self.assertRaises(ValueError):
+            parc3.benchmark.read_baseline(
+                baseline_path, dict(settings, seed=1))
+
+
+
+class TestParallelMerging(TestCase):
+
+    def test_parallel_matches_serial(self):
+        serial = parc3.annotation_merging.read_bnp_pronoun_dataset(
+            skip=0, limit=20)
+        parallel = parc3.annotation_merging.read_bnp_pronoun_dataset(
+            skip=0, limit=20, processes=2)
+        self.assertEqual(sorted(parallel), sorted(serial))
+        for doc_id in serial:
+            self.assertEqual(
+                list(parallel[doc_id].tokens), list(serial[doc_id].tokens))
+
+
+    def test_failures_are_returned(self):
+        doc_id, doc, error, counts = (
+            parc3.annotation_merging.try_merge_bnp_doc(
+                (7, (None, None, None, []))))
+        self.assertEqual((doc_id, doc, counts), (7, None, {}))
+        self.assertTrue(error.startswith('AttributeError'))
+
+
+
+class TestBBNEntityTypeIndex(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        docs = [
+            (2, 'The <ENAMEX TYPE="PERSON">analyst</ENAMEX> said'),
+            (1, 'Ms. <ENAMEX TYPE="PERSON">Smith</ENAMEX> left'),
+        ]
+        with open(os.path.join(self.temp_dir, 'wsj00.qa'), 'w') as out_file:
+            for doc_id, text in docs:
+                out_file.write(
+                    '<DOC>\n<DOCNO> WSJ%04d </DOCNO>\n%s\n</DOC>\n'
+                    % (doc_id, text)
+                )
+        with open(os.path.join(self.temp_dir, 'wsj01.qa'), 'w') as out_file:
+            out_file.write('<DOC>\n<DOCNO> WSJ0003 </DOCNO>\nHi\n</DOC>\n')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_index(self):
+        index = parc3.annotation_merging.BBNEntityTypeIndex(self.temp_dir)
+        self.assertEqual(index.doc_ids, [1, 2, 3])
+
+        doc = index.get_doc(2)
+        self.assertEqual(doc.doc_id, 2)
+        self.assertEqual(
+            [token['text'] for token in doc.tokens],
+            ['The', 'analyst', 'said']
+        )
+        self.assertEqual(doc.tokens[1]['entity'], 0)
+
+        for processes in (1, 2):
+            found = [
+                (doc_id, doc.doc_id) for doc_id, doc in
+                parc3.annotation_merging.iter_bbn_entity_types(
+                    self.temp_dir, limit=3, skip=1, processes=processes)
+            ]
+            self.assertEqual(found, [(1, 1), (2, 2)])
+
+
+    def test_duplicate_doc(self):
+        # The last copy of a doc wins, within a file and across files.
+        with open(os.path.join(self.temp_dir, 'wsj01.qa'), 'a') as out_file:
+            out_file.write('<DOC>\n<DOCNO> WSJ0003 </DOCNO>\nBye\n</DOC>\n')
+        with open(os.path.join(self.temp_dir, 'wsj02.qa'), 'w') as out_file:
+            out_file.write('<DOC>\n<DOCNO> WSJ0002 </DOCNO>\nNew\n</DOC>\n')
+        index = parc3.annotation_merging.BBNEntityTypeIndex(self.temp_dir)
+        self.assertEqual(index.doc_ids, [1, 2, 3])
+        for doc_id, text in [(2, 'New'), (3, 'Bye')]:
+            self.assertEqual(
+                [token['text'] for token in index.get_doc(doc_id).tokens],
+                [text]
+            )
+
+
+
+class TestDocOffsetIndex(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.sentences_path = os.path.join(self.temp_dir, 'WSJ.sent')
+        self.pronouns_path = os.path.join(self.temp_dir, 'WSJ.pron')
+        with open(self.sentences_path, 'w') as out_file:
+            for doc_id in (4, 2):
+                out_file.write(
+                    '(WSJ%04d\n\tS1: Ms. Smith arrived .\n'
+                    '\tS2: She left .\n)\n' % doc_id
+                )
+        with open(self.pronouns_path, 'w') as out_file:
+            for doc_id in (4, 2):
+                out_file.write(
+                    '(WSJ%04d\n    (\n\tAntecedent -> S1:1-2 -> Ms. Smith\n'
+                    '\tPronoun -> S2:1-1 -> She\n    )\n)\n' % doc_id
+                )
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def test_index(self):
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        index = parc3.annotation_merging.DocOffsetIndex(
+            self.sentences_path, cache_dir)
+        self.assertEqual(index.get_doc_ids(), [2, 4])
+        self.assertEqual(
+            index.read_lines(2)[1], '\tS1: Ms. Smith arrived .\n')
+
+        # The index is cached in the cache dir, not beside the file.
+        self.assertEqual(os.path.dirname(index.index_path), cache_dir)
+        self.assertTrue(os.path.exists(index.index_path))
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)),
+            ['WSJ.pron', 'WSJ.sent', 'cache']
+        )
+
+        # The cached index is used until the file changes.
+        reloaded = parc3.annotation_merging.DocOffsetIndex(
+            self.sentences_path, cache_dir)
+        self.assertEqual(reloaded.offsets, index.offsets)
+        with open(self.sentences_path, 'a') as out_file:
+            out_file.write('(WSJ0007\n\tS1: Hi\n)\n')
+        reloaded = parc3.annotation_merging.DocOffsetIndex(
+            self.sentences_path, cache_dir)
+        self.assertEqual(reloaded.get_doc_ids(), [2, 4, 7])
+
+
+    def test_index_in_memory(self):
+        # A cache dir that can't be created falls back to an in-memory index.
+        blocker_path = os.path.join(self.temp_dir, 'blocker')
+        open(blocker_path, 'w').close()
+        index = parc3.annotation_merging.DocOffsetIndex(
+            self.sentences_path, os.path.join(blocker_path, 'cache'))
+        self.assertEqual(index.get_doc_ids(), [2, 4])
+        self.assertIsNone(index.index_path)
+
+        index = parc3.annotation_merging.DocOffsetIndex(
+            self.sentences_path, None)
+        self.assertEqual(index.get_doc_ids(), [2, 4])
+        self.assertEqual(
+            sorted(os.listdir(self.temp_dir)),
+            ['WSJ.pron', 'WSJ.sent', 'blocker']
+        )
+
+
+    def test_load_single_doc(self):
+        cache_dir = os.path.join(self.temp_dir, 'cache')
+        doc = parc3.annotation_merging.load_coreference_annotated_doc(
+            2, self.sentences_path, self.pronouns_path, cache_dir)
+        self.assertEqual(doc.doc_id, 2)
+        self.assertEqual(
+            doc.get_sentence_tokens(1).text(), 'She left .')
+        mention_ids = doc.tokens[0]['mentions']
+        self.assertEqual(
+            doc.annotations['mentions'][mention_ids[0]]['text'], 'Ms. Smith')
+        with self.assertRaises(KeyError):
+            parc3.annotation_merging.load_coreference_annotated_doc(
+                3, self.sentences_path, self.pronouns_path, cache_dir)
+
+
+
+class TestDocStream(TestCase):
+
+    def test_seek(self):
+        docs = parc3.annotation_merging.DocStream(
+            iter([(1, 'a'), (3, 'b'), (4, 'c')]))
+        with self.assertRaises(KeyError):
+            docs.seek(0)
+        self.assertEqual(docs.seek(1), 'a')
+        with self.assertRaises(KeyError):
+            docs.seek(2)
+        self.assertEqual(docs.seek(4), 'c')
+        with self.assertRaises(KeyError):
+            docs.seek(5)
+
+        docs = parc3.annotation_merging.DocStream([(1, 'a')], default=None)
+        self.assertEqual(docs.seek(0), None)
+
+        docs = parc3.annotation_merging.DocStream([(2, 'a'), (1, 'b')])
+        with self.assertRaises(ValueError):
+            docs.seek(3)
+
+
+
 class TestMergingPropbankVerbs(TestCase):
 
     def setUp(self):
@@ -51,65 +302,303 @@ class TestMergingPropbankVerbs(TestCase):
 
 
 
+class TestPropbankVerbMatcher(TestCase):
+
+    def get_test_doc(self, lemmas, pos):
+        tokens = [
+            {'text': lemma, 'lemma': lemma, 'pos': tag, 'id': i,
+                'sentence_id': 0, 'abs_id': i}
+            for i, (lemma, tag) in enumerate(zip(lemmas, pos))
+        ]
+        sentences = [parc3.spans.Span(
+            {'id': 0, 'token_span': [(None, 0, len(tokens))]}, absolute=True)]
+        return parc3.annotated_document.AnnotatedDocument(
+            tokens, sentences, {})
+
+
+    def test_exact_match_prefers_nearest_then_after(self):
+        doc = self.get_test_doc(
+            ['say', 'be', 'go', 'be', 'say'], ['VB'] * 5)
+        matcher = parc3.annotation_merging.PropbankVerbMatcher(doc)
+        find = matcher.find_nearest_exact_matching_token
+        self.assertEqual(find(0, 2, 'say')['abs_id'], 4)
+        self.assertEqual(find(0, 1, 'say')['abs_id'], 0)
+        self.assertEqual(find(0, 2, 'be')['abs_id'], 3)
+        with self.assertRaises(ValueError):
+            find(0, 2, 'tell')
+
+
+    def test_near_match_prefers_last_probed_among_ties(self):
+        doc = self.get_test_doc(
+            ['sae', 'be', 'go', 'be', 'sax', 'say'],
+            ['VB', 'VB', 'VB', 'VB', 'VB', 'NN']
+        )
+        matcher = parc3.annotation_merging.PropbankVerbMatcher(doc)
+        find = matcher.find_closest_near_matching_token
+
+        # 'sae' and 'sax' overlap 'say' equally.  Among ties, the token probed
+        # last wins: the farther one, or at equal distances, the one before.
+        # Token 5 isn't a verb, so it isn't considered.
+        self.assertEqual(find(0, 2, 'say')['abs_id'], 0)
+        self.assertEqual(find(0, 4, 'say')['abs_id'], 0)
+        self.assertEqual(find(0, 1, 'say')['abs_id'], 4)
+        self.assertEqual(find(0, 2, 'go')['abs_id'], 2)
+
+
+
+class TestIterTree(TestCase):
+
+    def setUp(self):
+        # a(b(d, e), c(f))
+        self.tree = ('a', [('b', [('d', []), ('e', [])]), ('c', [('f', [])])])
+
+
+    def walk(self, **kwargs):
+        return [
+            (depth, node[0]) for depth, node in
+            parc3.utils.iter_tree(self.tree, lambda node: node[1], **kwargs)
+        ]
+
+
+    def test_orders(self):
+        self.assertEqual(
+            self.walk(),
+            [(0, 'a'), (1, 'b'), (2, 'd'), (2, 'e'), (1, 'c'), (2, 'f')]
+        )
+        self.assertEqual(
+            self.walk(order='post'),
+            [(2, 'd'), (2, 'e'), (1, 'b'), (2, 'f'), (1, 'c'), (0, 'a')]
+        )
+        self.assertEqual(
+            self.walk(order='level'),
+            [(0, 'a'), (1, 'b'), (1, 'c'), (2, 'd'), (2, 'e'), (2, 'f')]
+        )
+        with self.assertRaises(ValueError):
+            self.walk(order='in')
+
+
+    def test_prune_and_max_depth(self):
+        prune = lambda depth, node: node[0] == 'b'
+        for order in parc3.utils.TRAVERSAL_ORDERS:
+            found = self.walk(order=order, prune=prune)
+            self.assertEqual(
+                sorted(found), [(0, 'a'), (1, 'b'), (1, 'c'), (2, 'f')])
+            found = self.walk(order=order, max_depth=1)
+            self.assertEqual(sorted(found), [(0, 'a'), (1, 'b'), (1, 'c')])
+
+
+    def test_deep_tree(self):
+        # Deeper than the recursion limit
+        depth = 5000
+        self.tree = ('leaf', [])
+        for i in range(depth):
+            self.tree = ('node', [self.tree])
+        found = self.walk()
+        self.assertEqual(len(found), depth + 1)
+        self.assertEqual(found[-1], (depth, 'leaf'))
+
+
+    def test_dfs_sequence(self):
+        get_children = lambda node: node[1]
+        sequence = [(0, 'root')]
+        found = parc3.utils.get_dfs_sequence(
+            self.tree[1][1], get_children, sequence, 1)
+        self.assertIs(found, sequence)
+        self.assertEqual(
+            [(depth, node if depth == 0 else node[0])
+                for depth, node in found],
+            [(0, 'root'), (1, 'c'), (2, 'f')]
+        )
+        self.assertEqual(
+            [(depth, node[0]) for depth, node in
+                parc3.utils.get_dfs_sequence(self.tree, get_children)],
+            self.walk()
+        )
+
+
+
+class TestAttributionIndex(TestCase):
+
+    def setUp(self):
+        self.index = parc3.attribution_index.AttributionIndex()
+        attributions = [
+            ('a1', 'he', 'PRP', 'said', 'say'),
+            ('a2', 'the analyst', 'NN', 'said', 'say'),
+            ('a3', 'she', 'PRP', 'reported', 'report'),
+            ('a4', 'they', 'PRP', 'says', 'say'),
+        ]
+        for attribution_id, source, pos, cue, lemma in attributions:
+            self.index.add({'attribution_id': attribution_id}, {
+                'source': [
+                    {'word': word, 'pos': pos} for word in source.split()],
+                'cue': [{'word': cue, 'lemma': lemma, 'pos': 'VBD'}],
+            })
+
+
+    def find_ids(self, **conditions):
+        return [
+            back_pointer['attribution_id']
+            for back_pointer in self.index.query(**conditions)
+        ]
+
+
+    def test_query(self):
+        self.assertEqual(self.find_ids(cue='said'), ['a1', 'a2'])
+        self.assertEqual(
+            self.find_ids(cue_regex='said', source_pos='PRP'), ['a1'])
+        self.assertEqual(self.find_ids(cue_lemma='say'), ['a1', 'a2', 'a4'])
+        self.assertEqual(self.find_ids(cue_prefix='sa'), ['a1', 'a2', 'a4'])
+        self.assertEqual(self.find_ids(source_regex='^th'), ['a2', 'a4'])
+        self.assertEqual(self.find_ids(cue='(?i)SAID|rep'), ['a1', 'a2', 'a3'])
+        self.assertEqual(self.find_ids(content='.*'), ['a1', 'a2', 'a3', 'a4'])
+        self.assertEqual(self.find_ids(cue_lemma='claim'), [])
+        with self.assertRaises(ValueError):
+            self.find_ids(cue_color='red')
+
+
+    def test_required_literals(self):
+        get_required_literals = (
+            parc3.attribution_index.get_required_literals)
+        self.assertEqual(get_required_literals('said|told'), [])
+        self.assertEqual(get_required_literals('(?i)said'), [])
+        self.assertEqual(
+            get_required_literals(r'accord\w* to'), ['accord', ' to'])
+
+
+
+class TestIntervalIndex(TestCase):
+
+    def test_overlapping(self):
+        intervals = [(4, 6, 'c'), (0, 3, 'a'), (2, 9, 'b'), (7, 8, 'd')]
+        index = parc3.utils.IntervalIndex(intervals)
+        self.assertEqual(index.overlapping(0, 10), ['a', 'b', 'c', 'd'])
+        self.assertEqual(index.overlapping(3, 4), ['b'])
+        self.assertEqual(index.overlapping(5, 8), ['b', 'c', 'd'])
+        self.assertEqual(index.containing(2), ['a', 'b'])
+        self.assertEqual(index.containing(9), [])
+        self.assertEqual(parc3.utils.IntervalIndex().overlapping(0, 10), [])
+
+        index.remap(lambda x: x + 1 if x >= 5 else x)
+        self.assertEqual(index.containing(6), ['b', 'c'])
+        self.assertEqual(index.containing(10), [])
+
+
+
+class TestFenwickTree(TestCase):
+
+    def test_prefix_sum(self):
+        tree = parc3.utils.FenwickTree(6)
+        values = [3, 0, -2, 5, 1, 4]
+        for index, value in enumerate(values):
+            tree.add(index, value)
+        tree.add(2, 1)
+        values[2] += 1
+        self.assertEqual(
+            [tree.prefix_sum(stop) for stop in range(7)],
+            [sum(values[:stop]) for stop in range(7)]
+        )
+
+
+
+class TestLRUCache(TestCase):
+
+    def test_count_bound(self):
+        loaded = []
+        def load(key):
+            loaded.append(key)
+            return key * 2
+        cache = parc3.utils.LRUCache(load, max_items=2)
+
+        self.assertEqual([cache[1], cache[2], cache[1]], [2, 4, 2])
+        self.assertEqual(loaded, [1, 2])
+
+        # Loading 3 evicts 2, which was used least recently.
+        self.assertEqual(cache[3], 6)
+        self.assertEqual(sorted(cache), [1, 3])
+        self.assertEqual(cache[2], 4)
+        self.assertEqual(loaded, [1, 2, 3, 2])
+        self.assertEqual(cache.num_evictions, 2)
+
+
+    def test_size_bound(self):
+        cache = parc3.utils.LRUCache(
+            lambda key: 'x' * key, max_size=5, get_size=len)
+        cache[2], cache[3]
+        self.assertEqual(sorted(cache), [2, 3])
+        cache[4]
+        self.assertEqual(sorted(cache), [4])
+        self.assertEqual(cache.total_size, 4)
+
+        # A value that is too big on its own is still kept.
+        cache[6]
+        self.assertEqual(sorted(cache), [6])
+
+        with self.assertRaises(ValueError):
+            parc3.utils.LRUCache(len, max_size=5)
+
+
+
 class TestTokenSpan(TestCase):
 
+    span_class = parc3.spans.TokenSpan
+
     def test_bad_span(self):
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan([(0, 0, 0)])
+            self.span_class([(0, 0, 0)])
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan([(0, 1, 0)])
+            self.span_class([(0, 1, 0)])
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan(single_range=(0, 0, 0))
+            self.span_class(single_range=(0, 0, 0))
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan(single_range=(0, 1, 0))
+            self.span_class(single_range=(0, 1, 0))
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan([(0, 1, 0)], absolute=True)
+            self.span_class([(0, 1, 0)], absolute=True)
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan([(None, 1, 0)])
+            self.span_class([(None, 1, 0)])
         with self.assertRaises(ValueError):
-            parc3.spans.TokenSpan(single_range=(0,1))
+            self.span_class(single_range=(0,1))
 
 
     def test_consolidation(self):
 
         # Consolidation when one span is adjacent to another
-        t1 = parc3.spans.TokenSpan([(0,0,1), (0,1,2)])
-        t2 = parc3.spans.TokenSpan([(0,0,2)])
+        t1 = self.span_class([(0,0,1), (0,1,2)])
+        t2 = self.span_class([(0,0,2)])
         self.assertEqual(t1, t2)
 
         # Consolidating when one span subsumes another
-        t1 = parc3.spans.TokenSpan([(0,0,2), (0,1,3)])
-        t2 = parc3.spans.TokenSpan([(0,0,3)])
+        t1 = self.span_class([(0,0,2), (0,1,3)])
+        t2 = self.span_class([(0,0,3)])
         self.assertEqual(t1, t2)
 
         # Consolidation of unordered ranges works, and equality is maintained.
-        t1 = parc3.spans.TokenSpan([(0,1,2), (0,0,1)])
-        t2 = parc3.spans.TokenSpan([(0,0,2)])
+        t1 = self.span_class([(0,1,2), (0,0,1)])
+        t2 = self.span_class([(0,0,2)])
         self.assertEqual(t1, t2)
 
         # Equality is not affected by order.
-        t1 = parc3.spans.TokenSpan([(0,2,3), (0,0,1)])
-        t2 = parc3.spans.TokenSpan([(0,0,1), (0,2,3)])
+        t1 = self.span_class([(0,2,3), (0,0,1)])
+        t2 = self.span_class([(0,0,1), (0,2,3)])
         self.assertEqual(t1, t2)
 
 
     def test_good_span(self):
-        parc3.spans.TokenSpan(single_range=(0,0,1))
-        parc3.spans.TokenSpan(single_range=(0,1), absolute=True)
-        parc3.spans.TokenSpan(single_range=(None,0,1), absolute=True)
+        self.span_class(single_range=(0,0,1))
+        self.span_class(single_range=(0,1), absolute=True)
+        self.span_class(single_range=(None,0,1), absolute=True)
 
 
     def test_adding_ranges(self):
 
         # if `absolute=False`, ranges must have integer sentence_id
-        span = parc3.spans.TokenSpan()
+        span = self.span_class()
         with self.assertRaises(ValueError):
             span.append((None, 0, 1))
         span.append((0,0,1))
         self.assertEqual(span.get_single_range(), (0,0,1))
 
         # If `absolute=True`, appended ranges must have `sentence_id=None`
-        span = parc3.spans.TokenSpan(absolute=True)
+        span = self.span_class(absolute=True)
         span.append((None,0,1))
         self.assertEqual(span.get_single_range(), (None,0,1))
         with self.assertRaises(ValueError):
@@ -117,7 +606,7 @@ class TestTokenSpan(TestCase):
 
         # If `absolute=True`, appending multiple ranges that have
         # `sentence_id=None`.  Raise value error if `sentence_id` is an `int`
-        span = parc3.spans.TokenSpan(absolute=True)
+        span = self.span_class(absolute=True)
         span.extend([(None, 0,1), (None, 1,5)])
         self.assertEqual(span.get_single_range(), (None, 0,5))
         with self.assertRaises(ValueError):
@@ -125,22 +614,695 @@ class TestTokenSpan(TestCase):
 
         # If `absolute=True`, appending multiple ranges that have
         # `sentence_id=None`.  Raise value error if `sentence_id` is an `int`
-        span = parc3.spans.TokenSpan()
+        span = self.span_class()
         span.extend([(0, 0, 1), (0, 1, 5)])
         self.assertEqual(span.get_single_range(), (0, 0, 5))
         with self.assertRaises(ValueError):
             span.extend([(0, 0, 1), (None, 1, 5)])
 
 
+    def test_trusted_ranges(self):
+        ranges = [(0, 0, 2), (0, 4, 5), (1, 0, 3)]
+        span = self.span_class.from_trusted_ranges(ranges)
+        self.assertEqual(span, self.span_class(ranges))
+        self.assertFalse(span.absolute)
+        span.append((1, 3, 4))
+        self.assertEqual(span[-1], (1, 0, 4))
+
+        span.replace_with_trusted([(None, 1, 2)], absolute=True)
+        self.assertEqual(span, [(None, 1, 2)])
+        self.assertTrue(span.absolute)
+
+        # Trusted ranges are only checked in debug mode.
+        bad_ranges = [(0, 0, 2), (0, 2, 3)]
+        self.assertEqual(
+            self.span_class.from_trusted_ranges(bad_ranges), bad_ranges)
+        parc3.spans.VALIDATE_TRUSTED_RANGES = True
+        try:
+            for bad_ranges in [[(0, 0, 2), (0, 2, 3)], [(0, 1, 1)]]:
+                with self.assertRaises(ValueError):
+                    self.span_class.from_trusted_ranges(bad_ranges)
+            with self.assertRaises(ValueError):
+                span.replace_with_trusted([(0, 0, 1)])
+            self.assertEqual(
+                self.span_class.from_trusted_ranges(ranges), ranges)
+        finally:
+            parc3.spans.VALIDATE_TRUSTED_RANGES = False
+
+
+    def test_pickle(self):
+        for absolute in [True, False]:
+            sentence_id = None if absolute else 0
+            span = self.span_class(
+                [(sentence_id, 0, 2), (sentence_id, 4, 5)], absolute=absolute)
+            for protocol in [0, 2]:
+                unpickled = pickle.loads(pickle.dumps(span, protocol))
+                self.assertEqual(unpickled, span)
+                self.assertEqual(unpickled.absolute, absolute)
+
+
     def test_len(self):
-        empty_span = parc3.spans.TokenSpan()
+        empty_span = self.span_class()
         self.assertEqual(len(empty_span), 0)
-        span_with_overlaps = parc3.spans.TokenSpan(
+        span_with_overlaps = self.span_class(
             [(0,3), (1,4)], absolute=True)
         self.assertEqual(len(span_with_overlaps), 4)
 
 
 
+class TestArrayTokenSpan(TestTokenSpan):
+
+    span_class = parc3.spans.ArrayTokenSpan
+
+    def test_list_like(self):
+        ranges = [(0, 0, 2), (0, 4, 5), (1, 0, 3)]
+        span = self.span_class(ranges)
+        self.assertEqual(list(span), ranges)
+        self.assertEqual(span, parc3.spans.TokenSpan(ranges))
+        self.assertEqual(span[1], (0, 4, 5))
+        self.assertEqual(span[-1], (1, 0, 3))
+        self.assertEqual(span[1:], ranges[1:])
+        self.assertEqual(span.num_segments(), 3)
+        self.assertEqual(len(span), 6)
+        with self.assertRaises(IndexError):
+            span[3]
+
+    def test_from_sorted_ranges(self):
+        span = self.span_class.from_sorted_ranges(
+            [(None, 0, 2), (None, 1, 3), (None, 3, 4), (None, 6, 7)],
+            absolute=True
+        )
+        self.assertEqual(span, [(None, 0, 4), (None, 6, 7)])
+        self.assertTrue(span.absolute)
+
+    def test_accomodate_inserted_tokens(self):
+        ranges = [(0, 0, 2), (0, 4, 5), (1, 0, 3)]
+        insertion_points = parc3.spans.InsertionPoints(
+            [(2, 0, 2), (5, 0, 5), (6, 1, 0)])
+        span = self.span_class(ranges)
+        span.accomodate_inserted_tokens(insertion_points)
+        expected_span = parc3.spans.TokenSpan(ranges)
+        expected_span.accomodate_inserted_tokens(insertion_points)
+        self.assertEqual(span, expected_span)
+
+
+
+class TestTokenAlignment(TestCase):
+
+    def test_align_characters(self):
+        self.assertEqual(
+            parc3.token_alignment.align_characters('abxcd', 'abcyd'),
+            [(0, 0), (1, 1), (3, 2), (4, 4)]
+        )
+
+
+    def test_align_tokens(self):
+        align_tokens = parc3.token_alignment.align_tokens
+
+        # Splits, extra characters, and tokens that differ entirely.
+        self.assertEqual(
+            align_tokens(["don't", 'gEo', 'now'], ['Do', "n't", 'go', '.']),
+            [[(0, 0, 2), (1, 2, 5)], [(2, 0, 3)], [(3, 0, 3)]]
+        )
+        self.assertEqual(
+            align_tokens(['a', 'b'], ['a', "'", 'b']),
+            [[(0, 0, 1)], [(2, 0, 1)]]
+        )
+
+        # Tokens with nothing in common are paired up if they fill the same
+        # gap, but otherwise align to nothing.
+        self.assertEqual(
+            align_tokens(['a', 'xy', 'b'], ['a', 'zw', 'b']),
+            [[(0, 0, 1)], [(1, 0, 2)], [(2, 0, 1)]]
+        )
+        self.assertEqual(
+            align_tokens(['a', 'xy', 'b'], ['a', 'z', 'w', 'b']),
+            [[(0, 0, 1)], [], [(3, 0, 1)]]
+        )
+
+
+    def test_merge_tokens(self):
+        tokens = [
+            {'text': text, 'abs_id': abs_id}
+            for abs_id, text in enumerate(["don't", 'gEo', 'now'])
+        ]
+        sentences = [
+            parc3.spans.Span({'token_span': [(None, 0, 3)]}, absolute=True)]
+        doc = parc3.annotated_document.AnnotatedDocument(
+            tokens, sentences, {})
+        other = parc3.annotated_document.AnnotatedDocument([
+            {'text': text, 'entity': entity} for text, entity in
+            [('Do', 1), ("n't", 2), ('go', 3), ('now', 4), ('.', 5)]
+        ])
+        doc.merge_tokens(other, ['entity'], [])
+        self.assertEqual(
+            [(t['text'], t['entity'], t['id']) for t in doc.tokens],
+            [('do', 1, 0), ("n't", 2, 1), ('gEo', 3, 2), ('now', 4, 3)]
+        )
+
+
+    def test_merge_straddling_tokens(self):
+        # Other tokens that straddle a boundary between this doc's tokens
+        # must not change the doc's text.
+        tokens = [
+            {'text': text, 'abs_id': abs_id}
+            for abs_id, text in enumerate(['ab', 'cd'])
+        ]
+        sentences = [
+            parc3.spans.Span({'token_span': [(None, 0, 2)]}, absolute=True)]
+        doc = parc3.annotated_document.AnnotatedDocument(
+            tokens, sentences, {})
+        other = parc3.annotated_document.AnnotatedDocument([
+            {'text': text, 'entity': entity} for text, entity in
+            [('a', 1), ('bc', 2), ('d', 3)]
+        ])
+        doc.merge_tokens(other, ['entity'], [])
+        self.assertEqual(
+            [(t['text'], t['entity']) for t in doc.tokens],
+            [('a', 1), ('b', 2), ('c', 2), ('d', 3)]
+        )
+
+
+
+class TestLog(TestCase):
+
+    def setUp(self):
+        parc3.log.reset_counts()
+
+
+    def tearDown(self):
+        parc3.log.reset_counts()
+
+
+    def merge_test_docs(self):
+        tokens = [{'text': text} for text in ["don't", 'now', 'xy']]
+        sentences = [
+            parc3.spans.Span({'token_span': [(None, 0, 3)]}, absolute=True)]
+        doc = parc3.annotated_document.AnnotatedDocument(
+            tokens, sentences, {}, doc_id=3)
+        other = parc3.annotated_document.AnnotatedDocument([
+            {'text': text} for text in ['Do', "n't", 'now', 'z', 'w']])
+        doc.merge_tokens(other, [], [])
+
+
+    def test_counts(self):
+        self.merge_test_docs()
+        self.assertEqual(
+            parc3.log.get_counts(), {'tokens_split': 1, 'tokens_unaligned': 1})
+        parc3.log.add_counts({'tokens_split': 2, 'docs_skipped': 1})
+        self.assertEqual(parc3.log.get_counts(), {
+            'tokens_split': 3, 'tokens_unaligned': 1, 'docs_skipped': 1})
+        parc3.log.reset_counts()
+        self.assertEqual(parc3.log.get_counts(), {})
+
+
+    def test_enable(self):
+        stream = StringIO()
+        handler = parc3.log.enable(logging.DEBUG, stream, '%(message)s')
+        try:
+            self.merge_test_docs()
+        finally:
+            parc3.log.disable(handler)
+        self.assertEqual(
+            stream.getvalue(),
+            'doc #3, token 0, splitting "don\'t" into "do", "n\'t"\n'
+        )
+
+        # Nothing more is written once disabled.
+        self.merge_test_docs()
+        self.assertEqual(stream.getvalue().count('\n'), 1)
+
+
+
+class TestTokenInsertion(TestCase):
+
+    def get_test_doc(self):
+        """
+        Make a document with two sentences, "a bc d" and "ef g", and some
+        absolutely and relatively addressed annotations.
+        """
+        tokens = [
+            {'text': text, 'abs_id': abs_id}
+            for abs_id, text in enumerate(['a', 'bc', 'd', 'ef', 'g'])
+        ]
+        sentences = [
+            parc3.spans.Span({'token_span': [(None, 0, 3)]}, absolute=True),
+            parc3.spans.Span({'token_span': [(None, 3, 5)]}, absolute=True),
+        ]
+        annotations = {'test': {
+            'abs': parc3.spans.Span(
+                {'token_span': [(None, 1, 2), (None, 3, 5)]}, absolute=True),
+            'rel': parc3.spans.Span({'token_span': [(0, 1, 2), (1, 0, 2)]}),
+        }}
+        return parc3.annotated_document.AnnotatedDocument(
+            tokens, sentences, annotations)
+
+
+    def test_split_token(self):
+        doc = self.get_test_doc()
+        doc.split_token(doc.tokens[1], 'b')
+        self.assertEqual(
+            [t['text'] for t in doc.tokens], ['a', 'b', 'c', 'd', 'ef', 'g'])
+        self.assertEqual([t['abs_id'] for t in doc.tokens], range(6))
+        self.assertEqual(
+            [(t['sentence_id'], t['id']) for t in doc.tokens],
+            [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1)]
+        )
+        self.assertEqual(doc.sentence_starts, [0, 4])
+
+        # Spans covering the split token cover both parts, and relative spans
+        # in other sentences are unaffected.
+        annotations = doc.annotations['test']
+        self.assertEqual(
+            annotations['abs']['token_span'], [(None, 1, 3), (None, 4, 6)])
+        self.assertEqual(
+            annotations['rel']['token_span'], [(0, 1, 3), (1, 0, 2)])
+
+
+    def test_split_held_tokens(self):
+        # Tokens held from before a split are split in the right place, even
+        # though their absolute ids are only renumbered lazily.
+        doc = self.get_test_doc()
+        tokens = list(doc.tokens)
+        doc.split_token(tokens[1], 'b')
+        doc.split_token(tokens[3], 'e')
+        self.assertEqual(
+            [t['text'] for t in doc.tokens],
+            ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        )
+        self.assertEqual(
+            [s['token_span'] for s in doc.sentences],
+            [[(None, 0, 4)], [(None, 4, 7)]]
+        )
+
+        doc = self.get_test_doc()
+        tokens = list(doc.tokens)
+        doc.split_token(tokens[1], 'b')
+        doc.split_tokens([(tokens[3], 'e')])
+        self.assertEqual(
+            [t['text'] for t in doc.tokens],
+            ['a', 'b', 'c', 'd', 'e', 'f', 'g']
+        )
+
+
+    def test_annotation_index(self):
+        doc = self.get_test_doc()
+        doc.annotations['attributions'] = {'att': parc3.spans.Attribution({
+            'source': [(0, 0, 1)], 'cue': [(0, 1, 2)], 'content': [(1, 0, 2)]
+        })}
+        self.assertEqual(
+            doc.get_overlapping_annotations('test', 0, 0, 3), ['abs', 'rel'])
+        self.assertEqual(doc.get_covering_annotations('test', 0, 0), [])
+        self.assertEqual(
+            doc.get_annotation_index('attributions').containing(1, 1),
+            [('att', 'content')]
+        )
+
+        # Tokens inserted into both sentences shift the indexed ranges along
+        # with the annotations.
+        doc.insert_tokens([(1, {'text': 'x'}), (4, {'text': 'y'})])
+        for sentence_id, token_id, covering in [
+            (0, 1, []), (0, 2, ['abs', 'rel']), (0, 3, []),
+            (1, 0, ['abs', 'rel']), (1, 1, ['abs', 'rel']), (1, 3, []),
+        ]:
+            self.assertEqual(
+                doc.get_covering_annotations('test', sentence_id, token_id),
+                covering
+            )
+        self.assertEqual(
+            doc.get_annotation_index('attributions').overlapping(0, 0, 4),
+            [('att', 'source'), ('att', 'cue')]
+        )
+
+        # Adding an annotation rebuilds the index.
+        doc.annotations['test']['new'] = parc3.spans.Span(
+            {'token_span': [(0, 0, 1)]})
+        self.assertEqual(
+            doc.get_covering_annotations('test', 0, 0), ['new'])
+
+
+    def test_offsets_are_shifted_lazily(self):
+        doc = self.get_test_doc()
+        doc.insert_token(0, {'text': 'x'})
+        doc.insert_token(2, {'text': 'y'})
+        doc.insert_token(7, {'text': 'z'})
+
+        # Offsets and ids are right before the shifts are applied...
+        self.assertEqual(doc.get_sentence_range(0), (1, 5))
+        self.assertEqual(doc.get_sentence_range(1), (5, 8))
+        self.assertEqual(doc.get_sentence_tokens(1).text(), 'ef g z')
+        self.assertEqual(
+            doc.relativize([(None, 2, 7)]), [(0, 1, 4), (1, 0, 2)])
+        self.assertEqual(
+            [(t['sentence_id'], t['id']) for t in doc.get_tokens_abs(
+                [(None, 1, 8)])],
+            [(0, 0), (0, 1), (0, 2), (0, 3), (1, 0), (1, 1), (1, 2)]
+        )
+
+        # ...and are applied to the sentences and tokens when they're read.
+        self.assertEqual(
+            [s['token_span'] for s in doc.sentences],
+            [[(None, 1, 5)], [(None, 5, 8)]]
+        )
+        self.assertEqual(doc.sentence_starts, [1, 5])
+        self.assertEqual([t['abs_id'] for t in doc.tokens], range(8))
+        self.assertEqual(doc.pending_shifts, None)
+        self.assertEqual(doc.stale_abs_ids_from, None)
+
+
+    def test_relativize_spans(self):
+        doc = self.get_test_doc()
+        doc.insert_token(0, {'text': 'x'})
+        token_spans = [
+            parc3.spans.TokenSpan([(None, 2, 6)], absolute=True),
+            parc3.spans.ArrayTokenSpan(
+                [(None, 1, 2), (None, 4, 5)], absolute=True),
+            parc3.spans.TokenSpan(absolute=True),
+        ]
+        doc.relativize_spans(token_spans)
+        self.assertEqual(
+            token_spans, [[(0, 1, 3), (1, 0, 2)], [(0, 0, 1), (1, 0, 1)], []])
+        self.assertFalse(any([span.absolute for span in token_spans]))
+
+        # Ranges that meet at a sentence boundary are merged.
+        doc.absolutize_spans(token_spans)
+        self.assertEqual(
+            token_spans, [[(None, 2, 6)], [(None, 1, 2), (None, 4, 5)], []])
+
+        # Nothing is converted if any range falls outside the sentences.
+        token_spans.append(
+            parc3.spans.TokenSpan([(None, 0, 1)], absolute=True))
+        with self.assertRaises(ValueError):
+            doc.relativize_spans(token_spans)
+        self.assertEqual(token_spans[0], [(None, 2, 6)])
+        with self.assertRaises(ValueError):
+            doc.absolutize_spans(token_spans)
+
+
+    def test_batched_insertion_matches_sequential(self):
+        insertions = [(0, 'x'), (2, 'y'), (3, 'z'), (3, 'w'), (5, 'v')]
+
+        batched_doc = self.get_test_doc()
+        batched_doc.insert_tokens([
+            (abs_index, {'text': text}) for abs_index, text in insertions])
+
+        sequential_doc = self.get_test_doc()
+        for abs_index, text in reversed(insertions):
+            sequential_doc.insert_token(abs_index, {'text': text})
+
+        self.assertEqual(
+            [t['text'] for t in batched_doc.tokens],
+            ['x', 'a', 'bc', 'y', 'd', 'z', 'w', 'ef', 'g', 'v']
+        )
+        self.assertEqual(batched_doc.tokens, sequential_doc.tokens)
+        self.assertEqual(batched_doc.sentences, sequential_doc.sentences)
+        self.assertEqual(
+            batched_doc.sentence_starts, sequential_doc.sentence_starts)
+        self.assertEqual(batched_doc.annotations, sequential_doc.annotations)
+
+
+    def test_batched_splits_match_sequential(self):
+        batched_doc = self.get_test_doc()
+        batched_doc.split_tokens([
+            (batched_doc.tokens[1], 'b'), (batched_doc.tokens[3], 'e')])
+
+        sequential_doc = self.get_test_doc()
+        sequential_doc.split_token(sequential_doc.tokens[3], 'e')
+        sequential_doc.split_token(sequential_doc.tokens[1], 'b')
+
+        self.assertEqual(batched_doc.tokens, sequential_doc.tokens)
+        self.assertEqual(batched_doc.sentences, sequential_doc.sentences)
+        self.assertEqual(batched_doc.annotations, sequential_doc.annotations)
+
+
+
+class TestTokenStore(TestCase):
+
+    def get_test_tokens(self):
+        return [
+            {'text': 'The', 'pos': 'DT', 'abs_id': 0, 'attributions': []},
+            {'text': 'cat', 'pos': 'NN', 'abs_id': 1, 'entity': None},
+            {'text': 'sat', 'pos': 'VBD', 'abs_id': 2},
+        ]
+
+
+    def test_views_match_tokens(self):
+        tokens = self.get_test_tokens()
+        store = parc3.token_store.TokenStore(tokens)
+        self.assertEqual(len(store), 3)
+        self.assertEqual(store, tokens)
+        self.assertEqual(store[1]['text'], 'cat')
+        self.assertEqual(store[-1]['pos'], 'VBD')
+        self.assertIsNone(store[1]['entity'])
+        self.assertNotIn('entity', store[0])
+        self.assertNotIn('lemma', store[0])
+        with self.assertRaises(KeyError):
+            store[2]['entity']
+        with self.assertRaises(IndexError):
+            store[3]
+        self.assertEqual(store[1:].text(), 'cat sat')
+        self.assertEqual(store.text(), 'The cat sat')
+
+
+    def test_writes_and_inserts(self):
+        store = parc3.token_store.TokenStore(self.get_test_tokens())
+        token = store[0]
+        token['attributions'].append('attribution')
+        token.update({'text': 'A', 'id': 0})
+        self.assertEqual(store[0]['attributions'], ['attribution'])
+        self.assertEqual(store[0]['text'], 'A')
+        self.assertEqual(store[0]['id'], 0)
+
+        store.insert(1, {'text': 'big', 'pos': 'JJ', 'mentions': [3]})
+        self.assertEqual(store.text(), 'A big cat sat')
+        self.assertEqual(store[1]['mentions'], [3])
+        self.assertNotIn('mentions', store[2])
+        self.assertEqual(store[2], self.get_test_tokens()[1])
+
+        del store[1]['pos']
+        self.assertNotIn('pos', store[1])
+        with self.assertRaises(ValueError):
+            store[1]['abs_id'] = None
+
+
+    def test_token_list_view(self):
+        tokens = self.get_test_tokens()
+        for source in [tokens, parc3.token_store.TokenStore(tokens)]:
+            view = parc3.token_list.TokenListView(
+                source, [(2, 3), (1, 1), (0, 1)])
+            self.assertEqual(len(view), 2)
+            self.assertEqual(view.text(), 'sat The')
+            self.assertEqual(view, [tokens[2], tokens[0]])
+            self.assertEqual(view[-1]['text'], 'The')
+            self.assertEqual(view[1:].text(), 'The')
+            with self.assertRaises(IndexError):
+                view[2]
+
+
+    def test_missing_text(self):
+        # A token without text fails the same way whether its text is read
+        # from the column or through its view.
+        store = parc3.token_store.TokenStore(
+            [{'text': 'a'}, {'pos': 'NN'}, {'text': 'c'}])
+        self.assertEqual(store.text(2), 'c')
+        with self.assertRaises(KeyError):
+            store.text()
+        with self.assertRaises(KeyError):
+            parc3.token_list.TokenListView(store, [(0, 3)]).text()
+        with self.assertRaises(KeyError):
+            parc3.token_list.TokenList(store).text()
+
+
+    def test_compact_tokens(self):
+        tokens = [
+            {'text': text, 'abs_id': abs_id}
+            for abs_id, text in enumerate(['a', 'bc', 'd', 'ef', 'g'])
+        ]
+        sentences = [
+            parc3.spans.Span({'token_span': [(None, 0, 3)]}, absolute=True),
+            parc3.spans.Span({'token_span': [(None, 3, 5)]}, absolute=True),
+        ]
+        doc = parc3.annotated_document.AnnotatedDocument(
+            copy.deepcopy(tokens), copy.deepcopy(sentences))
+        compact_doc = parc3.annotated_document.AnnotatedDocument(
+            copy.deepcopy(tokens), copy.deepcopy(sentences))
+        compact_doc.compact_tokens()
+        self.assertEqual(compact_doc.tokens, doc.tokens)
+
+        span = [(0, 1, 3), (1, 0, 1)]
+        self.assertEqual(compact_doc.get_tokens(span).text(), 'bc d ef')
+        self.assertEqual(
+            compact_doc.get_tokens(span, view=True).text(), 'bc d ef')
+        self.assertIsInstance(doc.get_tokens(span), parc3.token_list.TokenList)
+        self.assertEqual(doc.get_tokens(span, view=True), doc.get_tokens(span))
+
+        doc.split_token(doc.tokens[1], 'b')
+        compact_doc.split_token(compact_doc.tokens[1], 'b')
+        self.assertEqual(compact_doc.tokens, doc.tokens)
+
+
+
+class TestParallelLoading(TestCase):
+
+    def test_parallel_matches_serial(self):
+        serial = list(parc3.data.iter_parc_docs(limit=20))
+        parallel = list(
+            parc3.data.iter_parc_docs(limit=20, processes=4, chunksize=2))
+        self.assertEqual(
+            [doc_num for doc_num, doc in serial],
+            [doc_num for doc_num, doc in parallel]
+        )
+        for (_, serial_doc), (_, parallel_doc) in zip(serial, parallel):
+            self.assertEqual(serial_doc.tokens, parallel_doc.tokens)
+            self.assertEqual(serial_doc.sentences, parallel_doc.sentences)
+            self.assertEqual(
+                serial_doc.annotations, parallel_doc.annotations)
+
+
+
+class TestSavedParcDataset(TestCase):
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.temp_dir, 'dataset')
+
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+
+    def get_test_dataset(self):
+        # Fill in a dataset by hand, rather than building it from articles.
+        dataset = parc3.data.ParcDataset.__new__(parc3.data.ParcDataset)
+        dataset.lazy = False
+        dataset.articles = {1: {'text': 'one'}, 3: {'text': 'three'}}
+        dataset.article_nums = [1, 3]
+        dataset.cues = {'said': [{'doc_num': 3, 'attribution_id': 'a'}]}
+        dataset.contents = {}
+        dataset.sources = {}
+        dataset._attributions = {'a': {'doc_num': 3, 'attribution_id': 'a'}}
+        dataset.index = parc3.attribution_index.AttributionIndex()
+        dataset.index.add(
+            dataset._attributions['a'], {'cue': [{'word': 'said'}]})
+        return dataset
+
+
+    def test_save_and_load(self):
+        self.get_test_dataset().save(self.path)
+        for lazy in (False, True):
+            loaded = parc3.data.ParcDataset(
+                load=self.path, lazy=lazy, max_articles=1)
+
+            # Articles are only read once they are needed.
+            self.assertEqual(len(loaded.articles), 0)
+            self.assertEqual(loaded.articles[3], {'text': 'three'})
+            self.assertEqual(loaded.articles[1], {'text': 'one'})
+            self.assertEqual(len(loaded.articles), 1 if lazy else 2)
+
+            self.assertEqual(loaded.cue_grep('sai'), loaded.cues)
+            self.assertEqual(
+                loaded.query(cue='said'), [loaded._attributions['a']])
+
+
+    def test_build_save_and_load(self):
+        # Article 4 is missing, and is skipped.
+        dataset = parc3.data.ParcDataset(article_nums=[3, 4, 5])
+        self.assertEqual(dataset.article_nums, [3, 5])
+        found = dataset.query(cue='said', source_pos='PRP')
+        self.assertTrue(found)
+        attribution = dataset.get_attribution(**found[0])
+        self.assertEqual(
+            dataset.articles[3].get_tokens(attribution['cue']).text(), 'said')
+
+        dataset.save(self.path)
+        loaded = parc3.data.ParcDataset(load=self.path)
+        self.assertEqual(loaded.article_nums, [3, 5])
+        self.assertEqual(loaded.query(cue='said', source_pos='PRP'), found)
+        self.assertEqual(loaded.cues, dataset.cues)
+        self.assertEqual(loaded.articles[5].tokens, dataset.articles[5].tokens)
+        self.assertEqual(
+            loaded.get_attribution(**found[0]), attribution)
+
+
+    def test_lazy_build(self):
+        # Articles evicted while building are loaded again when needed.
+        for bounds in [{'max_articles': 1}, {'max_tokens': 1}]:
+            dataset = parc3.data.ParcDataset(
+                article_nums=[3, 5, 7], lazy=True, **bounds)
+            self.assertEqual(len(dataset.articles), 1)
+            self.assertEqual(dataset.article_nums, [3, 5, 7])
+            found = dataset.query(cue='said')
+            self.assertEqual(
+                set([back_pointer['doc_num'] for back_pointer in found]),
+                set([3, 5, 7])
+            )
+            attributions = list(dataset.attributions())
+            self.assertEqual(len(attributions), len(dataset._attributions))
+            self.assertEqual(
+                dataset.articles[3].tokens, parc3.data.load_parc_doc(3).tokens)
+            self.assertEqual(len(dataset.articles), 1)
+
+
+    def test_rejects_other_versions(self):
+        self.get_test_dataset().save(self.path)
+        with open(self.path, 'r+b') as saved_file:
+            saved_file.write(parc3.data.DATASET_HEADER.pack(
+                parc3.data.DATASET_MAGIC,
+                parc3.data.DATASET_FORMAT_VERSION + 1, 0, 0
+            ))
+        with self.assertRaises(ValueError):
+            parc3.data.ParcDataset(load=self.path)
+
+
+
+class TestParcCache(TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_cached_doc_matches_parsed_doc(self):
+        parsed_doc = parc3.data.load_parc_doc(3)
+        for i in range(2):
+            cached_doc = parc3.data.load_cached_parc_doc(
+                3, cache_dir=self.cache_dir)
+            self.assertEqual(cached_doc.tokens, parsed_doc.tokens)
+            self.assertEqual(cached_doc.sentences, parsed_doc.sentences)
+            self.assertEqual(cached_doc.annotations, parsed_doc.annotations)
+
+    def test_cache_key(self):
+        parc3.data.load_cached_parc_doc(3, cache_dir=self.cache_dir)
+        parc_path = parc3.data.get_parc_path(3)
+        cache_path = parc3.data.get_parc_cache_path(3, True, self.cache_dir)
+
+        key = parc3.data.get_parc_cache_key(parc_path, True)
+        self.assertIsNotNone(parc3.data.read_parc_cache(cache_path, key))
+
+        # Entries are not shared between nested and unnested documents
+        unnested_key = parc3.data.get_parc_cache_key(parc_path, False)
+        self.assertIsNone(parc3.data.read_parc_cache(cache_path, unnested_key))
+
+        # Entries go stale when the source file changes
+        stale_key = key[:3] + (key[3] - 1,) + key[4:]
+        self.assertIsNone(parc3.data.read_parc_cache(cache_path, stale_key))
+
+    def test_unreadable_entry(self):
+        # An entry pickled against a class that no longer exists is reparsed.
+        parc_path = parc3.data.get_parc_path(3)
+        cache_path = parc3.data.get_parc_cache_path(3, True, self.cache_dir)
+        key = parc3.data.get_parc_cache_key(parc_path, True)
+        with open(cache_path, 'wb') as cache_file:
+            pickle.dump(key, cache_file, pickle.HIGHEST_PROTOCOL)
+            cache_file.write('cparc3.data\nNoSuchClass\n.')
+        self.assertIsNone(parc3.data.read_parc_cache(cache_path, key))
+
+        doc = parc3.data.load_cached_parc_doc(3, cache_dir=self.cache_dir)
+        self.assertEqual(doc.tokens, parc3.data.load_parc_doc(3).tokens)
+        self.assertIsNotNone(parc3.data.read_parc_cache(cache_path, key))
+
+
 
 class TestReadParcFile(TestCase):
 
@@ -239,6 +1401,89 @@ class TestReadParcFile(TestCase):
                     token_ids, 
                 )
 
+    def test_iterparse_backend(self):
+        """
+        Ensure that the streaming backend builds the same document as the
+        BeautifulSoup backend.
+        """
+        path = parc3.data.get_parc_path(3)
+        xml = open(path).read()
+        for include_nested in [True, False]:
+            soup_doc = parc3.parc_reader.read_parc_file(
+                xml, include_nested=include_nested, backend='soup')
+            iterparse_doc = parc3.parc_reader.read_parc_file(
+                xml, include_nested=include_nested, backend='iterparse')
+            self.assertEqual(soup_doc.tokens, iterparse_doc.tokens)
+            self.assertEqual(soup_doc.sentences, iterparse_doc.sentences)
+            self.assertEqual(soup_doc.annotations, iterparse_doc.annotations)
+
+        # Files are streamed from the path, or from an open file.
+        for backend in parc3.parc_reader.PARSER_BACKENDS:
+            path_doc = parc3.parc_reader.read_parc_path(path, backend=backend)
+            with open(path, 'rb') as parc_file:
+                file_doc = parc3.parc_reader.read_parc_file(
+                    parc_file, backend=backend)
+            for doc in [path_doc, file_doc]:
+                self.assertEqual(doc.tokens, soup_doc.tokens)
+                self.assertEqual(doc.annotations, soup_doc.annotations)
+
+        with self.assertRaises(ValueError):
+            parc3.parc_reader.read_parc_file(xml, backend='not-a-backend')
+
+
+    def test_relativize(self):
+        """
+        Ensure that absolute ranges are split across sentence boundaries and
+        addressed relative to their sentences.
+        """
+        # Sentence 1 spans tokens 36 to 68.
+        self.assertEqual(self.doc.sentence_starts[:2], [0, 36])
+        self.assertEqual(
+            self.doc.relativize([(None, 0, 3), (None, 30, 40)]),
+            [(0, 0, 3), (0, 30, 36), (1, 0, 4)]
+        )
+        self.assertEqual(
+            self.doc.relativize([(None, 30, 70)]),
+            [(0, 30, 36), (1, 0, 32), (2, 0, 2)]
+        )
+
+        num_tokens = len(self.doc.tokens)
+        with self.assertRaises(ValueError):
+            self.doc.relativize([(None, num_tokens, num_tokens + 1)])
+        with self.assertRaises(ValueError):
+            self.doc.relativize([(None, num_tokens - 1, num_tokens + 1)])
+
+
+    def test_flatten_constituents(self):
+        """
+        Ensure that a DFS over flattened constituency trees yields the same
+        constituents, with the same keys, at the same depths, as a DFS over
+        the nested trees.
+        """
+        def describe(sentence):
+            return [
+                (depth, sorted([
+                    (key, value) for key, value in node.items()
+                    if key != 'constituent_children'
+                ]), len(node['constituent_children']))
+                for depth, node in parc3.spans.get_dfs_constituents(sentence)
+            ]
+
+        expected = [describe(sentence) for sentence in self.doc.sentences]
+        self.doc.flatten_constituents()
+        for sentence in self.doc.sentences:
+            self.assertNotIn('constituent_children', sentence)
+            self.assertIn('flat_tree', sentence)
+        found = [describe(sentence) for sentence in self.doc.sentences]
+        self.assertEqual(found, expected)
+
+        # Roots follow their sentences when tokens are inserted.
+        self.doc.insert_token(1, {'text': 'inserted'})
+        for sentence in self.doc.sentences:
+            root = parc3.spans.FlatConstituent(sentence['flat_tree'], 0)
+            self.assertEqual(root['token_span'], sentence['token_span'])
+
+
     def test_exclude_nested(self):
         expected_num_nested = 3
         num_nested = len([
@@ -0,0 +1,196 @@
+'''
+Aligns two tokenizations of the same text, so that annotations can be carried
+from the tokens of one onto the tokens of the other.
+'''
+
+from array import array
+
+
+# Snakes (runs of matching characters) are followed this many characters at
+# a time before falling back to single characters.
+SNAKE_STEP = 64
+
+
+def normalize_text(text):
+    """
+    Normalize a token's text for alignment.  The result has exactly one
+    character for each character of `text`.
+    """
+    return text.replace('`', "'").lower()
+
+
+def align_tokens(texts, other_texts):
+    """
+    Align the tokens having `texts` with the tokens having `other_texts`.
+
+    The texts are joined together on each side and aligned character by
+    character (see `align_characters`).  Returns a list with an entry for each
+    token in `texts`, listing the tokens of `other_texts` that it aligns to,
+    in order, as `(other_index, start, end)` triples.  `start` and `end` mark
+    the part of the token's text that goes with that other token, so a token
+    that aligns to several other tokens should be split at those points.
+    Characters that align to nothing go with the other token after them,
+    unless they trail the token.
+
+    Tokens that share no characters with the other side, but that sit in a gap
+    between aligned tokens facing the same number of unaligned other tokens,
+    are paired up with those other tokens one to one.
+    """
+    text, owners, offsets = join_texts(texts)
+    other_text, other_owners, _ = join_texts(other_texts)
+
+    # For each token, the last character of the token that aligns with each
+    # other token.
+    last_aligned = [[] for token_text in texts]
+    for position, other_position in align_characters(text, other_text):
+        index = owners[position]
+        other_index = other_owners[other_position]
+        offset = position - offsets[index]
+        aligned = last_aligned[index]
+        if aligned and aligned[-1][0] == other_index:
+            aligned[-1][1] = offset
+        else:
+            aligned.append([other_index, offset])
+
+    pair_unaligned_gaps(last_aligned, len(other_texts), texts)
+
+    alignments = []
+    for token_text, aligned in zip(texts, last_aligned):
+        alignment = []
+        start = 0
+        for i, (other_index, last_offset) in enumerate(aligned):
+            end = len(token_text) if i == len(aligned) - 1 else last_offset + 1
+            alignment.append((other_index, start, end))
+            start = end
+        alignments.append(alignment)
+
+    return alignments
+
+
+def join_texts(texts):
+    """
+    Join normalized `texts`.  Also return the index of the text that each
+    character came from, and the offset at which each text starts.
+    """
+    owners = array('i')
+    offsets = []
+    offset = 0
+    for index, text in enumerate(texts):
+        offsets.append(offset)
+        owners.extend([index] * len(text))
+        offset += len(text)
+    joined = ''.join([normalize_text(text) for text in texts])
+    return joined, owners, offsets
+
+
+def pair_unaligned_gaps(last_aligned, num_other_tokens, texts):
+    """
+    Pair up tokens that have no aligned characters with other tokens that
+    have none, where they sit in the same gap and there are the same number
+    on each side.  `last_aligned` is updated in place.
+    """
+    aligned_other = set()
+    anchors = [(-1, -1)]
+    for index, aligned in enumerate(last_aligned):
+        for other_index, _ in aligned:
+            aligned_other.add(other_index)
+            anchors.append((index, other_index))
+    anchors.append((len(last_aligned), num_other_tokens))
+
+    for (index, other_index), (next_index, next_other_index) in zip(
+        anchors, anchors[1:]
+    ):
+        gap = [
+            i for i in xrange(index + 1, next_index)
+            if not last_aligned[i]
+        ]
+        other_gap = [
+            i for i in xrange(other_index + 1, next_other_index)
+            if i not in aligned_other
+        ]
+        if gap and len(gap) == len(other_gap):
+            for i, other_i in zip(gap, other_gap):
+                last_aligned[i].append([other_i, len(texts[i]) - 1])
+
+
+def align_characters(text, other_text):
+    """
+    Return the `(position, other_position)` pairs of matching characters in
+    a shortest edit script (insertions and deletions) that turns `text` into
+    `other_text`.  This is Myers' O(ND) diff: the work grows with the
+    length of the texts times the number of edits, so it is close to linear
+    for two tokenizations of the same text.
+    """
+    n, m = len(text), len(other_text)
+    max_edits = n + m
+
+    # furthest[k] is the furthest position reached in `text` on diagonal k
+    # (position - other_position); `trace` keeps the needed part of it before
+    # each round, for backtracking.
+    offset = max_edits + 1
+    furthest = array('i', [0]) * (2 * max_edits + 3)
+    trace = []
+    num_edits = None
+    for edits in xrange(max_edits + 1):
+        trace.append(furthest[offset - edits - 1:offset + edits + 2])
+        for k in xrange(-edits, edits + 1, 2):
+            if k == -edits or (
+                k != edits
+                and furthest[offset + k - 1] < furthest[offset + k + 1]
+            ):
+                position = furthest[offset + k + 1]
+            else:
+                position = furthest[offset + k - 1] + 1
+            other_position = position - k
+            position += common_prefix_length(
+                text, position, other_text, other_position)
+            furthest[offset + k] = position
+            if position >= n and position - k >= m:
+                num_edits = edits
+                break
+        if num_edits is not None:
+            break
+
+    # Backtrack, collecting the diagonal runs of matching characters.
+    matches = []
+    position, other_position = n, m
+    for edits in xrange(num_edits, -1, -1):
+        previous = trace[edits]
+        k = position - other_position
+        get = lambda diagonal: previous[diagonal + edits + 1]
+        if k == -edits or (k != edits and get(k - 1) < get(k + 1)):
+            previous_k = k + 1
+        else:
+            previous_k = k - 1
+        previous_position = get(previous_k)
+        previous_other_position = previous_position - previous_k
+        while (
+            position > previous_position
+            and other_position > previous_other_position
+        ):
+            position -= 1
+            other_position -= 1
+            matches.append((position, other_position))
+        position, other_position = previous_position, previous_other_position
+
+    matches.reverse()
+    return matches
+
+
+def common_prefix_length(text, position, other_text, other_position):
+    start = position
+    n, m = len(text), len(other_text)
+    while (
+        position + SNAKE_STEP <= n and other_position + SNAKE_STEP <= m
+        and text[position:position + SNAKE_STEP]
+            == other_text[other_position:other_position + SNAKE_STEP]
+    ):
+        position += SNAKE_STEP
+        other_position += SNAKE_STEP
+    while (
+        position < n and other_position < m
+        and text[position] == other_text[other_position]
+    ):
+        position += 1
+        other_position += 1
+    return position - start
@@ -1,3 +1,6 @@
+import parc3
+
+
 class TokenList(list):
 
     def __init__(self, tokens=None):
@@ -10,3 +13,81 @@ class TokenList(list):
     def text(self):
         return ' '.join([t['text'] for t in self])
 
+
+
+class TokenListView(object):
+    """
+    The tokens in some ranges of a document's tokens, read straight from the
+    document's token list (or TokenStore) without copying them out.  Supports
+    iteration, indexing, `len` and `text()` like a TokenList, and
+    `TokenList(view)` copies the tokens out when a list is needed.
+
+    `ranges` are `(start, stop)` pairs of absolute token indices.  A view
+    addresses tokens by position, so inserting tokens into the document
+    shifts it onto other tokens.
+    """
+
+    __slots__ = ('tokens', 'ranges')
+
+    def __init__(self, tokens, ranges):
+        self.tokens = tokens
+        self.ranges = [(start, stop) for start, stop in ranges if start < stop]
+
+
+    def __len__(self):
+        return sum([stop - start for start, stop in self.ranges])
+
+
+    def __iter__(self):
+        tokens = self.tokens
+        for start, stop in self.ranges:
+            for index in xrange(start, stop):
+                yield tokens[index]
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return TokenList(list(self)[index])
+
+        if index < 0:
+            index += len(self)
+        if index >= 0:
+            for start, stop in self.ranges:
+                if index < stop - start:
+                    return self.tokens[start + index]
+                index -= stop - start
+        raise IndexError('TokenListView index out of range')
+
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+    def text(self):
+        # A TokenStore joins text straight from its text column.
+        if isinstance(self.tokens, parc3.token_store.TokenStore):
+            return ' '.join([
+                self.tokens.text(start, stop) for start, stop in self.ranges])
+        tokens = self.tokens
+        return ' '.join([
+            tokens[index]['text']
+            for start, stop in self.ranges
+            for index in xrange(start, stop)
+        ])
@@ -0,0 +1,260 @@
+'''
+A columnar alternative to keeping every token of a document as its own dict.
+'''
+
+import parc3
+from array import array
+from collections import MutableMapping
+
+
+class Missing(object):
+    """
+    Marks a token as not having a value for a field in an extra column.  (The
+    class itself is used as the marker, so it survives pickling.)
+    """
+
+
+class TokenStore(object):
+    """
+    Holds a document's tokens column by column.  The string fields in
+    `STRING_FIELDS` are interned, and stored as arrays of integer codes, and
+    the integer fields in `INT_FIELDS` are stored as integer arrays.  Any
+    other field gets a plain list, which is only created once some token has
+    that field.
+
+    A TokenStore behaves like a list of tokens.  Indexing and iterating hand
+    out `TokenView`s, which read and write the columns but otherwise behave
+    like the token dicts that they replace.  A view addresses a position in
+    the store, so inserting tokens before it shifts it onto another token.
+    Slicing gives a TokenList of views, without copying any token data.
+    """
+
+    STRING_FIELDS = ('text', 'lemma', 'pos')
+    INT_FIELDS = ('abs_id', 'id', 'sentence_id')
+
+    # Marks missing values in string and integer columns
+    MISSING_CODE = -1
+
+    def __init__(self, tokens=None):
+        self.num_tokens = 0
+        self.strings = {
+            field: parc3.utils.IncrementingMap()
+            for field in self.STRING_FIELDS
+        }
+        self.columns = {
+            field: array('i') for field in self.STRING_FIELDS + self.INT_FIELDS
+        }
+        self.extra_columns = {}
+        if tokens is not None:
+            self.extend(tokens)
+
+
+    def __len__(self):
+        return self.num_tokens
+
+
+    def __iter__(self):
+        for index in xrange(self.num_tokens):
+            yield TokenView(self, index)
+
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return parc3.token_list.TokenList([
+                TokenView(self, i)
+                for i in xrange(*index.indices(self.num_tokens))
+            ])
+        return TokenView(self, self._check_index(index))
+
+
+    def __setitem__(self, index, token):
+        index = self._check_index(index)
+        row = dict(token)
+        for field in self.get_fields(index):
+            self.del_field(index, field)
+        for field, value in row.items():
+            self.set_field(index, field, value)
+
+
+    def __eq__(self, other):
+        try:
+            return list(self) == list(other)
+        except TypeError:
+            return NotImplemented
+
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        if equal is NotImplemented:
+            return equal
+        return not equal
+
+
+    __hash__ = None
+
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+    def _check_index(self, index):
+        if index < 0:
+            index += self.num_tokens
+        if index < 0 or index >= self.num_tokens:
+            raise IndexError('TokenStore index out of range')
+        return index
+
+
+    def append(self, token):
+        self.insert(self.num_tokens, token)
+
+
+    def extend(self, tokens):
+        for token in tokens:
+            self.append(token)
+
+
+    def insert(self, index, token):
+        """
+        Insert a token, given as a dict or a view, before `index`.  Its
+        values are copied into the columns.
+        """
+        index = max(0, min(index, self.num_tokens))
+        row = dict(token)
+
+        for field in self.STRING_FIELDS:
+            self.columns[field].insert(index, self._encode(field, row))
+        for field in self.INT_FIELDS:
+            self.columns[field].insert(index, self._encode(field, row))
+        for field, column in self.extra_columns.items():
+            column.insert(index, row.pop(field, Missing))
+        self.num_tokens += 1
+
+        # Fields that no token had before get new extra columns
+        for field, value in row.items():
+            if field not in self.columns and field not in self.extra_columns:
+                self.extra_columns[field] = [Missing] * self.num_tokens
+                self.extra_columns[field][index] = value
+
+
+    def _encode(self, field, row):
+        """Pop the value for `field` from `row` and encode it."""
+        if field not in row:
+            return self.MISSING_CODE
+
+        value = row.pop(field)
+        if field in self.strings:
+            strings = self.strings[field]
+            strings.add(value)
+            return strings[value]
+
+        if not isinstance(value, (int, long)) or value < 0:
+            raise ValueError(
+                'Token field "%s" must be a non-negative integer.  Got %s.'
+                % (field, repr(value))
+            )
+        return value
+
+
+    def get_field(self, index, field):
+        if field in self.columns:
+            code = self.columns[field][index]
+            if code == self.MISSING_CODE:
+                raise KeyError(field)
+            if field in self.strings:
+                return self.strings[field].key(code)
+            return code
+
+        if field not in self.extra_columns:
+            raise KeyError(field)
+        value = self.extra_columns[field][index]
+        if value is Missing:
+            raise KeyError(field)
+        return value
+
+
+    def set_field(self, index, field, value):
+        if field in self.columns:
+            self.columns[field][index] = self._encode(field, {field: value})
+        else:
+            if field not in self.extra_columns:
+                self.extra_columns[field] = [Missing] * self.num_tokens
+            self.extra_columns[field][index] = value
+
+
+    def del_field(self, index, field):
+        # Raise KeyError if the field isn't there.
+        self.get_field(index, field)
+        if field in self.columns:
+            self.columns[field][index] = self.MISSING_CODE
+        else:
+            self.extra_columns[field][index] = Missing
+
+
+    def get_fields(self, index):
+        fields = [
+            field for field, column in self.columns.items()
+            if column[index] != self.MISSING_CODE
+        ]
+        fields.extend([
+            field for field, column in self.extra_columns.items()
+            if column[index] is not Missing
+        ])
+        return fields
+
+
+    def text(self, start=0, end=None):
+        """
+        Join the text of tokens `start` to `end` straight from the text
+        column.  Raises KeyError if any of them has no text, as reading their
+        'text' field would.
+        """
+        strings = self.strings['text']
+        texts = []
+        for code in self.columns['text'][start:end]:
+            if code == self.MISSING_CODE:
+                raise KeyError('text')
+            texts.append(strings.key(code))
+        return ' '.join(texts)
+
+
+
+class TokenView(MutableMapping):
+    """
+    The token at one position in a TokenStore.  Reads and writes go to the
+    store's columns.
+    """
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store, index):
+        self.store = store
+        self.index = index
+
+
+    def __getitem__(self, field):
+        return self.store.get_field(self.index, field)
+
+
+    def __setitem__(self, field, value):
+        self.store.set_field(self.index, field, value)
+
+
+    def __delitem__(self, field):
+        self.store.del_field(self.index, field)
+
+
+    def __iter__(self):
+        return iter(self.store.get_fields(self.index))
+
+
+    def __len__(self):
+        return len(self.store.get_fields(self.index))
+
+
+    def copy(self):
+        return dict(self)
+
+
+    def __repr__(self):
+        return repr(dict(self))
@@ -3,6 +3,14 @@ This module contains a couple utility classes used by the ParcCorenlpReader,
 and ParcAnnotatedText.
 '''
 
+import bisect
+import logging
+from array import array
+from collections import deque, OrderedDict, MutableMapping
+
+
+LOGGER = logging.getLogger(__name__)
+
 
 def rangify(iterable):
     '''
@@ -80,6 +88,194 @@ class IncrementingMap(dict):
         return [k for k in self._get_keys()]
 
 
+class LRUCache(MutableMapping):
+    '''
+    A mapping that holds a bounded number of values, and loads missing ones
+    on demand by calling `load(key)`.  Once there are more than `max_items`
+    values, or the values' total size exceeds `max_size`, the least recently
+    used values are evicted, and will be loaded again if they are needed.
+    Sizes are found by calling `get_size(value)`, and only matter if
+    `max_size` is given.  The most recently used value is never evicted.
+    '''
+
+    def __init__(self, load, max_items=None, max_size=None, get_size=None):
+        if max_size is not None and get_size is None:
+            raise ValueError('A max_size needs a get_size function.')
+        self.load = load
+        self.max_items = max_items
+        self.max_size = max_size
+        self.get_size = get_size
+        self.values = OrderedDict()
+        self.sizes = {}
+        self.total_size = 0
+        self.num_loads = 0
+        self.num_evictions = 0
+
+
+    def __getitem__(self, key):
+        try:
+            value = self.values.pop(key)
+        except KeyError:
+            value = self.load(key)
+            self.num_loads += 1
+            self[key] = value
+            return value
+        self.values[key] = value
+        return value
+
+
+    def __setitem__(self, key, value):
+        if key in self.values:
+            del self[key]
+        self.values[key] = value
+        if self.max_size is not None:
+            self.sizes[key] = self.get_size(value)
+            self.total_size += self.sizes[key]
+        self.evict()
+
+
+    def __delitem__(self, key):
+        del self.values[key]
+        self.total_size -= self.sizes.pop(key, 0)
+
+
+    def __contains__(self, key):
+        return key in self.values
+
+
+    def __iter__(self):
+        return iter(self.values)
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def is_full(self):
+        if self.max_items is not None and len(self.values) > self.max_items:
+            return True
+        if self.max_size is not None and self.total_size > self.max_size:
+            return True
+        return False
+
+
+    def evict(self):
+        while len(self.values) > 1 and self.is_full():
+            oldest_key = next(iter(self.values))
+            del self[oldest_key]
+            self.num_evictions += 1
+
+
+
+class IntervalIndex(object):
+    '''
+    Finds which of a set of half-open integer intervals overlap a query
+    interval.  Intervals are built in as `(start, end, value)` triples, and
+    kept sorted by start.  The intervals that start before the query's end
+    are then a prefix of them, and a binary tree holding the greatest end
+    under each node picks out the ones in that prefix that end after the
+    query's start.  A query takes O(log n) time, plus O(log n) for each
+    interval found.
+    '''
+
+    # Marks the leaves of the tree that hold no interval.
+    NO_END = -1
+
+    def __init__(self, intervals=()):
+        intervals = sorted(intervals, key=lambda interval: interval[:2])
+        self.starts = array('i', [start for start, _, _ in intervals])
+        self.ends = array('i', [end for _, end, _ in intervals])
+        self.values = [value for _, _, value in intervals]
+
+        self.num_leaves = 1
+        while self.num_leaves < len(intervals):
+            self.num_leaves *= 2
+        self.max_ends = array('i', [self.NO_END]) * (2 * self.num_leaves)
+        self.max_ends[self.num_leaves:self.num_leaves + len(self.ends)] = (
+            self.ends)
+        for node in xrange(self.num_leaves - 1, 0, -1):
+            self.max_ends[node] = max(
+                self.max_ends[2*node], self.max_ends[2*node + 1])
+
+
+    def __len__(self):
+        return len(self.values)
+
+
+    def overlapping(self, start, end):
+        '''
+        Return the values of intervals overlapping `[start, end)`, in order of
+        their start.
+        '''
+        stop = bisect.bisect_left(self.starts, end)
+        found = []
+
+        # Each node of the tree covers the leaves `[first, last)`.
+        stack = [(1, 0, self.num_leaves)]
+        while stack:
+            node, first, last = stack.pop()
+            if first >= stop or self.max_ends[node] <= start:
+                continue
+            if node >= self.num_leaves:
+                found.append(self.values[first])
+                continue
+            middle = (first + last) / 2
+            stack.append((2*node + 1, middle, last))
+            stack.append((2*node, first, middle))
+
+        return found
+
+
+    def containing(self, position):
+        '''Return the values of intervals that contain `position`.'''
+        return self.overlapping(position, position + 1)
+
+
+    def remap(self, function):
+        '''
+        Move every endpoint `x` to `function(x)`.  The function must never
+        decrease, so that the intervals stay in order, and the greatest end
+        under each node stays the greatest.
+        '''
+        for endpoints in (self.starts, self.ends, self.max_ends):
+            for i, x in enumerate(endpoints):
+                if x != self.NO_END:
+                    endpoints[i] = function(x)
+
+
+
+class FenwickTree(object):
+    '''
+    Keeps a sequence of integers, all zero to begin with, such that adding to
+    one of them, and summing a prefix of them, each take O(log n) time.
+    '''
+
+    def __init__(self, size):
+        self.size = size
+        self.tree = array('i', [0]) * (size + 1)
+
+
+    def __len__(self):
+        return self.size
+
+
+    def add(self, index, amount):
+        index += 1
+        while index <= self.size:
+            self.tree[index] += amount
+            index += index & -index
+
+
+    def prefix_sum(self, stop):
+        '''Return the sum of the values at indices below `stop`.'''
+        total = 0
+        while stop > 0:
+            total += self.tree[stop]
+            stop -= stop & -stop
+        return total
+
+
+
 def get_span(sentence, start, stop):
     return sentence['tokens'][start:stop]
 
@@ -112,19 +308,81 @@ def get_spans(sentence, spans, elipsis=True):
         try:
             tokens.extend(get_span(sentence, *span))
         except TypeError:
-            print span
+            LOGGER.debug('could not get span %s', span)
             raise
 
     return tokens
 
 
 # CONSTITUENCY-RELATED FUNCTIONS
+TRAVERSAL_ORDERS = ('pre', 'post', 'level')
+
+def iter_tree(node, get_children, order='pre', prune=None, max_depth=None):
+    '''
+    Lazily walk the tree under `node`, yielding `(depth, node)` pairs one at a
+    time, with the root at depth 0.  `order` is 'pre' or 'post' for a
+    depth-first pre-order or post-order traversal, or 'level' for a
+    breadth-first traversal.  The traversal keeps its own stack (or queue),
+    so deep trees don't run into the recursion limit.
+
+    If given, `prune(depth, node)` is called for each node, and if it
+    returns True, that node is still yielded but its children are not
+    visited.  Nodes deeper than `max_depth` are not visited.
+    '''
+    if order not in TRAVERSAL_ORDERS:
+        raise ValueError(
+            'order must be one of %s.  Got %s.'
+            % (', '.join(TRAVERSAL_ORDERS), repr(order))
+        )
+
+    def expand(depth, node):
+        if max_depth is not None and depth >= max_depth:
+            return []
+        if prune is not None and prune(depth, node):
+            return []
+        return get_children(node)
+
+    if order == 'level':
+        queue = deque([(0, node)])
+        while queue:
+            depth, node = queue.popleft()
+            yield depth, node
+            queue.extend([(depth+1, child) for child in expand(depth, node)])
+
+    elif order == 'pre':
+        stack = [(0, node)]
+        while stack:
+            depth, node = stack.pop()
+            yield depth, node
+            children = expand(depth, node)
+            stack.extend([(depth+1, child) for child in reversed(children)])
+
+    else:
+        # Each node goes on the stack twice: first to push its children, and
+        # then, once they have all been yielded, to be yielded itself.
+        stack = [(0, node, False)]
+        while stack:
+            depth, node, expanded = stack.pop()
+            if expanded:
+                yield depth, node
+                continue
+            stack.append((depth, node, True))
+            children = expand(depth, node)
+            stack.extend([
+                (depth+1, child, False) for child in reversed(children)])
+
+
 def get_dfs_sequence(node, get_children, sequence=None, depth=0):
+    """
+    Append `(depth, node)` pairs for the tree under `node` to `sequence`, in
+    depth-first pre-order, starting at `depth`.  Returns `sequence`.
+    """
     if sequence is None:
         sequence = []
-    sequence.append((depth, node))
-    for child in get_children(node):
-        get_dfs_sequence(child, get_children, sequence, depth+1)
+    sequence.extend([
+        (depth + node_depth, tree_node)
+        for node_depth, tree_node in iter_tree(node, get_children)
+    ])
     return sequence
 
 